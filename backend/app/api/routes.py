@@ -1,17 +1,21 @@
+import asyncio
 import hashlib
 import json
 import logging
 import math
 import os
+import time
 import uuid
 import zipfile
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 
 from fastapi import APIRouter, Depends, UploadFile, HTTPException
-from fastapi.responses import FileResponse, Response
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from starlette.requests import Request
 from PIL import Image
+import aiofiles
 import io
 
 from app.config import settings, ensure_user_dirs
@@ -22,6 +26,7 @@ from app.models.schemas import (
     CornersResponse,
     TraceRequest,
     TraceResponse,
+    TraceStatusResponse,
     PolygonsRequest,
     GenerateRequest,
     GenerateResponse,
@@ -47,18 +52,46 @@ from app.models.schemas import (
     BinListResponse,
     BinUpdateRequest,
     CreateBinRequest,
+    Layout,
+    TilePyramid,
+    UploadBlob,
+    PolygonPatchRequest,
+    BinPatchRequest,
 )
 from app.constants import GF_GRID
-from app.services.image_processor import ImageProcessor
-from app.services.ai_tracer import AITracer
+from app.services.image_processor import ImageProcessor, DEBUG_STAGES, detection_stats
+from app.services.image_cache import image_cache
+from app.services.debug_cache import DebugStageCache
+from app.services.mask_cache import mask_cache
+from app.services.gemini_client import GeminiClientPool
+from app.services.gemini_payload import payload_cache
+from app.services.gemini_scheduler import GeminiScheduler, GeminiRateLimited
+from app.services.hedging import Hedger
+from app.services.circuit_breaker import CircuitBreaker, CircuitOpen
+from app.services.mask_align import align_stats
+from app.services.ai_tracer import AITracer, polygon_from_rings
 from app.services.polygon_scaler import PolygonScaler, ScaledPolygon, ScaledFingerHole
 from app.services.stl_generator_manifold import ManifoldSTLGenerator
 from app.services.session_store import SessionStore
 from app.services.tool_store import ToolStore
 from app.services.bin_store import BinStore
-from app.services.bin_service import sync_placed_tools
+from app.services.blob_store import BlobStore
+from app.services.bin_service import sync_placed_tools, sync_bins
 from app.services.image_service import generate_tool_thumbnail
+from app.services.layout_ops import apply_polygon_ops, apply_placed_tool_ops
+from app.services.usage_store import UsageStore, file_size
+from app.services.janitor import Janitor
+from app.services.ingest import normalize_upload
+from app.services.tile_pyramid import build_pyramid, pyramid_version, remove_pyramids
+from app.services.output_manifest import (
+    OutputManifest,
+    manifest_path,
+    read_manifest,
+    write_manifest,
+    remove_outputs,
+)
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 # register heif/heic support with pillow
 try:
@@ -83,12 +116,24 @@ def get_stores(user_id: str) -> tuple[SessionStore, ToolStore, BinStore]:
     return _store_cache[user_id]
 
 
+_blob_stores: dict[str, BlobStore] = {}
+
+
+def get_blob_store(user_id: str) -> BlobStore:
+    if user_id not in _blob_stores:
+        user_path = settings.storage_path / user_id
+        ensure_user_dirs(user_path)
+        _blob_stores[user_id] = BlobStore(user_path)
+    return _blob_stores[user_id]
+
+
 def _user_path(user_id: str) -> Path:
     return settings.storage_path / user_id
 
 
 ALLOWED_IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic", ".heif"}
 HEIC_EXTENSIONS = {".heic", ".heif"}
+UPLOAD_CHUNK = 1024 * 1024
 
 
 def _convert_heic_to_jpeg(content: bytes, original_ext: str) -> tuple[bytes, str]:
@@ -102,9 +147,53 @@ def _convert_heic_to_jpeg(content: bytes, original_ext: str) -> tuple[bytes, str
 
 
 image_processor = ImageProcessor()
-ai_tracer = AITracer(model=settings.gemini_image_model)
+debug_cache = DebugStageCache(image_processor, settings.debug_cache_ttl_s, settings.debug_max_dim)
+gemini_pool = GeminiClientPool(settings.gemini_workers, base_url=settings.gemini_base_url)
+gemini_scheduler = GeminiScheduler(settings.gemini_max_concurrent, max_retries=settings.gemini_max_retries)
+mask_hedger = Hedger(settings.gemini_hedge_percentile, settings.gemini_hedge_budget)
+gemini_breaker = CircuitBreaker(settings.gemini_breaker_failures, settings.gemini_breaker_reset_s)
+ai_tracer = AITracer(
+    model=settings.gemini_image_model,
+    gemini=gemini_pool,
+    scheduler=gemini_scheduler,
+    hedger=mask_hedger,
+    breaker=gemini_breaker,
+    aligner=settings.mask_aligner,
+)
 polygon_scaler = PolygonScaler()
 stl_generator = ManifoldSTLGenerator()
+usage_store = UsageStore(settings.storage_path)
+janitor = Janitor(
+    settings.storage_path,
+    get_stores,
+    usage_store,
+    get_blob_store=get_blob_store,
+    grace_s=settings.janitor_grace_s,
+    debug_max_age_s=settings.janitor_debug_max_age_s,
+    mask_max_age_s=settings.janitor_mask_max_age_s,
+    outputs_max_bytes=settings.janitor_outputs_max_mb * 1024 * 1024,
+)
+# decode/heic/corner detection for new uploads and tile pyramid builds. kept
+# apart from the corner strategy pool, which detection itself submits to.
+ingest_pool = ThreadPoolExecutor(
+    max_workers=settings.ingest_workers or os.cpu_count() or 2, thread_name_prefix="ingest"
+)
+
+
+def _unlink(path: str | Path | None) -> int:
+    """delete a file if present. returns bytes freed."""
+    if not path:
+        return 0
+    size = file_size(path)
+    Path(path).unlink(missing_ok=True)
+    return size
+
+
+def _check_quota(user_id: str, incoming: int = 0):
+    if not settings.user_quota_mb:
+        return
+    if usage_store.get(user_id) + incoming > settings.user_quota_mb * 1024 * 1024:
+        raise HTTPException(status_code=413, detail=f"storage quota exceeded (max {settings.user_quota_mb}MB)")
 
 
 def _rel(abs_path: str | Path, user_path: Path) -> str:
@@ -134,6 +223,18 @@ def _translate_finger_holes(holes: list[FingerHole], dx: float, dy: float) -> li
     ]
 
 
+def _manifest_response(manifest: OutputManifest, user_id: str) -> GenerateResponse:
+    base = f"/storage/{user_id}/outputs"
+    stl_urls = [f"{base}/{name}" for name in manifest.parts]
+    return GenerateResponse(
+        stl_url=f"{base}/{manifest.stl}",
+        stl_urls=stl_urls,
+        threemf_url=f"{base}/{manifest.threemf}" if manifest.threemf else None,
+        split_count=max(1, len(stl_urls)),
+        zip_url=f"{base}/{manifest.zip}" if manifest.zip else None,
+    )
+
+
 def _run_generate(
     scaled: list[ScaledPolygon],
     gen_req: GenerateRequest,
@@ -143,59 +244,160 @@ def _run_generate(
     user_id: str,
 ) -> GenerateResponse:
     """shared STL generation with caching, splitting, and zipping"""
-    output_path = user_path / "outputs" / f"{entity_id}.stl"
-    hash_path = user_path / "outputs" / f"{entity_id}.hash"
-    threemf_path = user_path / "outputs" / f"{entity_id}.3mf"
-    zip_path = user_path / "outputs" / f"{entity_id}_parts.zip"
-
-    if output_path.exists() and hash_path.exists() and hash_path.read_text() == input_hash:
-        part_paths = sorted(user_path.glob(f"outputs/{entity_id}_part*.stl"))
-        stl_urls = [f"/storage/{user_id}/outputs/{p.name}" for p in part_paths]
-        return GenerateResponse(
-            stl_url=f"/storage/{user_id}/outputs/{entity_id}.stl",
-            stl_urls=stl_urls,
-            threemf_url=f"/storage/{user_id}/outputs/{entity_id}.3mf" if threemf_path.exists() else None,
-            split_count=max(1, len(stl_urls)),
-            zip_url=f"/storage/{user_id}/outputs/{entity_id}_parts.zip" if zip_path.exists() else None,
-        )
+    outputs_dir = user_path / "outputs"
+    output_path = outputs_dir / f"{entity_id}.stl"
+    threemf_path = outputs_dir / f"{entity_id}.3mf"
+    zip_path = outputs_dir / f"{entity_id}_parts.zip"
 
-    threemf_path.unlink(missing_ok=True)
-    for old in user_path.glob(f"outputs/{entity_id}_part*.stl"):
-        old.unlink(missing_ok=True)
-    zip_path.unlink(missing_ok=True)
+    # cache hit is answered from the manifest alone, no directory scans
+    manifest = read_manifest(outputs_dir, entity_id)
+    if manifest and manifest.input_hash == input_hash:
+        return _manifest_response(manifest, user_id)
 
+    freed = remove_outputs(outputs_dir, entity_id)
+    timings: dict[str, float] = {}
+
+    t0 = time.perf_counter()
     bin_body, text_body = stl_generator.generate_bin(scaled, gen_req, str(output_path), str(threemf_path))
+    timings["generate"] = time.perf_counter() - t0
 
-    stl_urls: list[str] = []
-    zip_url = None
+    part_paths: list[str] = []
     if gen_req.bed_size > 0:
-        output_dir = str(user_path / "outputs")
-        part_paths = stl_generator.split_bin(bin_body, text_body, gen_req, gen_req.bed_size, output_dir, entity_id)
+        t0 = time.perf_counter()
+        part_paths = stl_generator.split_bin(bin_body, text_body, gen_req, gen_req.bed_size, str(outputs_dir), entity_id)
+        timings["split"] = time.perf_counter() - t0
         if part_paths:
-            stl_urls = [f"/storage/{user_id}/outputs/{Path(p).name}" for p in part_paths]
+            t0 = time.perf_counter()
             part_bytes = [(Path(p).name, Path(p).read_bytes()) for p in part_paths]
             with zipfile.ZipFile(str(zip_path), 'w', zipfile.ZIP_DEFLATED) as zf:
                 for fname, data in part_bytes:
                     zf.writestr(fname, data)
-            zip_url = f"/storage/{user_id}/outputs/{entity_id}_parts.zip"
+            timings["zip"] = time.perf_counter() - t0
+
+    manifest = OutputManifest(
+        input_hash=input_hash,
+        stl=output_path.name,
+        parts=[Path(p).name for p in part_paths],
+        threemf=threemf_path.name if threemf_path.exists() else None,
+        zip=zip_path.name if part_paths else None,
+        timings={k: round(v, 3) for k, v in timings.items()},
+        created_at=datetime.utcnow().isoformat(),
+    )
+    manifest.sizes = {name: file_size(outputs_dir / name) for name in manifest.files()}
+    write_manifest(outputs_dir, entity_id, manifest)
 
-    hash_path.write_text(input_hash)
+    written = sum(manifest.sizes.values()) + file_size(manifest_path(outputs_dir, entity_id))
+    usage_store.add(user_id, written - freed)
 
-    threemf_url = None
-    if threemf_path.exists():
-        threemf_url = f"/storage/{user_id}/outputs/{entity_id}.3mf"
+    return _manifest_response(manifest, user_id)
 
-    return GenerateResponse(
-        stl_url=f"/storage/{user_id}/outputs/{entity_id}.stl",
-        stl_urls=stl_urls,
-        threemf_url=threemf_url,
-        split_count=max(1, len(stl_urls)),
-        zip_url=zip_url,
+
+def _release_upload(user_id: str, rel_path: str | None) -> int:
+    """delete an uploaded image unless another session or an upload still in
+    flight shares it. returns bytes freed."""
+    if not rel_path:
+        return 0
+    user_sessions, _, _ = get_stores(user_id)
+    # per-session uploads from before content addressing have no blob entry
+    # and are just unlinked
+    return get_blob_store(user_id).discard(
+        Path(rel_path).stem,
+        Path(_abs(rel_path)),
+        lambda: any(s.original_image_path == rel_path for s in user_sessions.all().values()),
     )
 
 
-@router.post("/upload", response_model=UploadResponse)
-async def upload_image(request: Request, image: UploadFile, user_id: str = Depends(get_user_id)):
+def _ingest_upload(user_id: str, session_id: str, raw_path: Path, digest: str):
+    """normalize a streamed upload into its content-addressed blob and detect
+    paper corners, once per blob. runs on ingest_pool; the outcome lands on
+    the session's upload_status. releases the blob hold _store_upload took."""
+    user_sessions, _, _ = get_stores(user_id)
+    blobs = get_blob_store(user_id)
+    up = _user_path(user_id)
+    blob_path = up / "uploads" / f"{digest}.jpg"
+    image_path = raw_path
+    corner_points = None
+    error = None
+    try:
+        raw_size = file_size(raw_path)
+        if blob_path.exists():
+            # an identical upload got here first
+            usage_store.add(user_id, -_unlink(raw_path))
+        else:
+            # primes the decoded-image cache for detection and later steps
+            normalize_upload(
+                raw_path,
+                blob_path,
+                max_pixels=int(settings.ingest_max_megapixels * 1_000_000),
+                quality=settings.ingest_jpeg_quality,
+            )
+            usage_store.add(user_id, file_size(blob_path) - raw_size)
+        image_path = blob_path
+
+        blob = blobs.get(digest)
+        if blob:
+            corner_points = blob.corners
+        else:
+            corners = image_processor.detect_paper_corners(str(blob_path))
+            corner_points = [Point(x=c[0], y=c[1]) for c in corners] if corners else None
+            blobs.set(digest, UploadBlob(
+                path=_rel(blob_path, up),
+                corners=corner_points,
+                created_at=datetime.utcnow().isoformat(),
+            ))
+    except Exception:
+        logger.exception("failed to process upload %s", session_id)
+        error = "could not read image"
+
+    session = user_sessions.get(session_id)
+    if session is not None and not error:
+        session.upload_status = "ready"
+        session.original_image_path = _rel(image_path, up)
+        session.corners = corner_points
+        user_sessions.set(session_id, session)
+    # the session points at the blob now (or never will), so another
+    # session's deletion may decide for itself whether it's still used
+    blobs.release(digest)
+    if session is None or error:
+        # deleted while we were working, or nothing worth keeping
+        if image_path == raw_path:
+            usage_store.add(user_id, -_unlink(raw_path))
+        else:
+            usage_store.add(user_id, -_release_upload(user_id, _rel(image_path, up)))
+    if session is not None and error:
+        session.upload_status = "failed"
+        session.upload_error = error
+        user_sessions.set(session_id, session)
+
+
+def _build_tiles(user_id: str, session_id: str, corrected_path: str):
+    """build the deep-zoom pyramid for a corrected image. runs on ingest_pool."""
+    user_sessions, _, _ = get_stores(user_id)
+    up = _user_path(user_id)
+    tiles_dir = up / "tiles" / session_id
+    try:
+        info, written = build_pyramid(corrected_path, tiles_dir)
+    except Exception:
+        logger.exception("failed to build tiles for %s", session_id)
+        info, written = None, 0
+
+    freed = 0
+    session = user_sessions.get(session_id)
+    if session is None:
+        freed = remove_pyramids(tiles_dir)
+    elif info and _abs(session.corrected_image_path) == corrected_path \
+            and pyramid_version(corrected_path) == info["version"]:
+        session.tiles = TilePyramid(path=_rel(tiles_dir / info["version"], up), **info)
+        user_sessions.set(session_id, session)
+        freed = remove_pyramids(tiles_dir, keep=info["version"])
+    # otherwise corners changed again meanwhile; the newer build cleans up
+    usage_store.add(user_id, written - freed)
+
+
+async def _store_upload(user_id: str, image: UploadFile) -> tuple[str, Future | None]:
+    """validate one upload, stream it to disk and create its session. returns
+    the session id and its ingest future, or None for the future when an
+    identical earlier upload already answered it."""
     if not image.content_type or not image.content_type.startswith("image/"):
         raise HTTPException(status_code=400, detail="file must be an image")
 
@@ -208,49 +410,140 @@ async def upload_image(request: Request, image: UploadFile, user_id: str = Depen
         raise HTTPException(status_code=400, detail="unsupported image format")
 
     max_bytes = settings.max_upload_mb * 1024 * 1024
-    content = await image.read()
-    if len(content) > max_bytes:
+    if image.size is not None and image.size > max_bytes:
         raise HTTPException(status_code=413, detail=f"file too large (max {settings.max_upload_mb}MB)")
+    _check_quota(user_id, image.size or 0)
+
+    # stream to disk in chunks rather than holding the whole file in memory
+    raw_path = up / "uploads" / f"{session_id}{ext}"
+    written = 0
+    hasher = hashlib.sha256()
+    try:
+        async with aiofiles.open(raw_path, "wb") as f:
+            while chunk := await image.read(UPLOAD_CHUNK):
+                written += len(chunk)
+                if written > max_bytes:
+                    raise HTTPException(status_code=413, detail=f"file too large (max {settings.max_upload_mb}MB)")
+                hasher.update(chunk)
+                await f.write(chunk)
+    except BaseException:
+        raw_path.unlink(missing_ok=True)
+        raise
+    usage_store.add(user_id, written)
+    digest = hasher.hexdigest()
+
+    # hold the blob until a session points at it, so deleting another
+    # session that shares it can't remove it in between
+    blobs = get_blob_store(user_id)
+    blobs.acquire(digest)
+    blob = blobs.get(digest)
+    if blob and (settings.storage_path / blob.path).exists():
+        # same photo as an earlier upload: share its image and corners
+        try:
+            usage_store.add(user_id, -_unlink(raw_path))
+            user_sessions.set(session_id, Session(
+                id=session_id,
+                created_at=datetime.utcnow().isoformat(),
+                upload_status="ready",
+                original_image_path=blob.path,
+                corners=blob.corners,
+            ))
+        finally:
+            blobs.release(digest)
+        return session_id, None
 
-    content, ext = _convert_heic_to_jpeg(content, ext)
-    image_path = up / "uploads" / f"{session_id}{ext}"
-    image_path.write_bytes(content)
+    try:
+        user_sessions.set(session_id, Session(
+            id=session_id,
+            created_at=datetime.utcnow().isoformat(),
+            upload_status="processing",
+        ))
+        return session_id, ingest_pool.submit(_ingest_upload, user_id, session_id, raw_path, digest)
+    except BaseException:
+        blobs.release(digest)
+        raise
 
-    corners = image_processor.detect_paper_corners(str(image_path))
-    corner_points = [Point(x=c[0], y=c[1]) for c in corners] if corners else None
 
-    user_sessions.set(session_id, Session(
-        id=session_id,
-        created_at=datetime.utcnow().isoformat(),
-        original_image_path=_rel(image_path, up),
-        corners=corner_points,
-    ))
-
-    return UploadResponse(
-        session_id=session_id,
-        image_url=f"/storage/{user_id}/uploads/{session_id}{ext}",
-        detected_corners=corner_points,
-    )
+@router.post("/upload", response_model=UploadResponse)
+async def upload_image(request: Request, image: UploadFile, user_id: str = Depends(get_user_id)):
+    session_id, ingest = await _store_upload(user_id, image)
+    return UploadResponse(session_id=session_id, status="processing" if ingest else "ready")
+
+
+def _batch_line(index: int, filename: str | None, session_id: str | None = None,
+                status: str = "failed", error: str | None = None) -> bytes:
+    return (json.dumps({
+        "index": index,
+        "filename": filename,
+        "session_id": session_id,
+        "status": status,
+        "error": error,
+    }) + "\n").encode()
+
+
+@router.post("/upload/batch")
+async def upload_batch(request: Request, images: list[UploadFile], user_id: str = Depends(get_user_id)):
+    """one session per image. files are stored up front, then ingest runs on
+    the shared pool and one ndjson line is streamed per image as it settles."""
+    if len(images) > settings.max_batch_files:
+        raise HTTPException(status_code=400, detail=f"too many files (max {settings.max_batch_files})")
+
+    user_sessions, _, _ = get_stores(user_id)
+    settled: list[bytes] = []
+    pending: dict[asyncio.Future, tuple[int, str | None, str]] = {}
+    for i, image in enumerate(images):
+        try:
+            session_id, ingest = await _store_upload(user_id, image)
+        except HTTPException as e:
+            settled.append(_batch_line(i, image.filename, error=e.detail))
+            continue
+        if ingest is None:
+            settled.append(_batch_line(i, image.filename, session_id, "ready"))
+        else:
+            pending[asyncio.wrap_future(ingest)] = (i, image.filename, session_id)
+
+    async def lines():
+        for line in settled:
+            yield line
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for fut in done:
+                i, filename, session_id = pending.pop(fut)
+                session = user_sessions.get(session_id)
+                if session is None:
+                    yield _batch_line(i, filename, session_id, error="session deleted")
+                else:
+                    yield _batch_line(i, filename, session_id, session.upload_status, session.upload_error)
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
 
 
 @router.post("/sessions/{session_id}/corners", response_model=CornersResponse)
 async def set_corners(request: Request, session_id: str, req: CornersRequest, user_id: str = Depends(get_user_id)):
     user_sessions, _, _ = get_stores(user_id)
     session = user_sessions.get(session_id)
+    if session and session.upload_status == "processing":
+        raise HTTPException(status_code=409, detail="image is still processing")
     if not session or not session.original_image_path:
         raise HTTPException(status_code=404, detail="session not found")
 
     corners = [(p.x, p.y) for p in req.corners]
-    output_path, scale_factor = image_processor.apply_perspective_correction(
-        _abs(session.original_image_path), corners, req.paper_size
+    previous = file_size(_abs(session.corrected_image_path))
+    output_path, scale_factor = await asyncio.to_thread(
+        image_processor.apply_perspective_correction,
+        _abs(session.original_image_path), corners, req.paper_size,
+        settings.warp_max_margin_mm, session_id, settings.warp_max_megapixels,
     )
+    usage_store.add(user_id, file_size(output_path) - previous)
 
     up = _user_path(user_id)
     session.corrected_image_path = _rel(output_path, up)
     session.corners = req.corners
     session.paper_size = req.paper_size
     session.scale_factor = scale_factor
+    session.tiles = None
     user_sessions.set(session_id, session)
+    ingest_pool.submit(_build_tiles, user_id, session_id, output_path)
 
     return CornersResponse(
         corrected_image_url=f"/storage/{session.corrected_image_path}",
@@ -274,17 +567,38 @@ async def trace_tools(request: Request, session_id: str, req: TraceRequest, user
         raise HTTPException(status_code=400, detail="must set corners first")
 
     api_key = settings.google_api_key or req.api_key
-    if not api_key:
+    if not api_key and req.provider == "google":
         raise HTTPException(status_code=400, detail="no api key provided")
 
     up = _user_path(user_id)
     mask_output_path = str(up / "processed" / f"{session_id}_mask.png")
+    previous = file_size(mask_output_path)
 
     try:
         polygons, mask_path = await ai_tracer.trace_tools(
             _abs(session.corrected_image_path),
             api_key,
             mask_output_path,
+            mask_cache_dir=up / "masks",
+            refresh=req.refresh,
+            user_id=user_id,
+            ticket=_trace_ticket(user_id, session_id),
+            provider=req.provider,
+            on_cached=lambda written: usage_store.add(user_id, written),
+        )
+    except CircuitOpen as e:
+        raise HTTPException(
+            status_code=503,
+            detail="Gemini is failing right now, not sending requests for a moment. Try again shortly.",
+            headers={"Retry-After": str(max(1, round(e.retry_in)))},
+        )
+    except GeminiRateLimited as e:
+        if "billing" in str(e).lower():
+            raise HTTPException(status_code=402, detail="API quota exceeded - check your billing")
+        raise HTTPException(
+            status_code=429,
+            detail="Gemini is rate limiting requests - try again shortly",
+            headers={"Retry-After": str(max(1, round(e.retry_after)))},
         )
     except TimeoutError:
         logging.warning("gemini timed out after 60s")
@@ -301,6 +615,7 @@ async def trace_tools(request: Request, session_id: str, req: TraceRequest, user
         detail = f"AI tracing failed ({type(e).__name__}: {error_msg[:200]})"
         raise HTTPException(status_code=500, detail=detail)
 
+    usage_store.add(user_id, file_size(mask_path) - previous)
     session.polygons = polygons
     session.mask_image_path = _rel(mask_path, up) if mask_path else None
     user_sessions.set(session_id, session)
@@ -312,6 +627,19 @@ async def trace_tools(request: Request, session_id: str, req: TraceRequest, user
     return TraceResponse(polygons=polygons, mask_url=mask_url)
 
 
+def _trace_ticket(user_id: str, session_id: str) -> str:
+    return f"{user_id}:{session_id}"
+
+
+@router.get("/sessions/{session_id}/trace-status", response_model=TraceStatusResponse)
+async def trace_status(session_id: str, user_id: str = Depends(get_user_id)):
+    """where this session's gemini calls are in the queue while a trace is running"""
+    position = gemini_scheduler.position(_trace_ticket(user_id, session_id))
+    if position is None:
+        return TraceStatusResponse()
+    return TraceStatusResponse(**position)
+
+
 @router.post("/sessions/{session_id}/trace-mask", response_model=TraceResponse)
 async def trace_from_mask(request: Request, session_id: str, mask: UploadFile, user_id: str = Depends(get_user_id)):
     """trace contours from a user-uploaded mask image"""
@@ -331,20 +659,20 @@ async def trace_from_mask(request: Request, session_id: str, mask: UploadFile, u
         raise HTTPException(status_code=400, detail="unsupported image format")
     content, mask_ext = _convert_heic_to_jpeg(content, mask_ext)
     mask_path = up / "processed" / f"{session_id}_mask.png"
+    previous_mask = file_size(mask_path)
+    _check_quota(user_id, len(content) - previous_mask)
     mask_path.write_bytes(content)
+    usage_store.add(user_id, len(content) - previous_mask)
 
-    contours = ai_tracer._trace_mask(str(mask_path), _abs(session.corrected_image_path))
+    contours = await asyncio.to_thread(ai_tracer._trace_mask, str(mask_path), _abs(session.corrected_image_path))
 
     if not contours:
         raise HTTPException(status_code=400, detail="no tool outlines found in mask")
 
-    polygons = []
-    for i, contour in enumerate(contours):
-        polygons.append(Polygon(
-            id=str(uuid.uuid4()),
-            points=[Point(x=p[0], y=p[1]) for p in contour],
-            label=f"tool {i + 1}",
-        ))
+    polygons = [
+        polygon_from_rings(exterior, holes, f"tool {i + 1}")
+        for i, (exterior, holes) in enumerate(contours)
+    ]
 
     session.polygons = polygons
     session.mask_image_path = _rel(mask_path, up)
@@ -368,6 +696,31 @@ async def update_polygons(request: Request, session_id: str, req: PolygonsReques
     return StatusResponse(status="ok")
 
 
+@router.patch("/sessions/{session_id}/polygons", response_model=StatusResponse)
+async def patch_polygons(request: Request, session_id: str, req: PolygonPatchRequest, user_id: str = Depends(get_user_id)):
+    """apply incremental polygon/finger hole ops to session polygons or layout"""
+    user_sessions, _, _ = get_stores(user_id)
+    session = user_sessions.get(session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="session not found")
+
+    layout = session.layout or Layout()
+    current = layout.polygons if req.target == "layout" else (session.polygons or [])
+    try:
+        updated = apply_polygon_ops(current, req.ops)
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    if req.target == "layout":
+        session.layout = layout.model_copy(update={"polygons": updated})
+    else:
+        session.polygons = updated
+    user_sessions.set(session_id, session)
+    return StatusResponse(status="ok")
+
+
 @router.post("/sessions/{session_id}/generate", response_model=GenerateResponse)
 def generate_stl(request: Request, session_id: str, req: GenerateRequest, user_id: str = Depends(get_user_id)):
     user_sessions, _, _ = get_stores(user_id)
@@ -381,6 +734,7 @@ def generate_stl(request: Request, session_id: str, req: GenerateRequest, user_i
         raise HTTPException(status_code=400, detail="no polygons to generate from")
 
     input_hash = hashlib.md5(json.dumps(req.model_dump(), sort_keys=True, default=str).encode()).hexdigest()
+    _check_quota(user_id)
 
     scaled = polygon_scaler.scale_to_mm(polygons, session.scale_factor)
     scaled = [polygon_scaler.add_clearance(p, req.cutout_clearance) for p in scaled]
@@ -460,46 +814,58 @@ async def delete_session(request: Request, session_id: str, user_id: str = Depen
     if not session:
         raise HTTPException(status_code=404, detail="session not found")
 
+    freed = _release_upload(user_id, session.original_image_path)
     for rel in [
-        session.original_image_path,
         session.corrected_image_path,
-        session.stl_path,
+        session.mask_image_path,
     ]:
-        p = _abs(rel)
-        if p:
-            Path(p).unlink(missing_ok=True)
+        freed += _unlink(_abs(rel))
+    freed += remove_outputs(up / "outputs", session_id)
+    freed += remove_pyramids(up / "tiles" / session_id)
 
-    if session.stl_path:
-        Path(_abs(session.stl_path)).with_suffix(".3mf").unlink(missing_ok=True)
-        for part_file in up.glob(f"outputs/{session_id}_part*.stl"):
-            part_file.unlink(missing_ok=True)
-        zip_path = up / "outputs" / f"{session_id}_parts.zip"
-        zip_path.unlink(missing_ok=True)
+    debug_dir = up / "debug" / session_id
+    if debug_dir.is_dir():
+        for f in debug_dir.iterdir():
+            freed += _unlink(f)
+        debug_dir.rmdir()
+    usage_store.add(user_id, -freed)
 
     return StatusResponse(status="deleted")
 
 
 @router.get("/sessions/{session_id}/debug")
 async def debug_session(request: Request, session_id: str, user_id: str = Depends(get_user_id)):
-    """generate debug images showing contour detection steps"""
+    """contour detection stats plus a url per intermediate stage"""
     user_sessions, _, _ = get_stores(user_id)
-    up = _user_path(user_id)
     session = user_sessions.get(session_id)
     if not session or not session.corrected_image_path:
         raise HTTPException(status_code=404, detail="session not found or no corrected image")
 
-    debug_dir = up / "debug" / session_id
-    debug_dir.mkdir(parents=True, exist_ok=True)
+    stats = await asyncio.to_thread(debug_cache.stats, _abs(session.corrected_image_path))
+    if stats is None:
+        return {"error": "could not read image"}
+    results = {stage: f"/api/sessions/{session_id}/debug/{stage}.jpg" for stage in DEBUG_STAGES}
+    results.update(stats)
+    return results
 
-    results = image_processor.debug_contour_detection(
-        _abs(session.corrected_image_path), debug_dir
-    )
 
-    for key in results:
-        if isinstance(results[key], str) and results[key].endswith(".jpg"):
-            results[key] = f"/storage/{user_id}/debug/{session_id}/{results[key]}"
+@router.get("/sessions/{session_id}/debug/{stage}.jpg")
+async def debug_stage_image(request: Request, session_id: str, stage: str, user_id: str = Depends(get_user_id)):
+    user_sessions, _, _ = get_stores(user_id)
+    session = user_sessions.get(session_id)
+    if not session or not session.corrected_image_path:
+        raise HTTPException(status_code=404, detail="session not found or no corrected image")
+    if stage not in DEBUG_STAGES:
+        raise HTTPException(status_code=404, detail="unknown debug stage")
 
-    return results
+    data = await asyncio.to_thread(debug_cache.stage_jpeg, _abs(session.corrected_image_path), stage)
+    if data is None:
+        raise HTTPException(status_code=404, detail="could not read image")
+    return Response(
+        content=data,
+        media_type="image/jpeg",
+        headers={"Cache-Control": f"private, max-age={settings.debug_cache_ttl_s}"},
+    )
 
 
 @router.get("/files/{session_id}/bin.stl")
@@ -591,12 +957,15 @@ async def update_tool(request: Request, tool_id: str, req: ToolUpdateRequest, us
     if not tool:
         raise HTTPException(status_code=404, detail="tool not found")
 
-    if req.name is not None:
+    if req.name is not None and req.name != tool.name:
         tool.name = req.name
-    if req.points is not None:
+        tool.version += 1
+    if req.points is not None and req.points != tool.points:
         tool.points = req.points
-    if req.finger_holes is not None:
+        tool.version += 1
+    if req.finger_holes is not None and req.finger_holes != tool.finger_holes:
         tool.finger_holes = req.finger_holes
+        tool.version += 1
     if req.interior_rings is not None:
         tool.interior_rings = req.interior_rings
     if req.smoothed is not None:
@@ -613,6 +982,7 @@ async def delete_tool(request: Request, tool_id: str, user_id: str = Depends(get
     tool = user_tools.delete(tool_id)
     if not tool:
         raise HTTPException(status_code=404, detail="tool not found")
+    usage_store.add(user_id, -_unlink(_abs(tool.thumbnail_path)))
     return StatusResponse(status="deleted")
 
 
@@ -683,13 +1053,6 @@ async def save_tools_from_session(request: Request, session_id: str, body: SaveT
         id_set = set(body.polygon_ids)
         polys = [p for p in polys if p.id in id_set]
 
-    src_img = None
-    if session.corrected_image_path:
-        try:
-            src_img = Image.open(_abs(session.corrected_image_path))
-        except Exception:
-            pass
-
     for poly in polys:
         centered, fholes, interior_rings = polygon_scaler.scale_and_centre(poly, sf)
         if not centered:
@@ -698,10 +1061,11 @@ async def save_tools_from_session(request: Request, session_id: str, body: SaveT
         tool_id = str(uuid.uuid4())
 
         thumbnail_path = None
-        if src_img:
-            thumb_abs = generate_tool_thumbnail(src_img, poly.points, tool_id, up / "tools")
+        if session.corrected_image_path:
+            thumb_abs = generate_tool_thumbnail(_abs(session.corrected_image_path), poly.points, tool_id, up / "tools")
             if thumb_abs:
                 thumbnail_path = _rel(thumb_abs, up)
+                usage_store.add(user_id, file_size(thumb_abs))
 
         user_tools.set(tool_id, Tool(
             id=tool_id,
@@ -722,8 +1086,9 @@ async def save_tools_from_session(request: Request, session_id: str, body: SaveT
 
 @router.get("/bins", response_model=BinListResponse)
 async def list_bins(request: Request, user_id: str = Depends(get_user_id)):
-    _, _, user_bins = get_stores(user_id)
+    _, user_tools, user_bins = get_stores(user_id)
     all_bins = user_bins.all()
+    user_bins.set_many(sync_bins(all_bins, user_tools.all()))
     summaries = []
     for bid, bin_data in all_bins.items():
         summaries.append(BinSummary(
@@ -775,6 +1140,7 @@ async def create_bin(request: Request, req: CreateBinRequest, user_id: str = Dep
             points=list(tool.points),
             finger_holes=list(tool.finger_holes),
             interior_rings=list(tool.interior_rings),
+            synced_version=tool.version,
         ))
 
     bc = BinConfig()
@@ -833,6 +1199,26 @@ async def update_bin(request: Request, bin_id: str, req: BinUpdateRequest, user_
     return StatusResponse(status="ok")
 
 
+@router.patch("/bins/{bin_id}/placed-tools", response_model=StatusResponse)
+async def patch_placed_tools(request: Request, bin_id: str, req: BinPatchRequest, user_id: str = Depends(get_user_id)):
+    """apply incremental move/rotate/finger hole ops to placed tools"""
+    _, _, user_bins = get_stores(user_id)
+    bin_data = user_bins.get(bin_id)
+    if not bin_data:
+        raise HTTPException(status_code=404, detail="bin not found")
+
+    try:
+        updated = apply_placed_tool_ops(bin_data.placed_tools, req.ops)
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    bin_data.placed_tools = updated
+    user_bins.set(bin_id, bin_data)
+    return StatusResponse(status="ok")
+
+
 @router.delete("/bins/{bin_id}", response_model=StatusResponse)
 async def delete_bin(request: Request, bin_id: str, user_id: str = Depends(get_user_id)):
     _, _, user_bins = get_stores(user_id)
@@ -841,14 +1227,7 @@ async def delete_bin(request: Request, bin_id: str, user_id: str = Depends(get_u
     if not bin_data:
         raise HTTPException(status_code=404, detail="bin not found")
 
-    if bin_data.stl_path:
-        stl_abs = Path(_abs(bin_data.stl_path))
-        stl_abs.unlink(missing_ok=True)
-        stl_abs.with_suffix(".3mf").unlink(missing_ok=True)
-        stl_abs.with_suffix(".hash").unlink(missing_ok=True)
-    for f in up.glob(f"outputs/{bin_id}_part*.stl"):
-        f.unlink(missing_ok=True)
-    (up / "outputs" / f"{bin_id}_parts.zip").unlink(missing_ok=True)
+    usage_store.add(user_id, -remove_outputs(up / "outputs", bin_id))
 
     return StatusResponse(status="deleted")
 
@@ -880,6 +1259,7 @@ def generate_bin_stl(request: Request, bin_id: str, user_id: str = Depends(get_u
         "smoothed_flags": smoothed_flags,
     }
     input_hash = hashlib.md5(json.dumps(input_data, sort_keys=True, default=str).encode()).hexdigest()
+    _check_quota(user_id)
 
     scaled = []
     for pt in bin_data.placed_tools:
@@ -972,29 +1352,57 @@ async def download_bin_threemf(request: Request, bin_id: str, user_id: str = Dep
     )
 
 
-def _dir_size(path: Path) -> int:
-    total = 0
-    for dirpath, _, filenames in os.walk(path):
-        for f in filenames:
-            total += os.path.getsize(os.path.join(dirpath, f))
-    return total
-
-
-@router.get("/admin/storage-stats")
-async def storage_stats(request: Request):
+def _require_admin(request: Request):
     if settings.proxy_secret:
         if request.headers.get("x-proxy-secret") != settings.proxy_secret:
             raise HTTPException(status_code=403)
 
-    storage = settings.storage_path
-    users = [d for d in storage.iterdir() if d.is_dir()]
+
+@router.get("/admin/storage-stats")
+async def storage_stats(request: Request):
+    _require_admin(request)
 
     per_user = []
     total = 0
-    for user_dir in sorted(users):
-        size = _dir_size(user_dir)
+    for uid, artifact_bytes in sorted(usage_store.all().items()):
+        size = artifact_bytes + usage_store.metadata_size(uid)
         total += size
-        per_user.append({"userId": user_dir.name, "bytes": size})
+        per_user.append({"userId": uid, "bytes": size})
+
+    return {"totalBytes": total, "users": per_user, "quotaBytes": settings.user_quota_mb * 1024 * 1024 or None}
 
-    return {"totalBytes": total, "users": per_user}
 
+@router.post("/admin/janitor")
+def run_janitor(request: Request, dry_run: bool = False):
+    """sweep orphaned and stale artifacts now. returns what was (or would be) reclaimed."""
+    _require_admin(request)
+    return janitor.run(dry_run=dry_run).as_dict()
+
+
+@router.get("/admin/janitor")
+async def janitor_status(request: Request):
+    _require_admin(request)
+    report = janitor.last_report
+    return {"lastRun": report.as_dict() if report else None}
+
+
+@router.get("/admin/detection-stats")
+async def paper_detection_stats(request: Request):
+    """per-strategy hit rate and timing for paper corner detection since startup"""
+    _require_admin(request)
+    return detection_stats.snapshot()
+
+
+@router.get("/admin/cache-stats")
+async def cache_stats(request: Request):
+    _require_admin(request)
+    return {
+        "decodedImages": image_cache.stats(),
+        "masks": mask_cache.stats(),
+        "gemini": gemini_pool.stats(),
+        "geminiPayloads": payload_cache.stats(),
+        "geminiScheduler": gemini_scheduler.stats(),
+        "maskHedging": mask_hedger.stats(),
+        "geminiBreaker": gemini_breaker.stats(),
+        "maskAlignment": align_stats.snapshot(),
+    }
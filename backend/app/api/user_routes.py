@@ -21,8 +21,10 @@ async def delete_user_data(request: Request, user_id: str = Depends(get_user_id)
         shutil.rmtree(user_path)
         logger.info("deleted storage for user %s", user_id)
 
-    # evict from store cache
-    from app.api.routes import _store_cache
+    # evict from store cache and usage ledger
+    from app.api.routes import _store_cache, _blob_stores, usage_store
     _store_cache.pop(user_id, None)
+    _blob_stores.pop(user_id, None)
+    usage_store.delete(user_id)
 
     return Response(status_code=204)
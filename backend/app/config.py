@@ -9,7 +9,33 @@ class Settings(BaseSettings):
     storage_path: Path = Path("./storage")
     google_api_key: Optional[str] = None
     gemini_image_model: str = "gemini-3.1-flash-image-preview"
+    gemini_workers: int = 8  # threads for blocking gemini sdk calls
+    gemini_max_concurrent: int = 4  # gemini calls in flight across all users, more queue fairly per user
+    gemini_max_retries: int = 4  # on 429/503, with retry-after or jittered backoff
+    gemini_hedge_percentile: float = 0  # e.g. 0.95: resend a mask request slower than this percentile, 0 = off
+    gemini_hedge_budget: float = 0.05  # max fraction of recent mask requests that may be hedged
+    gemini_breaker_failures: int = 5  # consecutive gemini timeouts/5xx before failing fast
+    gemini_breaker_reset_s: int = 30  # how long to fail fast before letting a probe through
+    mask_aligner: str = "phase"  # flash mask alignment: phase, template, or auto for the better of both per mask
+    gemini_base_url: Optional[str] = None  # override the gemini api endpoint (e.g. a local stand-in)
     max_upload_mb: int = 20
+    ingest_workers: int = 0  # upload decode/corner detection threads and heic decode processes, 0 = one per cpu
+    max_batch_files: int = 50  # per /upload/batch request
+    ingest_max_megapixels: float = 24  # uploads are downscaled to this, 0 = keep full size
+    ingest_jpeg_quality: int = 90  # for uploads that have to be re-encoded
+    image_cache_mb: int = 512  # decoded-image LRU shared by upload/trace steps
+    payload_cache_mb: int = 64  # encoded images ready to send to gemini
+    warp_max_margin_mm: int = 50  # corrected image keeps at most this much beyond each paper edge
+    warp_max_megapixels: float = 16  # margins shrink so the corrected image stays under this; bounds warp memory (~3 bytes/px per concurrent warp, 2 at once)
+    user_quota_mb: int = 0  # per-user storage cap, 0 = unlimited
+    usage_reconcile_interval_s: int = 3600  # how often the usage ledger is recounted from disk
+    janitor_interval_s: int = 21600  # orphan/stale artifact sweep, 0 = disabled
+    janitor_grace_s: int = 3600  # never touch files younger than this
+    janitor_debug_max_age_s: int = 86400
+    janitor_mask_max_age_s: int = 30 * 86400  # cached gemini masks unused for this long are dropped
+    janitor_outputs_max_mb: int = 0  # per-user cap on generated outputs, LRU-evicted, 0 = unlimited
+    debug_cache_ttl_s: int = 300  # in-memory contour debug stages
+    debug_max_dim: int = 1024  # debug stage images are downscaled to this
     log_level: str = "INFO"
     proxy_secret: Optional[str] = None
     cors_origins: list[str] = ["http://localhost:3000", "http://localhost:4001"]
@@ -23,7 +49,7 @@ settings = Settings()
 def ensure_user_dirs(user_path: Path):
     """create storage subdirs for a user"""
     user_path.mkdir(parents=True, exist_ok=True)
-    for sub in ("uploads", "processed", "outputs", "tools", "bins"):
+    for sub in ("uploads", "processed", "outputs", "tools", "bins", "tiles", "masks"):
         (user_path / sub).mkdir(exist_ok=True)
 
 
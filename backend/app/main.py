@@ -1,3 +1,4 @@
+import asyncio
 import logging
 
 from fastapi import FastAPI
@@ -5,7 +6,7 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.requests import Request
-from starlette.responses import Response
+from starlette.responses import JSONResponse, Response
 
 from app.config import settings
 
@@ -18,7 +19,7 @@ logging.basicConfig(
     datefmt=LOG_DATEFMT,
 )
 
-from app.api.routes import router
+from app.api.routes import router, usage_store, janitor, gemini_breaker
 from app.api.user_routes import router as user_router
 
 app = FastAPI(title="Tracefinity API", version="0.1.0")
@@ -32,6 +33,43 @@ def _configure_uvicorn_logging():
             h.setFormatter(fmt)
 
 
+async def _reconcile_usage_loop():
+    while True:
+        try:
+            await asyncio.to_thread(usage_store.reconcile)
+        except Exception:
+            logging.exception("usage reconcile failed")
+        await asyncio.sleep(settings.usage_reconcile_interval_s)
+
+
+@app.on_event("startup")
+async def _start_usage_reconcile():
+    if settings.usage_reconcile_interval_s > 0:
+        app.state.usage_reconcile = asyncio.create_task(_reconcile_usage_loop())
+    elif not usage_store.loaded:
+        await asyncio.to_thread(usage_store.reconcile)
+
+
+@app.on_event("shutdown")
+def _flush_usage():
+    usage_store.flush()
+
+
+async def _janitor_loop():
+    while True:
+        await asyncio.sleep(settings.janitor_interval_s)
+        try:
+            await asyncio.to_thread(janitor.run)
+        except Exception:
+            logging.exception("janitor run failed")
+
+
+@app.on_event("startup")
+async def _start_janitor():
+    if settings.janitor_interval_s > 0:
+        app.state.janitor = asyncio.create_task(_janitor_loop())
+
+
 class ProxySecretMiddleware(BaseHTTPMiddleware):
     """reject requests with X-User-Id but wrong/missing proxy secret"""
 
@@ -57,6 +95,41 @@ class StorageAuthMiddleware(BaseHTTPMiddleware):
         return await call_next(request)
 
 
+class UploadSizeMiddleware(BaseHTTPMiddleware):
+    """reject oversized multipart bodies by Content-Length before starlette
+    spools them; the per-file checks in the routes only run once the whole
+    form has been read. bodies without a length (chunked, from a proxy that
+    re-streams) still get only those checks."""
+
+    # multipart boundaries and part headers on top of the file bytes
+    FORM_OVERHEAD = 1024 * 1024
+
+    async def dispatch(self, request: Request, call_next):
+        if not request.headers.get("content-type", "").startswith("multipart/form-data"):
+            return await call_next(request)
+        files = settings.max_batch_files if request.url.path.endswith("/upload/batch") else 1
+        limit = files * settings.max_upload_mb * 1024 * 1024 + self.FORM_OVERHEAD
+        length = request.headers.get("content-length", "")
+        if length.isdigit() and int(length) > limit:
+            return JSONResponse(
+                {"detail": f"upload too large (max {settings.max_upload_mb}MB per file)"}, status_code=413
+            )
+        return await call_next(request)
+
+
+class StorageFiles(StaticFiles):
+    """storage mount; tile pyramids live in content-versioned dirs, so they
+    can be cached forever. only privately: /storage is checked per user, and
+    a shared cache would hand one user's tiles to another"""
+
+    async def get_response(self, path: str, scope):
+        response = await super().get_response(path, scope)
+        parts = path.split("/")
+        if len(parts) > 1 and parts[1] == "tiles" and response.status_code == 200:
+            response.headers["Cache-Control"] = "private, max-age=31536000, immutable"
+        return response
+
+
 # cors for local dev; in production the proxy serves everything same-origin
 app.add_middleware(
     CORSMiddleware,
@@ -66,13 +139,16 @@ app.add_middleware(
     allow_headers=["*"],
 )
 app.add_middleware(StorageAuthMiddleware)
+app.add_middleware(UploadSizeMiddleware)
 app.add_middleware(ProxySecretMiddleware)
 
-app.mount("/storage", StaticFiles(directory=str(settings.storage_path)), name="storage")
+app.mount("/storage", StorageFiles(directory=str(settings.storage_path)), name="storage")
 app.include_router(router, prefix="/api")
 app.include_router(user_router, prefix="/api")
 
 
 @app.get("/health")
 async def health():
-    return {"status": "ok"}
+    # gemini being down degrades tracing only; the service itself is still up
+    breaker = gemini_breaker.state
+    return {"status": "ok" if breaker == "closed" else "degraded", "gemini": breaker}
@@ -1,7 +1,7 @@
 from __future__ import annotations
 
-from pydantic import BaseModel, field_validator
-from typing import Literal, Optional
+from pydantic import BaseModel, Field, field_validator
+from typing import Annotated, Literal, Optional, Union
 
 
 class Point(BaseModel):
@@ -41,8 +41,7 @@ class Polygon(BaseModel):
 
 class UploadResponse(BaseModel):
     session_id: str
-    image_url: str
-    detected_corners: list[Point] | None
+    status: Literal["processing", "ready", "failed"] = "processing"
 
 
 class CornersRequest(BaseModel):
@@ -56,8 +55,9 @@ class CornersResponse(BaseModel):
 
 
 class TraceRequest(BaseModel):
-    provider: Literal["google"] = "google"
+    provider: Literal["google", "local"] = "google"  # local: offline opencv segmentation, no api key
     api_key: str | None = None
+    refresh: bool = False  # ignore the cached mask and ask the model again
 
 
 class TraceResponse(BaseModel):
@@ -65,6 +65,13 @@ class TraceResponse(BaseModel):
     mask_url: str | None = None
 
 
+class TraceStatusResponse(BaseModel):
+    # idle: no gemini call pending for this session
+    state: Literal["idle", "queued", "running"] = "idle"
+    position: int | None = None  # 1-based place in the gemini queue
+    retry_in: float | None = None  # seconds until a rate-limit pause ends
+
+
 class PolygonsRequest(BaseModel):
     polygons: list[Polygon]
 
@@ -135,14 +142,32 @@ class Layout(BaseModel):
     text_labels: list[TextLabel] = []
 
 
+class UploadBlob(BaseModel):
+    path: str  # normalized image, relative to storage root
+    corners: list[Point] | None = None  # memoized paper detection
+    created_at: str | None = None
+
+
+class TilePyramid(BaseModel):
+    path: str  # pyramid dir relative to storage root: image.dzi, preview.webp, image_files/
+    version: str
+    width: int
+    height: int
+    tile_size: int
+    max_level: int
+
+
 class Session(BaseModel):
     id: str
     name: str | None = None
     description: str | None = None
     tags: list[str] = []
     created_at: str | None = None
+    upload_status: Literal["processing", "ready", "failed"] | None = None  # None for older sessions
+    upload_error: str | None = None
     original_image_path: str | None = None
     corrected_image_path: str | None = None
+    tiles: TilePyramid | None = None  # built in the background after corners are set
     mask_image_path: str | None = None
     corners: list[Point] | None = None
     paper_size: Literal["a4", "letter"] | None = None
@@ -191,6 +216,7 @@ class Tool(BaseModel):
     source_session_id: str | None = None
     thumbnail_path: str | None = None
     created_at: str | None = None
+    version: int = 0  # bumped when points, finger holes or name change
 
 
 class ToolSummary(BaseModel):
@@ -236,6 +262,7 @@ class PlacedTool(BaseModel):
     finger_holes: list[FingerHole] = []  # mm, bin-space
     interior_rings: list[list[Point]] = []  # mm, bin-space
     rotation: float = 0.0  # degrees, applied on top of library points
+    synced_version: int | None = None  # library tool version these points came from
 
 
 class BinConfig(BinParams):
@@ -282,3 +309,87 @@ class BinUpdateRequest(BaseModel):
 class CreateBinRequest(BaseModel):
     name: str | None = None
     tool_ids: list[str] = []  # pre-place these tools
+
+
+# --- incremental edits ---
+# op-based patches so editors can send one change instead of the whole layout.
+# finger hole ops target a polygon (sessions) or a placed tool (bins) by id.
+
+class AddPolygonOp(BaseModel):
+    op: Literal["add_polygon"]
+    polygon: Polygon
+
+
+class UpdatePolygonOp(BaseModel):
+    op: Literal["update_polygon"]
+    polygon: Polygon  # replaces the polygon with the same id
+
+
+class RemovePolygonOp(BaseModel):
+    op: Literal["remove_polygon"]
+    polygon_id: str
+
+
+class AddFingerHoleOp(BaseModel):
+    op: Literal["add_finger_hole"]
+    target_id: str
+    finger_hole: FingerHole
+
+
+class UpdateFingerHoleOp(BaseModel):
+    op: Literal["update_finger_hole"]
+    target_id: str
+    finger_hole: FingerHole  # replaces the hole with the same id
+
+
+class RemoveFingerHoleOp(BaseModel):
+    op: Literal["remove_finger_hole"]
+    target_id: str
+    finger_hole_id: str
+
+
+class AddPlacedToolOp(BaseModel):
+    op: Literal["add_tool"]
+    placed_tool: PlacedTool
+
+
+class RemovePlacedToolOp(BaseModel):
+    op: Literal["remove_tool"]
+    placed_tool_id: str
+
+
+class MovePlacedToolOp(BaseModel):
+    op: Literal["move"]
+    placed_tool_id: str
+    dx: float  # mm
+    dy: float
+
+
+class RotatePlacedToolOp(BaseModel):
+    op: Literal["rotate"]
+    placed_tool_id: str
+    angle: float  # degrees, added to the placement rotation
+    cx: float | None = None  # pivot in bin-space mm, defaults to the outline centroid
+    cy: float | None = None
+
+
+FingerHoleOp = Union[AddFingerHoleOp, UpdateFingerHoleOp, RemoveFingerHoleOp]
+
+PolygonOp = Annotated[
+    Union[AddPolygonOp, UpdatePolygonOp, RemovePolygonOp, FingerHoleOp],
+    Field(discriminator="op"),
+]
+
+PlacedToolOp = Annotated[
+    Union[AddPlacedToolOp, RemovePlacedToolOp, MovePlacedToolOp, RotatePlacedToolOp, FingerHoleOp],
+    Field(discriminator="op"),
+]
+
+
+class PolygonPatchRequest(BaseModel):
+    ops: list[PolygonOp]
+    target: Literal["polygons", "layout"] = "polygons"  # session.polygons or session.layout.polygons
+
+
+class BinPatchRequest(BaseModel):
+    ops: list[PlacedToolOp]
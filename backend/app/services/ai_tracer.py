@@ -3,16 +3,32 @@ from __future__ import annotations
 import asyncio
 import json
 import logging
+import os
+import time
 import uuid
 import tempfile
 from pathlib import Path
+from typing import Callable
 
 import cv2
 import numpy as np
 
 from app.models.schemas import Polygon, Point
+from app.services.circuit_breaker import CircuitBreaker
+from app.services.gemini_client import GeminiClientPool
+from app.services.gemini_payload import Payload, payload_cache
+from app.services.gemini_scheduler import GeminiScheduler
+from app.services.hedging import Hedger
+from app.services.image_cache import image_cache
+from app.services.local_segmenter import segment_tools
+from app.services.mask_align import align_mask
+from app.services.mask_cache import mask_cache
 
 
+# bump when either mask prompt changes, so cached masks from the old prompt
+# aren't reused
+MASK_PROMPT_VERSION = 1
+
 # gemini-3-pro respects output dimensions precisely, so a direct
 # "create a mask" instruction works and alignment is trivial.
 MASK_PROMPT_PRO = """Create a black and white mask of this image.
@@ -41,27 +57,97 @@ The output must look like a stencil — solid black shapes on a solid white rect
 Output dimensions must be exactly {width}x{height} pixels. Tool positions must match the input photo."""
 
 
-LABEL_PROMPT = """This image shows tools on a white background. There are {count} tools detected.
-For each tool, identify what it is.
-
-The tools are located at these approximate positions (x, y center coordinates):
-{positions}
+# sent alongside the mask request, before any contours exist, so gemini
+# finds the tools itself and the boxes are matched to contours afterwards
+LABEL_PROMPT = """This image shows tools on a white background.
+Find every tool and identify what it is.
 
 Return ONLY valid JSON:
-{{
-  "labels": ["tool 1 name", "tool 2 name", ...]
-}}
+{
+  "tools": [{"label": "wrench", "box_2d": [ymin, xmin, ymax, xmax]}, ...]
+}
+
+box_2d is the tool's bounding box, with coordinates normalized to 0-1000.
+Keep labels short (e.g. "wrench", "screwdriver", "pliers")."""
 
-Keep labels short (e.g. "wrench", "screwdriver", "pliers").
-Return labels in the same order as the positions listed above."""
+# labels only need the tools recognisable, not traceable
+LABEL_MAX_DIM = 768
+LABEL_JPEG_QUALITY = 80
+MASK_JPEG_QUALITY = 90
+LABEL_MIN_IOU = 0.1
 
 # models that need post-hoc alignment (don't respect output dimensions)
 _NEEDS_ALIGNMENT = {"gemini-2.5-flash-image"}
 
 
+def polygon_from_rings(exterior: np.ndarray, holes: list[np.ndarray], label: str) -> Polygon:
+    """schema polygon for one (exterior, holes) result of _trace_mask"""
+    return Polygon(
+        id=str(uuid.uuid4()),
+        points=[Point(x=x, y=y) for x, y in exterior.tolist()],
+        label=label,
+        interior_rings=[[Point(x=x, y=y) for x, y in hole.tolist()] for hole in holes],
+    )
+
+
 class AITracer:
-    def __init__(self, model: str = "gemini-3-pro-image-preview"):
+    def __init__(
+        self,
+        model: str = "gemini-3-pro-image-preview",
+        gemini: GeminiClientPool | None = None,
+        scheduler: GeminiScheduler | None = None,
+        hedger: Hedger | None = None,
+        breaker: CircuitBreaker | None = None,
+        aligner: str = "phase",
+    ):
         self.model = model
+        self.aligner = aligner
+        self.gemini = gemini or GeminiClientPool(max_workers=4)
+        self.scheduler = scheduler or GeminiScheduler(max_concurrent=self.gemini.max_workers)
+        self.hedger = hedger or Hedger(percentile=0, budget=0)
+        self.breaker = breaker or CircuitBreaker()
+
+    async def _generate(
+        self,
+        user_id: str,
+        ticket: str | None,
+        api_key: str,
+        timeout_s: float,
+        hedge: bool = False,
+        **kwargs,
+    ):
+        """generate_content through the circuit breaker and fair scheduler,
+        hedged if asked and the hedger is enabled"""
+        # fail fast instead of queueing while gemini is down
+        self.breaker.check()
+
+        def attempt(is_hedge: bool, on_finish):
+            return self.scheduler.run(
+                user_id,
+                lambda: self.breaker.call(
+                    lambda: self.gemini.generate_content(api_key, timeout_s=timeout_s, on_finish=on_finish, **kwargs)
+                ),
+                # the ticket tracks the primary; a hedge is anonymous
+                ticket=None if is_hedge else ticket,
+            )
+
+        if hedge and self.hedger.enabled:
+            return await self.hedger.run(attempt)
+        return await attempt(False, None)
+
+    async def _send(self, payload: Payload, image_path: str, purpose: str, *args, **kwargs):
+        """_generate for a request carrying payload, logging and recording
+        what it uploaded"""
+        start = time.monotonic()
+        response = await self._generate(*args, **kwargs)
+        elapsed = time.monotonic() - start
+        source = os.path.getsize(image_path)
+        payload_cache.record_upload(payload, source, elapsed)
+        logging.info(
+            "gemini %s request: uploaded %.0fKB of a %.0fKB image, answered in %.1fs",
+            purpose, len(payload.data) / 1024, source / 1024, elapsed,
+        )
+        return response
 
     def _mask_prompt(self, width: int, height: int) -> str:
         if self.model in _NEEDS_ALIGNMENT:
@@ -73,46 +159,110 @@ class AITracer:
         image_path: str,
         api_key: str,
         mask_output_path: str | None = None,
+        mask_cache_dir: Path | None = None,
+        refresh: bool = False,
+        user_id: str = "default",
+        ticket: str | None = None,
+        provider: str = "google",
+        on_cached: Callable[[int], None] | None = None,
     ) -> tuple[list[Polygon], str | None]:
-        """trace tools using Gemini mask generation. returns (polygons, mask_path)"""
-        import os
+        """trace tools using Gemini mask generation, or with provider="local"
+        the offline segmenter. returns (polygons, mask_path).
+        with mask_cache_dir, a mask generated earlier for the same image and
+        model is reused unless refresh is set; on_cached gets the bytes a newly
+        cached mask added to mask_cache_dir. gemini calls are queued per
+        user_id; ticket names them for scheduler.position()."""
+        if provider == "local":
+            return await self._trace_local(image_path, mask_output_path)
         if os.environ.get("E2E_TEST_MODE"):
             return self._mock_trace(mask_output_path)
 
-        mask_path = await self._generate_mask_gemini(image_path, api_key, mask_output_path)
-
-        if not mask_path:
-            return [], None
-
-        align = self.model in _NEEDS_ALIGNMENT
-        contours = self._trace_mask(mask_path, image_path, align=align)
-        if not contours:
-            return [], mask_output_path
+        return await self._trace_gemini(
+            image_path, api_key, mask_output_path, mask_cache_dir, refresh, user_id, ticket, on_cached,
+        )
 
+    async def _trace_gemini(
+        self,
+        image_path: str,
+        api_key: str,
+        mask_output_path: str | None,
+        mask_cache_dir: Path | None,
+        refresh: bool,
+        user_id: str,
+        ticket: str | None,
+        on_cached: Callable[[int], None] | None = None,
+    ) -> tuple[list[Polygon], str | None]:
+        mask_path = None
+        cache_key = None
+        detections = None
+        if mask_cache_dir is not None:
+            cache_key = await asyncio.to_thread(mask_cache.key, image_path, self.model, MASK_PROMPT_VERSION)
+            if refresh:
+                mask_cache.record_bypass()
+            else:
+                mask_path = mask_cache.fetch(mask_cache_dir, cache_key, mask_output_path)
+                if mask_path is not None:
+                    detections = mask_cache.fetch_labels(mask_cache_dir, cache_key)
+
+        labels_task = None
+        if detections is None:
+            # labels don't depend on the mask, so ask for them now on a small
+            # copy of the image instead of after tracing. the task is cancelled
+            # if the trace fails, and its own errors only cost the labels
+            labels_task = asyncio.create_task(self._detect_labels(image_path, api_key, user_id))
+            labels_task.add_done_callback(lambda t: t.cancelled() or t.exception())
         try:
-            labels = await self._get_labels(image_path, contours, api_key)
-        except Exception:
-            labels = [f"tool {i + 1}" for i in range(len(contours))]
-
-        polygons = []
-        for i, (exterior, holes) in enumerate(contours):
-            label = labels[i] if i < len(labels) else f"tool {i + 1}"
-            points = [Point(x=p[0], y=p[1]) for p in exterior]
-            interior_rings = [
-                [Point(x=p[0], y=p[1]) for p in hole]
-                for hole in holes
-            ]
-            polygons.append(
-                Polygon(
-                    id=str(uuid.uuid4()),
-                    points=points,
-                    label=label,
-                    interior_rings=interior_rings,
-                )
-            )
-
+            if mask_path is None:
+                mask_path = await self._generate_mask_gemini(image_path, api_key, mask_output_path, user_id, ticket)
+                if mask_path and cache_key:
+                    written = mask_cache.store(mask_cache_dir, cache_key, mask_path)
+                    if on_cached:
+                        on_cached(written)
+
+            if not mask_path:
+                return [], None
+
+            align = self.model in _NEEDS_ALIGNMENT
+            contours = await asyncio.to_thread(self._trace_mask, mask_path, image_path, align=align)
+            if not contours:
+                return [], mask_output_path
+
+            if labels_task is not None:
+                try:
+                    detections = await labels_task
+                except Exception:
+                    detections = []
+                # an empty answer isn't cached, so the next trace asks again
+                if detections and cache_key:
+                    written = mask_cache.store_labels(mask_cache_dir, cache_key, detections)
+                    if on_cached:
+                        on_cached(written)
+        finally:
+            if labels_task is not None:
+                labels_task.cancel()
+        labels = self._match_labels(contours, detections)
+
+        polygons = [
+            polygon_from_rings(exterior, holes, labels[i])
+            for i, (exterior, holes) in enumerate(contours)
+        ]
         return polygons, mask_output_path
 
+    async def _trace_local(self, image_path: str, mask_output_path: str | None) -> tuple[list[Polygon], str | None]:
+        """segment with classical cv, no network. tools get numbered labels."""
+        if mask_output_path is None:
+            with tempfile.NamedTemporaryFile(suffix=".png", delete=False) as f:
+                mask_output_path = f.name
+        mask_path = await asyncio.to_thread(segment_tools, image_path, mask_output_path)
+        if not mask_path:
+            return [], None
+        contours = await asyncio.to_thread(self._trace_mask, mask_path, image_path)
+        polygons = [
+            polygon_from_rings(exterior, holes, f"tool {i + 1}")
+            for i, (exterior, holes) in enumerate(contours)
+        ]
+        return polygons, mask_path
+
     def _mock_trace(self, mask_output_path: str | None) -> tuple[list[Polygon], str | None]:
         """return pre-recorded fixture data instead of calling Gemini"""
         import shutil
@@ -144,48 +294,42 @@ class AITracer:
 
     MAX_MASK_DIM = 2048  # keep output in the 1K/2K pricing tier
 
-    async def _generate_mask_gemini(self, image_path: str, api_key: str, output_path: str | None = None) -> str | None:
+    async def _generate_mask_gemini(
+        self,
+        image_path: str,
+        api_key: str,
+        output_path: str | None = None,
+        user_id: str = "default",
+        ticket: str | None = None,
+    ) -> str | None:
         """use gemini to generate a clean black/white mask"""
         try:
-            from google import genai
             from google.genai import types
 
-            client = genai.Client(api_key=api_key)
-
-            img = cv2.imread(image_path)
-            if img is None:
-                return None
-            height, width = img.shape[:2]
-
             # scale down to stay in the cheaper 2K output tier
-            if max(width, height) > self.MAX_MASK_DIM:
-                scale = self.MAX_MASK_DIM / max(width, height)
-                req_w, req_h = int(width * scale), int(height * scale)
-                resized = cv2.resize(img, (req_w, req_h), interpolation=cv2.INTER_AREA)
-                _, buf = cv2.imencode(".png", resized)
-                image_bytes = buf.tobytes()
-                mime_type = "image/png"
-                prompt = self._mask_prompt(req_w, req_h)
-            else:
-                with open(image_path, "rb") as f:
-                    image_bytes = f.read()
-                mime_type = self._get_media_type(image_path)
-                prompt = self._mask_prompt(width, height)
+            payload = await asyncio.to_thread(payload_cache.prepare, image_path, self.MAX_MASK_DIM, MASK_JPEG_QUALITY)
+            if payload is None:
+                return None
+            prompt = self._mask_prompt(payload.width, payload.height)
 
             logging.info("generating mask with %s", self.model)
-            response = await asyncio.wait_for(
-                asyncio.to_thread(
-                    client.models.generate_content,
-                    model=self.model,
-                    contents=[
-                        prompt,
-                        types.Part.from_bytes(data=image_bytes, mime_type=mime_type),
-                    ],
-                    config=types.GenerateContentConfig(
-                        response_modalities=["TEXT", "IMAGE"],
-                    ),
+            response = await self._send(
+                payload,
+                image_path,
+                "mask",
+                user_id,
+                ticket,
+                api_key,
+                timeout_s=60,
+                hedge=True,
+                model=self.model,
+                contents=[
+                    prompt,
+                    types.Part.from_bytes(data=payload.data, mime_type=payload.mime_type),
+                ],
+                config=types.GenerateContentConfig(
+                    response_modalities=["TEXT", "IMAGE"],
                 ),
-                timeout=60,
             )
 
             for part in response.candidates[0].content.parts:
@@ -210,16 +354,16 @@ class AITracer:
         original_path: str,
         min_area: int = 5000,
         align: bool = False,
-    ) -> list[tuple[list[tuple[float, float]], list[list[tuple[float, float]]]]]:
-        """trace contours from mask image. returns list of (exterior, [holes])."""
-        from shapely.geometry import Polygon as ShapelyPolygon
-        from shapely.ops import unary_union
+    ) -> list[tuple[np.ndarray, list[np.ndarray]]]:
+        """trace contours from mask image. returns list of (exterior, [holes]),
+        each ring an (n, 2) float array in original image pixels."""
+        import shapely
 
         img = cv2.imread(mask_path, cv2.IMREAD_UNCHANGED)
         if img is None:
             return []
 
-        original = cv2.imread(original_path)
+        original = image_cache.get(original_path)
         if original is None:
             return []
 
@@ -245,15 +389,36 @@ class AITracer:
             # BINARY_INV: dark pixels become white, so findContours finds the tool
             _, thresh = cv2.threshold(gray, 127, 255, cv2.THRESH_BINARY_INV)
 
+        # drop specks first, at the mask's own resolution: a noisy mask
+        # otherwise gives thousands of contours that are all thrown away
+        try:
+            # 16-bit labels halve the cost; opencv raises if they'd overflow
+            n, labels, stats, _ = cv2.connectedComponentsWithStats(thresh, connectivity=8, ltype=cv2.CV_16U)
+        except cv2.error:
+            n, labels, stats, _ = cv2.connectedComponentsWithStats(thresh, connectivity=8)
+        keep = stats[:, cv2.CC_STAT_AREA] >= min_area * (mask_w * mask_h) / (target_w * target_h)
+        keep[0] = False
+        if not keep.any():
+            return []
+        dropped = np.flatnonzero(~keep[1:]) + 1
+        if len(dropped) <= 64:
+            # a few specks are cheaper to clear in their boxes than in a full pass
+            for i in dropped:
+                x, y, w, h = stats[i, :4]
+                box = thresh[y:y + h, x:x + w]
+                box[labels[y:y + h, x:x + w] == i] = 0
+        else:
+            thresh = np.where(keep, 255, 0).astype(np.uint8)[labels]
+
         # resize mask to match original image dimensions
         if mask_h != target_h or mask_w != target_w:
             logging.info("resizing mask %dx%d -> %dx%d", mask_w, mask_h, target_w, target_h)
             thresh = cv2.resize(thresh, (target_w, target_h), interpolation=cv2.INTER_NEAREST)
 
-        # flash model returns content at unpredictable offsets — correct via
-        # template matching. pro model respects dimensions so skip this.
+        # flash model returns content at unpredictable offsets and scales.
+        # pro model respects dimensions so skip this.
         if align:
-            thresh = self._align_mask(thresh, original)
+            thresh, _ = align_mask(thresh, original, self.aligner)
 
         kernel = np.ones((3, 3), np.uint8)
         thresh = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel, iterations=2)
@@ -263,204 +428,122 @@ class AITracer:
         if not mask_contours or hierarchy is None:
             return []
 
-        hierarchy = hierarchy[0]  # shape: (N, 4) — [next, prev, child, parent]
-
-        # build parent->children mapping from hierarchy
-        parent_children: dict[int, list[int]] = {}
-        for i, h in enumerate(hierarchy):
-            parent_idx = h[3]
-            if parent_idx == -1:
-                # top-level contour
-                if i not in parent_children:
-                    parent_children[i] = []
-            else:
-                parent_children.setdefault(parent_idx, []).append(i)
-
-        shapely_polys = []
-        for parent_idx, child_indices in parent_children.items():
-            if hierarchy[parent_idx][3] != -1:
-                # not a top-level contour, skip
-                continue
-
-            contour = mask_contours[parent_idx]
-            area = cv2.contourArea(contour)
-            if area < min_area:
-                continue
-
-            exterior_pts = [(float(p[0][0]), float(p[0][1])) for p in contour]
-            if len(exterior_pts) < 4:
-                continue
-
-            # collect hole contours
-            holes = []
-            for ci in child_indices:
-                hole_contour = mask_contours[ci]
-                hole_pts = [(float(p[0][0]), float(p[0][1])) for p in hole_contour]
-                if len(hole_pts) >= 4 and cv2.contourArea(hole_contour) >= min_area // 4:
-                    holes.append(hole_pts)
-
-            try:
-                poly = ShapelyPolygon(exterior_pts, holes=holes)
-                if not poly.is_valid:
-                    poly = poly.buffer(0)
-                if poly.area > min_area:
-                    shapely_polys.append(poly)
-            except Exception:
-                continue
-
-        if not shapely_polys:
+        # contours are tool outlines (parent -1) and their holes. build all
+        # rings in one go, ordered so each outline precedes its holes
+        parents = hierarchy[0][:, 3]
+        sizes = np.array([len(c) for c in mask_contours])
+        areas = np.array([cv2.contourArea(c) for c in mask_contours])
+        valid = (sizes >= 4) & (areas >= np.where(parents == -1, min_area, min_area // 4))
+        owner = np.where(parents == -1, np.arange(len(parents)), parents)
+        valid &= valid[owner]
+        order = np.lexsort((parents != -1, owner))
+        order = order[valid[order]]
+        if len(order) == 0:
+            return []
+        coords = np.concatenate([mask_contours[i].reshape(-1, 2) for i in order]).astype(np.float64)
+        rings = shapely.linearrings(coords, indices=np.repeat(np.arange(len(order)), sizes[order]))
+        _, poly_index = np.unique(owner[order], return_inverse=True)
+        polys = shapely.polygons(rings, indices=poly_index)
+
+        invalid = ~shapely.is_valid(polys)
+        if invalid.any():
+            polys[invalid] = shapely.buffer(polys[invalid], 0)
+        polys = polys[shapely.area(polys) > min_area]
+        if len(polys) == 0:
             return []
 
-        merged = unary_union(shapely_polys)
+        parts = shapely.get_parts(shapely.union_all(polys))
+        parts = parts[shapely.area(parts) >= min_area]
+        simplified = shapely.simplify(parts, 4.0, preserve_topology=True)
+
+        # all rings of all polygons as one coordinate array, clamped at once,
+        # then split back per ring without the closing point
+        rings, ring_poly = shapely.get_rings(simplified, return_index=True)
+        coords = shapely.get_coordinates(rings)
+        np.clip(coords, 0, [target_w, target_h], out=coords)
+        ring_coords = np.split(coords, np.cumsum(shapely.get_num_coordinates(rings))[:-1])
 
         results = []
-        polys_to_process = []
-        if merged.geom_type == "Polygon":
-            polys_to_process = [merged]
-        elif merged.geom_type == "MultiPolygon":
-            polys_to_process = list(merged.geoms)
-
-        for poly in polys_to_process:
-            if poly.area < min_area:
-                continue
-            simplified = poly.simplify(4.0, preserve_topology=True)
-            coords = list(simplified.exterior.coords)[:-1]
-            if len(coords) < 4:
-                continue
-            clamped = [
-                (max(0, min(target_w, x)), max(0, min(target_h, y)))
-                for x, y in coords
-            ]
-            # extract interior rings (holes)
-            hole_rings = []
-            for interior in simplified.interiors:
-                hole_coords = list(interior.coords)[:-1]
-                if len(hole_coords) >= 3:
-                    hole_clamped = [
-                        (max(0, min(target_w, x)), max(0, min(target_h, y)))
-                        for x, y in hole_coords
-                    ]
-                    hole_rings.append(hole_clamped)
-            results.append((clamped, hole_rings))
+        for i, ring in enumerate(ring_coords):
+            ring = ring[:-1]
+            if i == 0 or ring_poly[i] != ring_poly[i - 1]:
+                # exterior ring
+                if len(ring) < 4:
+                    current = None
+                    continue
+                current = (ring, [])
+                results.append(current)
+            elif current is not None and len(ring) >= 3:
+                current[1].append(ring)
 
         return results
 
-    @staticmethod
-    def _align_mask(thresh: np.ndarray, original: np.ndarray) -> np.ndarray:
-        """correct positional offset between mask and image via template matching.
-
-        gemini flash returns masks at arbitrary dimensions. after resizing to
-        match the original, the tool silhouette may be offset by tens to hundreds
-        of pixels. we extract the tool region from the mask and match it against
-        the inverted photo to find the translation that best aligns them.
-        """
-        h, w = thresh.shape[:2]
-        work = 0.25
-        ww, wh = int(w * work), int(h * work)
-        if ww < 64 or wh < 64:
-            return thresh
-
-        mask_s = cv2.resize(thresh, (ww, wh), interpolation=cv2.INTER_NEAREST)
-        orig_gray = cv2.cvtColor(original, cv2.COLOR_BGR2GRAY)
-        corr_s = cv2.resize(255 - orig_gray, (ww, wh), interpolation=cv2.INTER_AREA)
-
-        # find tool bbox in reduced mask
-        contours, _ = cv2.findContours(mask_s.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        if not contours:
-            return thresh
-        largest = max(contours, key=cv2.contourArea)
-        bx, by, bw, bh = cv2.boundingRect(largest)
-
-        # template: tool region with padding for context
-        pad = 30
-        tx1, ty1 = max(0, bx - pad), max(0, by - pad)
-        tx2, ty2 = min(ww, bx + bw + pad), min(wh, by + bh + pad)
-        template = mask_s[ty1:ty2, tx1:tx2].astype(np.float32)
-
-        # search region: template area plus margin for shift detection
-        margin = 75  # ~300px at full resolution
-        sx1, sy1 = max(0, tx1 - margin), max(0, ty1 - margin)
-        sx2, sy2 = min(ww, tx2 + margin), min(wh, ty2 + margin)
-        search = corr_s[sy1:sy2, sx1:sx2].astype(np.float32)
-
-        if template.shape[0] >= search.shape[0] or template.shape[1] >= search.shape[1]:
-            return thresh
-
-        result = cv2.matchTemplate(search, template, cv2.TM_CCOEFF_NORMED)
-        _, max_val, _, max_loc = cv2.minMaxLoc(result)
-
-        # shift = matched position minus expected position
-        dx = (max_loc[0] - (tx1 - sx1)) / work
-        dy = (max_loc[1] - (ty1 - sy1)) / work
-        logging.info("mask alignment: shift=(%.1f, %.1f)px, score=%.3f", dx, dy, max_val)
-
-        max_shift = max(w, h) * 0.1
-        if max_val < 0.15 or (abs(dx) < 2 and abs(dy) < 2):
-            return thresh
-        if abs(dx) > max_shift or abs(dy) > max_shift:
-            logging.warning("mask alignment shift too large, skipping")
-            return thresh
-
-        M = np.float32([[1, 0, dx], [0, 1, dy]])
-        return cv2.warpAffine(thresh, M, (w, h), flags=cv2.INTER_NEAREST)
-
-    async def _get_labels(
-        self,
-        image_path: str,
-        contours: list[tuple[list[tuple[float, float]], list[list[tuple[float, float]]]]],
-        api_key: str,
-    ) -> list[str]:
-        """use gemini to identify what each detected contour is"""
-        positions = []
-        for i, (exterior, _holes) in enumerate(contours):
-            cx = sum(p[0] for p in exterior) / len(exterior)
-            cy = sum(p[1] for p in exterior) / len(exterior)
-            positions.append(f"{i + 1}. x={int(cx)}, y={int(cy)}")
-
-        prompt = LABEL_PROMPT.format(
-            count=len(contours),
-            positions="\n".join(positions),
-        )
-
-        result = await self._call_gemini(image_path, api_key, prompt)
-        return self._parse_labels(result, len(contours))
-
-    def _get_media_type(self, image_path: str) -> str:
-        ext = Path(image_path).suffix.lower()
-        return {
-            ".jpg": "image/jpeg",
-            ".jpeg": "image/jpeg",
-            ".png": "image/png",
-            ".webp": "image/webp",
-            ".gif": "image/gif",
-        }.get(ext, "image/jpeg")
-
-    async def _call_gemini(self, image_path: str, api_key: str, prompt: str) -> str:
-        from google import genai
+    async def _detect_labels(self, image_path: str, api_key: str, user_id: str = "default") -> list[tuple[str, tuple[float, float, float, float]]]:
+        """use gemini to find and name the tools in a downscaled copy of the
+        image. returns (label, (x0, y0, x1, y1)) in original pixel coords."""
         from google.genai import types
 
-        client = genai.Client(api_key=api_key)
-
-        with open(image_path, "rb") as f:
-            image_bytes = f.read()
-
-        mime_type = self._get_media_type(image_path)
-
-        response = await asyncio.wait_for(
-            asyncio.to_thread(
-                client.models.generate_content,
-                model="gemini-2.0-flash",
-                contents=[
-                    prompt,
-                    types.Part.from_bytes(data=image_bytes, mime_type=mime_type),
-                ],
-            ),
-            timeout=30,
+        payload = await asyncio.to_thread(payload_cache.prepare, image_path, LABEL_MAX_DIM, LABEL_JPEG_QUALITY)
+        img = image_cache.get(image_path)
+        if payload is None or img is None:
+            return []
+        height, width = img.shape[:2]
+
+        # no ticket: the mask request is the one the trace page follows
+        response = await self._send(
+            payload,
+            image_path,
+            "labels",
+            user_id,
+            None,
+            api_key,
+            timeout_s=30,
+            model="gemini-2.0-flash",
+            contents=[
+                LABEL_PROMPT,
+                types.Part.from_bytes(data=payload.data, mime_type=payload.mime_type),
+            ],
         )
-        return response.text
+        return self._parse_detections(response.text, width, height)
 
-    def _parse_labels(self, response: str, count: int) -> list[str]:
-        """extract labels from ai response"""
+    @staticmethod
+    def _match_labels(
+        contours: list[tuple[np.ndarray, list[np.ndarray]]],
+        detections: list[tuple[str, tuple[float, float, float, float]]],
+    ) -> list[str]:
+        """label each contour with the detection whose box overlaps its
+        bounding box most, greedily by iou. unmatched contours are numbered."""
+        labels = [f"tool {i + 1}" for i in range(len(contours))]
+        if not detections:
+            return labels
+        boxes = []
+        for exterior, _holes in contours:
+            pts = np.asarray(exterior, dtype=np.float64)
+            boxes.append((*pts.min(axis=0), *pts.max(axis=0)))
+        a = np.array(boxes)[:, None, :]
+        b = np.array([box for _label, box in detections])[None, :, :]
+        iw = np.clip(np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None)
+        ih = np.clip(np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]), 0, None)
+        inter = iw * ih
+        area_a = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+        area_b = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+        iou = inter / np.maximum(area_a + area_b - inter, 1e-9)
+
+        used_c: set[int] = set()
+        used_d: set[int] = set()
+        for flat in np.argsort(iou, axis=None, kind="stable")[::-1]:
+            ci, di = np.unravel_index(flat, iou.shape)
+            if iou[ci, di] < LABEL_MIN_IOU:
+                break
+            if ci in used_c or di in used_d:
+                continue
+            labels[ci] = detections[di][0]
+            used_c.add(ci)
+            used_d.add(di)
+        return labels
+
+    def _parse_detections(self, response: str, width: int, height: int) -> list[tuple[str, tuple[float, float, float, float]]]:
+        """extract (label, pixel box) pairs from ai response"""
         try:
             start = response.find("{")
             end = response.rfind("}") + 1
@@ -468,7 +551,12 @@ class AITracer:
                 response = response[start:end]
 
             data = json.loads(response)
-            labels = data.get("labels", [])
-            return labels[:count]
-        except (json.JSONDecodeError, KeyError):
-            return [f"tool {i + 1}" for i in range(count)]
+            detections = []
+            for tool in data.get("tools", []):
+                y0, x0, y1, x1 = (float(v) for v in tool["box_2d"])
+                box = (x0 * width / 1000, y0 * height / 1000, x1 * width / 1000, y1 * height / 1000)
+                if box[2] > box[0] and box[3] > box[1]:
+                    detections.append((str(tool["label"]), box))
+            return detections
+        except (json.JSONDecodeError, KeyError, TypeError, ValueError):
+            return []
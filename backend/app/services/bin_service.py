@@ -1,9 +1,24 @@
 import math
+
+import numpy as np
+
 from app.models.schemas import Point, FingerHole
 
 
+def _rotate_about(xy: np.ndarray, origin: np.ndarray, target: np.ndarray, rotation: float) -> np.ndarray:
+    """rotate (N, 2) coords about origin by rotation degrees, then move origin to target"""
+    rot = math.radians(rotation)
+    cos_r, sin_r = math.cos(rot), math.sin(rot)
+    r = np.array([[cos_r, sin_r], [-sin_r, cos_r]])
+    return (xy - origin) @ r + target
+
+
 def sync_placed_tools(bin_data, user_tools) -> bool:
-    """sync placed tools with their library versions. returns True if any changed."""
+    """sync placed tools with their library versions. returns True if any changed.
+
+    placements record the library version they were last synced from, so this
+    is a cheap version check unless the tool has been edited since.
+    """
     changed = False
     for pt in bin_data.placed_tools:
         if not pt.tool_id:
@@ -11,38 +26,42 @@ def sync_placed_tools(bin_data, user_tools) -> bool:
         tool = user_tools.get(pt.tool_id)
         if not tool or not tool.points:
             continue
+        if pt.synced_version == tool.version:
+            continue
 
-        n_placed = len(pt.points)
-        placed_cx = sum(p.x for p in pt.points) / n_placed
-        placed_cy = sum(p.y for p in pt.points) / n_placed
-
-        n_lib = len(tool.points)
-        lib_cx = sum(p.x for p in tool.points) / n_lib
-        lib_cy = sum(p.y for p in tool.points) / n_lib
-
-        rot = math.radians(pt.rotation)
-        cos_r, sin_r = math.cos(rot), math.sin(rot)
-
-        new_points = []
-        for p in tool.points:
-            rx = (p.x - lib_cx) * cos_r - (p.y - lib_cy) * sin_r
-            ry = (p.x - lib_cx) * sin_r + (p.y - lib_cy) * cos_r
-            new_points.append(Point(x=placed_cx + rx, y=placed_cy + ry))
-
-        new_fh = []
-        for fh in tool.finger_holes:
-            rx = (fh.x - lib_cx) * cos_r - (fh.y - lib_cy) * sin_r
-            ry = (fh.x - lib_cx) * sin_r + (fh.y - lib_cy) * cos_r
-            new_fh.append(FingerHole(
-                id=fh.id, x=placed_cx + rx, y=placed_cy + ry,
-                radius=fh.radius, width=fh.width, height=fh.height,
-                rotation=fh.rotation, shape=fh.shape,
-            ))
-
-        if new_points != pt.points or new_fh != pt.finger_holes:
-            pt.points = new_points
-            pt.finger_holes = new_fh
-            pt.name = tool.name
-            changed = True
+        placed = np.array([(p.x, p.y) for p in pt.points], dtype=np.float64)
+        lib = np.array([(p.x, p.y) for p in tool.points], dtype=np.float64)
+        placed_c = placed.mean(axis=0)
+        lib_c = lib.mean(axis=0)
+
+        new_xy = _rotate_about(lib, lib_c, placed_c, pt.rotation)
+        pt.points = [Point(x=x, y=y) for x, y in new_xy.tolist()]
+
+        if tool.finger_holes:
+            fh_xy = np.array([(fh.x, fh.y) for fh in tool.finger_holes], dtype=np.float64)
+            fh_xy = _rotate_about(fh_xy, lib_c, placed_c, pt.rotation)
+            pt.finger_holes = [
+                FingerHole(
+                    id=fh.id, x=x, y=y,
+                    radius=fh.radius, width=fh.width, height=fh.height,
+                    rotation=fh.rotation, shape=fh.shape,
+                )
+                for fh, (x, y) in zip(tool.finger_holes, fh_xy.tolist())
+            ]
+        else:
+            pt.finger_holes = []
+
+        pt.name = tool.name
+        pt.synced_version = tool.version
+        changed = True
 
     return changed
+
+
+def sync_bins(bins: dict, user_tools) -> dict:
+    """sync every bin against the library. returns {bin_id: bin} for bins that changed."""
+    return {
+        bid: bin_data
+        for bid, bin_data in bins.items()
+        if sync_placed_tools(bin_data, user_tools)
+    }
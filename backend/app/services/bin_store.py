@@ -49,6 +49,14 @@ class BinStore:
             self._bins[bin_id] = bin_data
             self._save()
 
+    def set_many(self, bins: dict[str, BinModel]):
+        """update several bins with a single write"""
+        if not bins:
+            return
+        with self._lock:
+            self._bins.update(bins)
+            self._save()
+
     def delete(self, bin_id: str) -> Optional[BinModel]:
         with self._lock:
             bin_data = self._bins.pop(bin_id, None)
@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import json
+import tempfile
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Callable, Optional
+
+from app.models.schemas import UploadBlob
+from app.services.usage_store import file_size
+
+
+class BlobStore:
+    """per-user index of content-addressed uploads, keyed by sha256 of the
+    bytes as received. holds the detected corners so a re-upload of the same
+    photo skips ingest and detection entirely.
+
+    uploads in flight hold a blob with acquire() until their session points
+    at it, so discard() can't delete it out from under them."""
+
+    def __init__(self, storage_path: Path):
+        self.file_path = storage_path / "blobs.json"
+        self._blobs: dict[str, UploadBlob] = {}
+        self._lock = threading.Lock()
+        self._held: Counter[str] = Counter()
+        self._load()
+
+    def _load(self):
+        if self.file_path.exists():
+            try:
+                data = json.loads(self.file_path.read_text())
+                for digest, bdata in data.items():
+                    self._blobs[digest] = UploadBlob.model_validate(bdata)
+            except Exception:
+                self._blobs = {}
+
+    def _save(self):
+        # atomic write: write to temp file then rename
+        data = {digest: b.model_dump() for digest, b in self._blobs.items()}
+        temp_fd, temp_path = tempfile.mkstemp(
+            dir=self.file_path.parent,
+            prefix=".blobs_",
+            suffix=".tmp"
+        )
+        try:
+            with open(temp_fd, 'w') as f:
+                json.dump(data, f, indent=2)
+            Path(temp_path).replace(self.file_path)
+        except Exception:
+            Path(temp_path).unlink(missing_ok=True)
+            raise
+
+    def get(self, digest: str) -> Optional[UploadBlob]:
+        with self._lock:
+            return self._blobs.get(digest)
+
+    def set(self, digest: str, blob: UploadBlob):
+        with self._lock:
+            self._blobs[digest] = blob
+            self._save()
+
+    def delete(self, digest: str) -> Optional[UploadBlob]:
+        with self._lock:
+            blob = self._blobs.pop(digest, None)
+            if blob:
+                self._save()
+            return blob
+
+    def acquire(self, digest: str):
+        with self._lock:
+            self._held[digest] += 1
+
+    def release(self, digest: str):
+        with self._lock:
+            self._held[digest] -= 1
+            if self._held[digest] <= 0:
+                del self._held[digest]
+
+    def held(self, digest: str) -> bool:
+        with self._lock:
+            return self._held[digest] > 0
+
+    def discard(self, digest: str, path: Path, referenced: Callable[[], bool]) -> int:
+        """delete the blob and its file at path unless an upload holds it or
+        referenced() says a session still points at it. returns bytes freed."""
+        with self._lock:
+            if self._held[digest] or referenced():
+                return 0
+            if self._blobs.pop(digest, None):
+                self._save()
+            size = file_size(path)
+            path.unlink(missing_ok=True)
+            return size
+
+    def all(self) -> dict[str, UploadBlob]:
+        with self._lock:
+            return self._blobs.copy()
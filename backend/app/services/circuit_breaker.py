@@ -0,0 +1,116 @@
+"""circuit breaker for gemini calls.
+
+after `failure_threshold` consecutive timeouts or 5xx responses the breaker
+opens and calls fail immediately with CircuitOpen instead of each waiting out
+the full timeout. after `reset_timeout_s` it goes half-open and lets a single
+probe through: success closes it, failure opens it for another period.
+client errors (bad key, quota, 429s) say nothing about gemini's health and
+don't count.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from typing import Awaitable, Callable, TypeVar
+
+T = TypeVar("T")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpen(Exception):
+    """gemini is failing; not attempting the call"""
+
+    def __init__(self, retry_in: float):
+        super().__init__(f"gemini circuit open, retry in {retry_in:.0f}s")
+        self.retry_in = retry_in
+
+
+def is_outage(exc: BaseException) -> bool:
+    return isinstance(exc, TimeoutError) or (getattr(exc, "code", None) or 0) >= 500
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = 5, reset_timeout_s: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_s = reset_timeout_s
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self.opened = 0
+        self.rejected = 0
+        self.last_error: str | None = None
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout_s:
+            self._state = HALF_OPEN
+        return self._state
+
+    def _retry_in(self) -> float:
+        return max(0.0, self._opened_at + self.reset_timeout_s - time.monotonic())
+
+    def _reject_if_open(self) -> str:
+        # caller holds the lock
+        state = self._current_state()
+        if state == OPEN or (state == HALF_OPEN and self._probing):
+            self.rejected += 1
+            raise CircuitOpen(self._retry_in())
+        return state
+
+    def check(self):
+        """raise CircuitOpen unless a call may go ahead now, without taking
+        the half-open probe slot. lets callers fail before queueing."""
+        with self._lock:
+            self._reject_if_open()
+
+    async def call(self, fn: Callable[[], Awaitable[T]]) -> T:
+        with self._lock:
+            probe = self._reject_if_open() == HALF_OPEN
+            if probe:
+                self._probing = True
+        try:
+            result = await fn()
+        except BaseException as e:
+            with self._lock:
+                if probe:
+                    self._probing = False
+                if is_outage(e):
+                    self._failures += 1
+                    self.last_error = f"{type(e).__name__}: {str(e)[:200]}"
+                    if probe or self._failures >= self.failure_threshold:
+                        if self._state != OPEN:
+                            self.opened += 1
+                        self._state = OPEN
+                        self._opened_at = time.monotonic()
+                elif getattr(e, "code", None):
+                    # gemini answered, just not with a result: it's up
+                    self._failures = 0
+                    self._state = CLOSED
+            raise
+        with self._lock:
+            if probe:
+                self._probing = False
+            self._failures = 0
+            self._state = CLOSED
+        return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            state = self._current_state()
+            return {
+                "state": state,
+                "consecutiveFailures": self._failures,
+                "retryIn": round(self._retry_in(), 1) if state == OPEN else None,
+                "opened": self.opened,
+                "rejected": self.rejected,
+                "lastError": self.last_error,
+            }
@@ -0,0 +1,86 @@
+"""short-lived in-memory cache of contour-detection debug stages.
+
+the pipeline runs once per corrected image at full resolution; each stage is
+kept downscaled and only jpeg-encoded when it's actually requested. entries
+expire after a ttl, so nothing accumulates and nothing touches disk.
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from app.services.image_processor import ImageProcessor
+
+DEBUG_JPEG_QUALITY = 80
+
+
+class _Entry:
+    def __init__(self, stages: dict[str, np.ndarray], stats: dict):
+        self.created = time.monotonic()
+        self.stages = stages
+        self.stats = stats
+        self.encoded: dict[str, bytes] = {}
+
+
+class DebugStageCache:
+    def __init__(self, image_processor: ImageProcessor, ttl_s: int, max_dim: int, max_entries: int = 8):
+        self.image_processor = image_processor
+        self.ttl_s = ttl_s
+        self.max_dim = max_dim
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple, _Entry] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _entry(self, image_path: str) -> _Entry | None:
+        try:
+            st = os.stat(image_path)
+        except OSError:
+            return None
+        key = (image_path, st.st_mtime_ns, st.st_size)
+        now = time.monotonic()
+        with self._lock:
+            for k in [k for k, e in self._entries.items() if now - e.created > self.ttl_s]:
+                del self._entries[k]
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+
+        result = self.image_processor.debug_contour_stages(image_path)
+        if result is None:
+            return None
+        stages, stats = result
+        entry = _Entry({name: self._shrink(img) for name, img in stages.items()}, stats)
+        with self._lock:
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def _shrink(self, img: np.ndarray) -> np.ndarray:
+        h, w = img.shape[:2]
+        scale = self.max_dim / max(h, w)
+        if scale >= 1:
+            return img
+        return cv2.resize(img, (round(w * scale), round(h * scale)), interpolation=cv2.INTER_AREA)
+
+    def stats(self, image_path: str) -> dict | None:
+        entry = self._entry(image_path)
+        return entry.stats if entry else None
+
+    def stage_jpeg(self, image_path: str, stage: str) -> bytes | None:
+        entry = self._entry(image_path)
+        if entry is None or stage not in entry.stages:
+            return None
+        data = entry.encoded.get(stage)
+        if data is None:
+            ok, buf = cv2.imencode(".jpg", entry.stages[stage], [cv2.IMWRITE_JPEG_QUALITY, DEBUG_JPEG_QUALITY])
+            if not ok:
+                return None
+            data = entry.encoded[stage] = buf.tobytes()
+        return data
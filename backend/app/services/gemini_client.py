@@ -0,0 +1,106 @@
+"""long-lived gemini clients and a bounded executor for blocking sdk calls.
+
+each genai.Client owns an http connection pool, so creating one per call pays
+connection setup and tls every time. clients are kept per api key (lru) and
+every generate_content call runs on one dedicated, bounded thread pool whose
+queue depth is visible. the http timeout is passed to the sdk itself so a
+slow call ends its worker thread instead of leaking it, which is what
+asyncio.wait_for around to_thread did.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+
+class GeminiClientPool:
+    def __init__(self, max_workers: int, max_clients: int = 32, base_url: str | None = None):
+        self.max_workers = max_workers
+        self.max_clients = max_clients
+        self.base_url = base_url
+        self._clients: OrderedDict[str, object] = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gemini")
+        self._queued = 0
+        self._active = 0
+        self.created = 0
+
+    def client(self, api_key: str):
+        from google import genai
+        from google.genai import types
+
+        key = hashlib.sha256(api_key.encode()).hexdigest()
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self._clients.move_to_end(key)
+                return client
+            http_options = types.HttpOptions(base_url=self.base_url) if self.base_url else None
+            client = genai.Client(api_key=api_key, http_options=http_options)
+            self._clients[key] = client
+            self.created += 1
+            evicted = self._clients.popitem(last=False)[1] if len(self._clients) > self.max_clients else None
+        if evicted is not None:
+            try:
+                evicted.close()
+            except Exception:
+                logger.debug("closing evicted gemini client failed", exc_info=True)
+        return client
+
+    async def generate_content(self, api_key: str, *, timeout_s: float, on_finish=None, **kwargs):
+        """client.models.generate_content on the bounded executor. raises
+        TimeoutError if the request takes longer than timeout_s. on_finish is
+        called from the worker thread with the monotonic end time of a
+        successful call, even if the awaiting task was cancelled meanwhile."""
+        from google.genai import types
+
+        config = kwargs.pop("config", None) or types.GenerateContentConfig()
+        config = config.model_copy(update={"http_options": types.HttpOptions(timeout=int(timeout_s * 1000))})
+        client = self.client(api_key)
+
+        def call():
+            with self._lock:
+                self._queued -= 1
+                self._active += 1
+            try:
+                response = client.models.generate_content(config=config, **kwargs)
+                if on_finish is not None:
+                    on_finish(time.monotonic())
+                return response
+            finally:
+                with self._lock:
+                    self._active -= 1
+
+        def dequeue_if_cancelled(fut):
+            # a call cancelled while still queued never runs call()
+            if fut.cancelled():
+                with self._lock:
+                    self._queued -= 1
+
+        with self._lock:
+            self._queued += 1
+        fut = self._executor.submit(call)
+        fut.add_done_callback(dequeue_if_cancelled)
+        try:
+            return await asyncio.wrap_future(fut)
+        except httpx.TimeoutException as e:
+            raise TimeoutError(f"gemini request exceeded {timeout_s:g}s") from e
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.max_workers,
+                "active": self._active,
+                "queued": self._queued,
+                "clients": len(self._clients),
+                "clientsCreated": self.created,
+            }
@@ -0,0 +1,127 @@
+"""image payloads for gemini requests.
+
+every call uploads the image it's about, and the corrected image is often a
+multi-megabyte file far larger than the call needs. prepare() resizes to the
+call's target long side and encodes as jpeg, keeping the original bytes when
+they're already a jpeg that fits and is smaller. results are cached per
+(path, mtime, size, target) so re-traces and retries don't re-encode.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+
+import cv2
+
+from app.config import settings
+from app.services.image_cache import image_cache
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Payload:
+    data: bytes
+    mime_type: str
+    width: int
+    height: int
+
+
+class PayloadCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[tuple, Payload] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.encode_s = 0.0
+        self.uploads = 0
+        self.upload_bytes = 0
+        self.source_bytes = 0
+        self.request_s = 0.0
+
+    def prepare(self, path: str | Path, max_dim: int, quality: int) -> Payload | None:
+        """the image at path as a jpeg no larger than max_dim on its long
+        side. None if unreadable."""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        key = (str(path), st.st_mtime_ns, st.st_size, max_dim, quality)
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return payload
+            self.misses += 1
+
+        start = time.perf_counter()
+        img = image_cache.get(path)
+        if img is None:
+            return None
+        height, width = img.shape[:2]
+        scale = min(1.0, max_dim / max(width, height))
+        if scale < 1:
+            width, height = int(width * scale), int(height * scale)
+            img = cv2.resize(img, (width, height), interpolation=cv2.INTER_AREA)
+        _, buf = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        data = buf.tobytes()
+        if scale == 1 and Path(path).suffix.lower() in (".jpg", ".jpeg") and st.st_size <= len(data):
+            # already a compact jpeg at this size; re-encoding only loses detail
+            data = Path(path).read_bytes()
+        payload = Payload(data, "image/jpeg", width, height)
+        elapsed = time.perf_counter() - start
+        logger.info(
+            "gemini payload for %s: %dx%d %.0fKB (source %.0fKB), encoded in %.0fms",
+            Path(path).name, width, height, len(data) / 1024, st.st_size / 1024, elapsed * 1000,
+        )
+
+        with self._lock:
+            self.encode_s += elapsed
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old.data)
+            # drop payloads of older versions of the file
+            for k in [k for k in self._entries if k[0] == key[0] and k[1:3] != key[1:3]]:
+                self._bytes -= len(self._entries.pop(k).data)
+            if len(data) <= self.max_bytes:
+                self._entries[key] = payload
+                self._bytes += len(data)
+            while self._bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted.data)
+        return payload
+
+    def record_upload(self, payload: Payload, source_bytes: int, request_s: float):
+        """count a request that carried payload, against the source file size
+        it would otherwise have sent"""
+        with self._lock:
+            self.uploads += 1
+            self.upload_bytes += len(payload.data)
+            self.source_bytes += source_bytes
+            self.request_s += request_s
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "maxBytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "encodeS": round(self.encode_s, 3),
+                "uploads": self.uploads,
+                "uploadBytes": self.upload_bytes,
+                "sourceBytes": self.source_bytes,
+                "avgRequestS": round(self.request_s / self.uploads, 2) if self.uploads else None,
+            }
+
+
+payload_cache = PayloadCache(settings.payload_cache_mb * 1024 * 1024)
@@ -0,0 +1,229 @@
+"""fair, rate-limit-aware scheduling of gemini calls.
+
+calls wait in one fifo per user and are dispatched round-robin across users,
+so one user queueing a dozen traces doesn't starve everyone else. at most
+`limit` calls are in flight; the limit grows by one per window of successful
+calls and halves on a 429 (aimd), so it settles just under what the quota
+allows. a 429 or 503 also pauses all dispatch until the server's retry-after
+(or a jittered exponential backoff when it gives none), and the call is
+retried at the head of its user's queue.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+import re
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Awaitable, Callable, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+RETRYABLE_CODES = {429, 503}
+
+
+class GeminiRateLimited(Exception):
+    """gemini kept rate limiting after all retries"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+@dataclass
+class _Waiter:
+    ticket: str | None
+    future: asyncio.Future
+    attempt: int = 0
+    state: str = "queued"
+
+
+def retry_after_s(exc: Exception) -> float | None:
+    """server-requested delay from a Retry-After header or a google.rpc.RetryInfo detail"""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if headers is not None:
+        try:
+            value = headers.get("retry-after")
+            if value is not None:
+                return max(0.0, float(value))
+        except (TypeError, ValueError):
+            pass
+    details = getattr(exc, "details", None)
+    if isinstance(details, dict):
+        for d in details.get("error", {}).get("details", []) or []:
+            m = re.fullmatch(r"([\d.]+)s", str(d.get("retryDelay", "")))
+            if m:
+                return float(m.group(1))
+    return None
+
+
+def is_retryable(exc: Exception) -> bool:
+    return getattr(exc, "code", None) in RETRYABLE_CODES
+
+
+class GeminiScheduler:
+    def __init__(
+        self,
+        max_concurrent: int,
+        max_retries: int = 4,
+        base_backoff_s: float = 1.0,
+        max_backoff_s: float = 60.0,
+    ):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_retries = max_retries
+        self.base_backoff_s = base_backoff_s
+        self.max_backoff_s = max_backoff_s
+        self.limit = float(self.max_concurrent)
+        self._queues: OrderedDict[str, deque[_Waiter]] = OrderedDict()
+        self._tickets: dict[str, _Waiter] = {}
+        self._active = 0
+        self._paused_until = 0.0
+        self._wakeup: asyncio.TimerHandle | None = None
+        self.completed = 0
+        self.rate_limited = 0
+        self.retries = 0
+
+    async def run(self, user_id: str, call: Callable[[], Awaitable[T]], ticket: str | None = None) -> T:
+        """run call() once a slot is free and it's this user's turn, retrying
+        on 429/503. raises GeminiRateLimited when retries run out."""
+        waiter = _Waiter(ticket, asyncio.get_running_loop().create_future())
+        if ticket:
+            self._tickets[ticket] = waiter
+        try:
+            while True:
+                await self._acquire(user_id, waiter)
+                try:
+                    result = await call()
+                except Exception as e:
+                    if not is_retryable(e):
+                        raise
+                    # pause before the slot is released, so nothing else is dispatched into the 429
+                    delay = self._on_rate_limited(e, waiter.attempt)
+                    if waiter.attempt >= self.max_retries:
+                        raise GeminiRateLimited(str(e), delay) from e
+                    waiter.attempt += 1
+                    self.retries += 1
+                    logger.info("gemini %s, retry %d in %.1fs", getattr(e, "code", "?"), waiter.attempt, delay)
+                    waiter.future = asyncio.get_running_loop().create_future()
+                    continue
+                finally:
+                    self._release()
+                self._on_success()
+                return result
+        finally:
+            if ticket and self._tickets.get(ticket) is waiter:
+                del self._tickets[ticket]
+
+    async def _acquire(self, user_id: str, waiter: _Waiter):
+        queue = self._queues.setdefault(user_id, deque())
+        # a retry keeps its place at the front of its user's queue
+        if waiter.attempt:
+            queue.appendleft(waiter)
+        else:
+            queue.append(waiter)
+        waiter.state = "queued"
+        self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # granted just as we were cancelled: hand the slot back
+                self._release()
+            else:
+                self._remove(user_id, waiter)
+            raise
+        waiter.state = "running"
+
+    def _remove(self, user_id: str, waiter: _Waiter):
+        queue = self._queues.get(user_id)
+        if queue and waiter in queue:
+            queue.remove(waiter)
+            if not queue:
+                del self._queues[user_id]
+
+    def _release(self):
+        self._active -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        now = time.monotonic()
+        if now < self._paused_until:
+            self._schedule_wakeup(self._paused_until - now)
+            return
+        while self._queues and self._active < int(self.limit):
+            user_id, queue = next(iter(self._queues.items()))
+            waiter = queue.popleft()
+            # rotate: this user goes to the back of the line
+            del self._queues[user_id]
+            if queue:
+                self._queues[user_id] = queue
+            if waiter.future.done():
+                continue
+            self._active += 1
+            waiter.future.set_result(None)
+
+    def _schedule_wakeup(self, delay: float):
+        if self._wakeup is not None:
+            self._wakeup.cancel()
+        self._wakeup = asyncio.get_running_loop().call_later(delay, self._dispatch)
+
+    def _on_rate_limited(self, exc: Exception, attempt: int) -> float:
+        self.rate_limited += 1
+        now = time.monotonic()
+        # calls that were already in flight hit the same limit; halve once per pause
+        if now >= self._paused_until:
+            self.limit = max(1.0, self.limit / 2)
+        delay = retry_after_s(exc)
+        if delay is None:
+            delay = min(self.max_backoff_s, self.base_backoff_s * 2 ** attempt)
+        # random jitter on top, so queued callers don't all fire at the same instant
+        delay = min(self.max_backoff_s, delay + random.uniform(0, self.base_backoff_s * 2 ** attempt))
+        self._paused_until = max(self._paused_until, now + delay)
+        return delay
+
+    def _on_success(self):
+        self.completed += 1
+        if self.limit < self.max_concurrent:
+            self.limit = min(self.max_concurrent, self.limit + 1 / self.limit)
+        self._dispatch()
+
+    def position(self, ticket: str) -> dict | None:
+        """where a ticketed call is: state, 1-based place in the dispatch
+        order while queued, and seconds until a rate-limit pause ends"""
+        waiter = self._tickets.get(ticket)
+        if waiter is None:
+            return None
+        result = {"state": waiter.state, "position": None, "retry_in": None}
+        if waiter.state != "queued":
+            return result
+        # dispatch takes index 0 of every queue in rotation order, then index 1, ...
+        users = list(self._queues.values())
+        for rank, queue in enumerate(users):
+            if waiter in queue:
+                k = queue.index(waiter)
+                ahead = sum(min(len(q), k) for q in users)
+                ahead += sum(1 for q in users[:rank] if len(q) > k)
+                result["position"] = ahead + 1
+                break
+        pause = self._paused_until - time.monotonic()
+        if pause > 0:
+            result["retry_in"] = round(pause, 1)
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "limit": int(self.limit),
+            "maxConcurrent": self.max_concurrent,
+            "active": self._active,
+            "queued": sum(len(q) for q in self._queues.values()),
+            "users": len(self._queues),
+            "pausedFor": round(max(0.0, self._paused_until - time.monotonic()), 1),
+            "completed": self.completed,
+            "rateLimited": self.rate_limited,
+            "retries": self.retries,
+        }
@@ -0,0 +1,160 @@
+"""hedged requests for calls with a long latency tail.
+
+if the first attempt hasn't answered by the `percentile` of recent latencies,
+a second identical attempt starts; whichever succeeds first is used and the
+other is cancelled. a hedge still queued behind other gemini calls never gets
+sent, but one already in flight can't be interrupted (the sdk call is blocking),
+so it runs out in the background and its result is dropped. hedges are capped
+at `budget` of recent calls, since every one is a paid request.
+
+time saved is measured, not estimated: a primary that lost to its hedge still
+finishes on its worker thread, and on_finish reports when.
+"""
+from __future__ import annotations
+
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+from typing import Awaitable, Callable, TypeVar
+
+T = TypeVar("T")
+
+# attempt(is_hedge, on_finish) -> awaitable result
+Attempt = Callable[[bool, Callable[[float], None] | None], Awaitable[T]]
+
+
+def percentile(samples: list[float], p: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, math.ceil(p * len(ordered)) - 1)]
+
+
+class Hedger:
+    def __init__(self, percentile: float, budget: float, min_samples: int = 20, window: int = 200):
+        self.percentile = percentile
+        self.budget = budget
+        self.min_samples = min_samples
+        self._latencies: deque[float] = deque(maxlen=window)
+        self._recent: deque[bool] = deque(maxlen=window)  # whether each recent call was hedged
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.denied = 0
+        self.saved_s = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return 0 < self.percentile < 1 and self.budget > 0
+
+    def threshold(self) -> float | None:
+        """seconds to wait before hedging, None until there are enough samples"""
+        with self._lock:
+            if not self.enabled or len(self._latencies) < self.min_samples:
+                return None
+            return percentile(list(self._latencies), self.percentile)
+
+    def _take_budget(self) -> bool:
+        with self._lock:
+            allowed = sum(self._recent) + 1 <= max(1.0, self.budget * len(self._recent))
+            if not allowed:
+                self.denied += 1
+            return allowed
+
+    def _record(self, latency: float | None, hedged: bool):
+        with self._lock:
+            self.calls += 1
+            self._recent.append(hedged)
+            if latency is not None:
+                self._latencies.append(latency)
+
+    async def run(self, attempt: Attempt) -> T:
+        start = time.monotonic()
+        primary_end: list[float] = []
+        served_at: list[float] = []
+
+        def on_primary_finish(end: float):
+            # worker thread; if the hedge already won, this is the tail we skipped
+            with self._lock:
+                primary_end.append(end)
+                if served_at:
+                    self.saved_s += max(0.0, end - served_at[0])
+                    self._latencies.append(end - start)
+
+        primary = asyncio.ensure_future(attempt(False, on_primary_finish))
+        delay = self.threshold()
+        if delay is not None:
+            try:
+                await asyncio.wait({primary}, timeout=delay)
+            except asyncio.CancelledError:
+                primary.cancel()
+                raise
+        if primary.done() or delay is None or not self._take_budget():
+            try:
+                result = await primary
+            except BaseException:
+                self._record(None, False)
+                raise
+            self._record(time.monotonic() - start, False)
+            return result
+
+        with self._lock:
+            self.hedged += 1
+        hedge = asyncio.ensure_future(attempt(True, None))
+        pending = {primary, hedge}
+        winner = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                ok = [t for t in done if not t.cancelled() and t.exception() is None]
+                if ok:
+                    winner = primary if primary in ok else ok[0]
+                    break
+        finally:
+            for t in pending:
+                t.cancel()
+
+        if winner is None:
+            self._record(None, True)
+            # both failed; report the primary's error
+            return await primary
+
+        now = time.monotonic()
+        if winner is hedge:
+            with self._lock:
+                self.hedge_wins += 1
+                served_at.append(now)
+                if primary_end:
+                    # primary finished between the hedge answering and us getting here
+                    self.saved_s += max(0.0, primary_end[0] - now)
+                    self._latencies.append(primary_end[0] - start)
+        # samples are always the primary's latency (added by on_primary_finish
+        # when the hedge won), so hedging doesn't hide the tail it's tuned on
+        self._record(now - start if winner is primary else None, True)
+        return winner.result()
+
+    def stats(self) -> dict:
+        with self._lock:
+            samples = list(self._latencies)
+            out = {
+                "enabled": self.enabled,
+                "percentile": self.percentile,
+                "budget": self.budget,
+                "calls": self.calls,
+                "hedged": self.hedged,
+                "hedgeWins": self.hedge_wins,
+                "deniedByBudget": self.denied,
+                "savedS": round(self.saved_s, 2),
+                "thresholdS": None,
+                "p50S": None,
+                "p95S": None,
+                "p99S": None,
+            }
+        if samples:
+            out["p50S"] = round(percentile(samples, 0.5), 2)
+            out["p95S"] = round(percentile(samples, 0.95), 2)
+            out["p99S"] = round(percentile(samples, 0.99), 2)
+            if self.enabled and len(samples) >= self.min_samples:
+                out["thresholdS"] = round(percentile(samples, self.percentile), 2)
+        return out
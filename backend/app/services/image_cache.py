@@ -0,0 +1,99 @@
+"""in-process cache of decoded images, shared by the upload/trace pipeline.
+
+entries are keyed by (path, mtime, size, flags) so a rewritten file is never
+served stale, and evicted least-recently-used once the decoded bytes exceed
+the budget. cached arrays are marked read-only: copy before drawing on them.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class DecodedImageCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[tuple, np.ndarray] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(path: str | Path, flags: int) -> tuple | None:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (str(path), st.st_mtime_ns, st.st_size, flags)
+
+    def get(self, path: str | Path, flags: int = cv2.IMREAD_COLOR) -> np.ndarray | None:
+        """decoded image at path, decoding on a miss. None if unreadable."""
+        key = self._key(path, flags)
+        if key is None:
+            return None
+        with self._lock:
+            img = self._entries.get(key)
+            if img is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return img
+            self.misses += 1
+
+        img = cv2.imread(str(path), flags)
+        if img is not None:
+            self._insert(key, img)
+        return img
+
+    def put(self, path: str | Path, img: np.ndarray, flags: int = cv2.IMREAD_COLOR):
+        """prime the cache with the decoded form of a file just written.
+        img must be exactly what decoding the file would produce."""
+        key = self._key(path, flags)
+        if key is not None:
+            self._insert(key, img)
+
+    def _insert(self, key: tuple, img: np.ndarray):
+        # too big to cache: hand it back writable, only cached arrays are shared
+        if img.nbytes > self.max_bytes:
+            return
+        img.flags.writeable = False
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.nbytes
+            # drop stale versions of the same file
+            for k in [k for k in self._entries if k[0] == key[0] and k[3] == key[3]]:
+                self._bytes -= self._entries.pop(k).nbytes
+            self._entries[key] = img
+            self._bytes += img.nbytes
+            while self._bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "maxBytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+def decode_bytes(content: bytes, flags: int = cv2.IMREAD_COLOR) -> np.ndarray | None:
+    """decode an in-memory encoded image without touching disk"""
+    return cv2.imdecode(np.frombuffer(content, dtype=np.uint8), flags)
+
+
+image_cache = DecodedImageCache(settings.image_cache_mb * 1024 * 1024)
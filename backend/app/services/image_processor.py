@@ -2,9 +2,16 @@ from __future__ import annotations
 
 import cv2
 import logging
+import os
+import threading
+import time
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Literal
+from typing import Callable, Literal
+
+from app.services.image_cache import image_cache
+from app.services.strategy_stats import StrategyStats
 
 logger = logging.getLogger(__name__)
 
@@ -15,67 +22,188 @@ PAPER_SIZES = {
 
 PX_PER_MM = 10
 
+# paper detection runs on the first pyramid level no larger than this, so its
+# cost doesn't grow with camera resolution. corners are refined at full res.
+DETECT_MAX_DIM = 1600
+
+# perspective warp: canvas margin kept around the paper and the canvas pixel
+# cap, tile size for the tiled warp, and how many warps may hold full-size
+# buffers at once
+DEFAULT_WARP_MARGIN_MM = 50
+DEFAULT_WARP_MAX_MEGAPIXELS = 16
+WARP_TILE = 1024
+_warp_pool = ThreadPoolExecutor(
+    max_workers=min(4, os.cpu_count() or 2), thread_name_prefix="warp"
+)
+_warp_slots = threading.BoundedSemaphore(2)
+
+# debug_contour_stages() output, in pipeline order
+DEBUG_STAGES = ("gray", "clahe", "blur", "canny", "dilated", "closed", "filled", "final", "contours")
+
+# a brightness candidate this full of bright pixels is accepted without
+# waiting for the other thresholds
+HIGH_CONFIDENCE_FILL = 0.9
+
+# opencv releases the GIL, so strategies genuinely run in parallel. kept
+# separate from any executor that calls detect_paper_corners to avoid
+# nested-submit deadlocks.
+_strategy_pool = ThreadPoolExecutor(
+    max_workers=min(8, os.cpu_count() or 4), thread_name_prefix="paper-detect"
+)
+
+
+detection_stats = StrategyStats()
+
+
+def _timed(fn: Callable):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
 
 class ImageProcessor:
     def detect_paper_corners(self, image_path: str) -> list[tuple[float, float]] | None:
-        """detect paper corners using multiple edge detection strategies"""
-        img = cv2.imread(image_path)
+        """detect paper corners on a downscaled pyramid level, refined at full resolution"""
+        img = image_cache.get(image_path)
         if img is None:
             return None
 
+        h, w = img.shape[:2]
+        level = img
+        while max(level.shape[:2]) > DETECT_MAX_DIM:
+            level = cv2.pyrDown(level)
+
+        corners = self._detect_on_level(level)
+        if not corners or level is img:
+            return corners
+
+        lh, lw = level.shape[:2]
+        sx, sy = w / lw, h / lh
+        corners = [(x * sx, y * sy) for x, y in corners]
+        return self._refine_corners(img, corners, max(sx, sy))
+
+    def _refine_corners(
+        self, img: np.ndarray, corners: list[tuple[float, float]], upscale: float
+    ) -> list[tuple[float, float]]:
+        """sub-pixel refine upscaled corners in small full-res windows around each one"""
+        h, w = img.shape[:2]
+        half = int(np.ceil(upscale * 2)) + 2  # covers ~2px of error at the detection level
+        pad = half * 2
+        criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.01)
+
+        refined = []
+        for x, y in corners:
+            x0, y0 = max(0, int(x) - pad), max(0, int(y) - pad)
+            x1, y1 = min(w, int(x) + pad + 1), min(h, int(y) + pad + 1)
+            lx, ly = x - x0, y - y0
+            # window must fit inside the crop; corners hugging the image edge stay as-is
+            if not (half + 1 <= lx < x1 - x0 - half - 1 and half + 1 <= ly < y1 - y0 - half - 1):
+                refined.append((float(x), float(y)))
+                continue
+
+            roi = cv2.cvtColor(img[y0:y1, x0:x1], cv2.COLOR_BGR2GRAY)
+            pt = np.array([[[lx, ly]]], dtype=np.float32)
+            cv2.cornerSubPix(roi, pt, (half, half), (-1, -1), criteria)
+            rx, ry = float(pt[0, 0, 0]) + x0, float(pt[0, 0, 1]) + y0
+            if abs(rx - x) > half or abs(ry - y) > half:
+                refined.append((float(x), float(y)))
+            else:
+                refined.append((rx, ry))
+        return refined
+
+    def _detect_on_level(self, img: np.ndarray) -> list[tuple[float, float]] | None:
+        """run the brightness + edge strategies on one pyramid level"""
         h, w = img.shape[:2]
         min_area = (h * w) * 0.05  # paper should be at least 5% of image
         max_area = (h * w) * 0.85  # but not more than 85% (exclude full-image detections)
         edge_margin = int(min(h, w) * 0.02)  # 2% margin from edges
 
         gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        timings: dict[str, float] = {}
 
         # try brightness-based detection first (paper is usually brightest)
-        bright_result = self._detect_bright_region(img, gray, min_area, max_area, edge_margin, h, w)
-        if bright_result:
-            return bright_result
-
-        # fallback to edge detection strategies
-        strategies = [
-            self._detect_canny(gray, 50, 150),
-            self._detect_canny(gray, 30, 100),
-            self._detect_canny(gray, 75, 200),
-            self._detect_adaptive_threshold(gray),
-            self._detect_saturation(img),
-        ]
+        result, winner = self._detect_bright_region(gray, min_area, max_area, edge_margin, h, w, timings)
+        if not result:
+            result, winner = self._detect_edges(img, gray, min_area, max_area, edge_margin, h, w, timings)
+
+        detection_stats.record(timings, winner)
+        logger.info(
+            "paper detection: winner=%s timings=%s",
+            winner, {k: round(v * 1000) for k, v in timings.items()},
+        )
+        return result
 
-        for edges in strategies:
-            if edges is None:
+    def _detect_bright_region(
+        self, gray: np.ndarray,
+        min_area: float, max_area: float, margin: int, h: int, w: int,
+        timings: dict[str, float],
+    ) -> tuple[list[tuple[float, float]] | None, str | None]:
+        """detect paper by finding bright white region. returns (corners, strategy name)."""
+        # all thresholds run concurrently but are accepted in a fixed order, so
+        # the result doesn't depend on which finishes first: the first one
+        # confident enough wins outright, otherwise the largest valid candidate
+        futures = [
+            (
+                f"bright_{thresh_val}",
+                _strategy_pool.submit(
+                    _timed,
+                    lambda t=thresh_val: self._try_brightness_threshold(gray, t, min_area, max_area, margin, h, w),
+                ),
+            )
+            for thresh_val in [200, 190, 180]
+        ]
+        best_result, best_name, best_area = None, None, 0
+        for i, (name, fut) in enumerate(futures):
+            (result, area, fill_ratio), elapsed = fut.result()
+            timings[name] = elapsed
+            if not result:
                 continue
+            if fill_ratio >= HIGH_CONFIDENCE_FILL:
+                for _, other in futures[i + 1:]:
+                    other.cancel()
+                return result, name
+            if area > best_area:
+                best_result, best_name, best_area = result, name, area
+        return best_result, best_name
 
-            result = self._find_paper_contour(edges, min_area, max_area, edge_margin, h, w)
-            if result:
-                return result
+    def _detect_edges(
+        self, img: np.ndarray, gray: np.ndarray,
+        min_area: float, max_area: float, margin: int, h: int, w: int,
+        timings: dict[str, float],
+    ) -> tuple[list[tuple[float, float]] | None, str | None]:
+        """fallback edge strategies, run concurrently but accepted in priority order"""
+        strategies: list[tuple[str, Callable[[], np.ndarray | None]]] = [
+            ("canny_50_150", lambda: self._detect_canny(gray, 50, 150)),
+            ("canny_30_100", lambda: self._detect_canny(gray, 30, 100)),
+            ("canny_75_200", lambda: self._detect_canny(gray, 75, 200)),
+            ("adaptive", lambda: self._detect_adaptive_threshold(gray)),
+            ("saturation", lambda: self._detect_saturation(img)),
+        ]
 
-        return None
+        def run(edge_fn):
+            edges = edge_fn()
+            if edges is None:
+                return None
+            return self._find_paper_contour(edges, min_area, max_area, margin, h, w)
 
-    def _detect_bright_region(
-        self, img: np.ndarray, gray: np.ndarray,
-        min_area: float, max_area: float, margin: int, h: int, w: int
-    ) -> list[tuple[float, float]] | None:
-        """detect paper by finding bright white region"""
-        # try all thresholds and pick the largest valid candidate
-        best_result = None
-        best_area = 0
-        for thresh_val in [200, 190, 180]:
-            result, area = self._try_brightness_threshold(
-                gray, thresh_val, min_area, max_area, margin, h, w
-            )
-            if result and area > best_area:
-                best_result = result
-                best_area = area
-        return best_result
+        futures = [
+            (name, _strategy_pool.submit(_timed, lambda fn=edge_fn: run(fn)))
+            for name, edge_fn in strategies
+        ]
+        for i, (name, fut) in enumerate(futures):
+            result, elapsed = fut.result()
+            timings[name] = elapsed
+            if result:
+                for _, other in futures[i + 1:]:
+                    other.cancel()
+                return result, name
+        return None, None
 
     def _try_brightness_threshold(
         self, gray: np.ndarray, thresh_val: int,
         min_area: float, max_area: float, margin: int, h: int, w: int
-    ) -> tuple[list[tuple[float, float]] | None, float]:
-        """try to find paper at a specific brightness threshold. returns (corners, area)."""
+    ) -> tuple[list[tuple[float, float]] | None, float, float]:
+        """try to find paper at a specific brightness threshold. returns (corners, area, fill ratio)."""
         _, thresh = cv2.threshold(gray, thresh_val, 255, cv2.THRESH_BINARY)
 
         # two-stage close: small kernel for noise, large kernel to bridge tool gaps
@@ -142,10 +270,10 @@ class ImageProcessor:
             corners = self._order_corners(box.astype(float))
             result = [(float(c[0]), float(c[1])) for c in corners]
             logger.info("paper detected: thresh=%d aspect=%.2f fill=%.2f area=%.0f", thresh_val, aspect, fill_ratio, best_area)
-            return result, best_area
+            return result, best_area, fill_ratio
 
         logger.debug("no paper found at thresh=%d", thresh_val)
-        return None, 0
+        return None, 0, 0.0
 
     def _find_paper_contour(
         self, edges: np.ndarray, min_area: float, max_area: float, margin: int, h: int, w: int
@@ -228,11 +356,18 @@ class ImageProcessor:
         image_path: str,
         corners: list[tuple[float, float]],
         paper_size: Literal["a4", "letter"],
+        max_margin_mm: float = DEFAULT_WARP_MARGIN_MM,
+        output_stem: str | None = None,
+        max_megapixels: float = DEFAULT_WARP_MAX_MEGAPIXELS,
     ) -> tuple[str, float]:
         """warp image to top-down view and return output path + scale factor.
-        includes the full visible area beyond the paper so oversized tools
-        are captured. paper is used for scale only."""
-        img = cv2.imread(image_path)
+        includes the visible area beyond the paper, up to max_margin_mm on each
+        side, so oversized tools are captured. paper is used for scale only.
+        the margins shrink evenly if the canvas would exceed max_megapixels
+        (the paper itself is always kept); that cap, times _warp_slots, is
+        the real bound on warp memory. output is written to
+        processed/{output_stem or image stem}_corrected."""
+        img = image_cache.get(image_path)
         src = np.array(corners, dtype="float32")
 
         width_mm, height_mm = PAPER_SIZES[paper_size]
@@ -266,15 +401,35 @@ class ImageProcessor:
         ).reshape(-1, 1, 2)
         warped_corners = cv2.perspectiveTransform(img_corners, M).reshape(-1, 2)
 
-        # cap to avoid extreme warp artifacts at vanishing points
-        max_extent = max(paper_w, paper_h) * 3
-        warped_corners = np.clip(warped_corners, -max_extent, max_extent)
+        # cap the canvas around the paper; also avoids extreme warp artifacts
+        # at vanishing points
+        margin = max_margin_mm * PX_PER_MM
+        warped_corners[:, 0] = np.clip(warped_corners[:, 0], -margin, paper_w + margin)
+        warped_corners[:, 1] = np.clip(warped_corners[:, 1], -margin, paper_h + margin)
 
         min_x = min(0.0, float(warped_corners[:, 0].min()))
         min_y = min(0.0, float(warped_corners[:, 1].min()))
         max_x = max(float(paper_w), float(warped_corners[:, 0].max()))
         max_y = max(float(paper_h), float(warped_corners[:, 1].max()))
 
+        # shrink the margins by a common factor k until the canvas fits:
+        # (paper_w + k*extra_w) * (paper_h + k*extra_h) <= cap
+        extra_w, extra_h = (max_x - min_x) - paper_w, (max_y - min_y) - paper_h
+        cap = max_megapixels * 1e6
+        if (paper_w + extra_w) * (paper_h + extra_h) > cap:
+            a = extra_w * extra_h
+            b = paper_w * extra_h + paper_h * extra_w
+            c = paper_w * paper_h - cap
+            if c >= 0:
+                k = 0.0
+            elif a > 0:
+                k = (-b + np.sqrt(b * b - 4 * a * c)) / (2 * a)
+            else:
+                k = -c / b
+            min_x, min_y = min_x * k, min_y * k
+            max_x = paper_w + (max_x - paper_w) * k
+            max_y = paper_h + (max_y - paper_h) * k
+
         # translate so all coords are positive
         tx, ty = -min_x, -min_y
         T = np.array([[1, 0, tx], [0, 1, ty], [0, 0, 1]], dtype="float64")
@@ -283,58 +438,92 @@ class ImageProcessor:
         out_w = int(np.ceil(max_x + tx))
         out_h = int(np.ceil(max_y + ty))
 
-        warped = cv2.warpPerspective(img, M_full, (out_w, out_h))
-
         base = Path(image_path)
         output_dir = base.parent.parent / "processed"
-        output_path = output_dir / f"{base.stem}_corrected{base.suffix}"
-        cv2.imwrite(str(output_path), warped)
+        output_path = output_dir / f"{output_stem or base.stem}_corrected{base.suffix}"
+        with _warp_slots:
+            warped = self._tiled_warp(img, M_full, out_w, out_h)
+            cv2.imwrite(str(output_path), warped)
+            del warped
 
         scale_factor = 1.0 / PX_PER_MM
         return str(output_path), scale_factor
 
-    def debug_contour_detection(
-        self, image_path: str, output_dir: Path
-    ) -> dict:
-        """run contour detection and save debug images for each step"""
-        img = cv2.imread(image_path)
+    def _tiled_warp(self, img: np.ndarray, M: np.ndarray, out_w: int, out_h: int) -> np.ndarray:
+        """warpPerspective in parallel tiles. each tile only reads the source
+        region that maps into it, which bounds the source reads and warp
+        scratch space. the output canvas is still allocated whole (imwrite
+        needs one array), so peak memory is set by the megapixel cap:
+        ~3 bytes per output pixel per warp holding a _warp_slots slot."""
+        h_src, w_src = img.shape[:2]
+        out = np.zeros((out_h, out_w) + img.shape[2:], dtype=img.dtype)
+        M_inv = np.linalg.inv(M)
+
+        def warp_tile(x0: int, y0: int, x1: int, y1: int):
+            tile_corners = np.array([[x0, y0, 1], [x1, y0, 1], [x1, y1, 1], [x0, y1, 1]], dtype="float64")
+            src_h = tile_corners @ M_inv.T
+            T = np.array([[1, 0, -x0], [0, 1, -y0], [0, 0, 1]], dtype="float64")
+            if np.all(src_h[:, 2] > 0):
+                # tile lies on the visible side of the horizon, so its source
+                # footprint is the bounding box of the back-projected corners
+                src_pts = src_h[:, :2] / src_h[:, 2:]
+                sx0 = int(np.clip(np.floor(src_pts[:, 0].min()) - 2, 0, w_src))
+                sy0 = int(np.clip(np.floor(src_pts[:, 1].min()) - 2, 0, h_src))
+                sx1 = int(np.clip(np.ceil(src_pts[:, 0].max()) + 3, 0, w_src))
+                sy1 = int(np.clip(np.ceil(src_pts[:, 1].max()) + 3, 0, h_src))
+                if sx1 <= sx0 or sy1 <= sy0:
+                    return  # maps entirely outside the photo, stays black
+            else:
+                sx0, sy0, sx1, sy1 = 0, 0, w_src, h_src
+            S = np.array([[1, 0, sx0], [0, 1, sy0], [0, 0, 1]], dtype="float64")
+            out[y0:y1, x0:x1] = cv2.warpPerspective(
+                img[sy0:sy1, sx0:sx1], T @ M @ S, (x1 - x0, y1 - y0)
+            )
+
+        futures = [
+            _warp_pool.submit(warp_tile, x0, y0, min(x0 + WARP_TILE, out_w), min(y0 + WARP_TILE, out_h))
+            for y0 in range(0, out_h, WARP_TILE)
+            for x0 in range(0, out_w, WARP_TILE)
+        ]
+        for fut in futures:
+            fut.result()
+        return out
+
+    def debug_contour_stages(self, image_path: str) -> tuple[dict[str, np.ndarray], dict] | None:
+        """run contour detection and return each intermediate image by stage
+        name (see DEBUG_STAGES) plus contour stats. None if unreadable."""
+        img = image_cache.get(image_path)
         if img is None:
-            return {"error": "could not read image"}
+            return None
 
         h, w = img.shape[:2]
-        results = {}
+        stages = {}
 
         # step 1: grayscale
         gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        cv2.imwrite(str(output_dir / "01_gray.jpg"), gray)
-        results["gray"] = "01_gray.jpg"
+        stages["gray"] = gray
 
         # step 2: CLAHE normalized
         clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
         normalized = clahe.apply(gray)
-        cv2.imwrite(str(output_dir / "02_clahe.jpg"), normalized)
-        results["clahe"] = "02_clahe.jpg"
+        stages["clahe"] = normalized
 
         # step 3: blur
         blur = cv2.GaussianBlur(normalized, (7, 7), 0)
-        cv2.imwrite(str(output_dir / "03_blur.jpg"), blur)
-        results["blur"] = "03_blur.jpg"
+        stages["blur"] = blur
 
         # step 4: canny edges
         edges = cv2.Canny(blur, 30, 100)
-        cv2.imwrite(str(output_dir / "04_canny.jpg"), edges)
-        results["canny"] = "04_canny.jpg"
+        stages["canny"] = edges
 
         # step 5: dilate edges
         kernel = np.ones((5, 5), np.uint8)
         dilated = cv2.dilate(edges, kernel, iterations=2)
-        cv2.imwrite(str(output_dir / "05_dilated.jpg"), dilated)
-        results["dilated"] = "05_dilated.jpg"
+        stages["dilated"] = dilated
 
         # step 6: close gaps
         closed = cv2.morphologyEx(dilated, cv2.MORPH_CLOSE, kernel, iterations=3)
-        cv2.imwrite(str(output_dir / "06_closed.jpg"), closed)
-        results["closed"] = "06_closed.jpg"
+        stages["closed"] = closed
 
         # step 7: flood fill from corners
         filled = closed.copy()
@@ -342,22 +531,21 @@ class ImageProcessor:
         cv2.floodFill(filled, mask, (0, 0), 255)
         filled_inv = cv2.bitwise_not(filled)
         final_mask = closed | filled_inv
-        cv2.imwrite(str(output_dir / "07_filled.jpg"), final_mask)
-        results["filled"] = "07_filled.jpg"
+        stages["filled"] = final_mask
 
         # step 8: cleanup
         final_clean = cv2.morphologyEx(final_mask, cv2.MORPH_OPEN, kernel, iterations=1)
-        cv2.imwrite(str(output_dir / "08_final.jpg"), final_clean)
-        results["final"] = "08_final.jpg"
+        stages["final"] = final_clean
 
         # step 9: contours on original
         contours, _ = cv2.findContours(final_clean, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
         contour_img = img.copy()
         cv2.drawContours(contour_img, contours, -1, (0, 255, 0), 2)
-        cv2.imwrite(str(output_dir / "09_contours.jpg"), contour_img)
-        results["contours"] = "09_contours.jpg"
-        results["contour_count"] = len(contours)
-        results["contour_areas"] = sorted([cv2.contourArea(c) for c in contours], reverse=True)[:10]
+        stages["contours"] = contour_img
 
-        return results
+        stats = {
+            "contour_count": len(contours),
+            "contour_areas": sorted([cv2.contourArea(c) for c in contours], reverse=True)[:10],
+        }
+        return stages, stats
 
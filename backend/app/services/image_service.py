@@ -1,28 +1,37 @@
 from pathlib import Path
-from PIL import Image
+
+import cv2
+
+from app.services.image_cache import image_cache
 
 
 def generate_tool_thumbnail(
-    src_img: Image.Image, poly_points, tool_id: str, output_dir: Path
+    image_path: str, poly_points, tool_id: str, output_dir: Path
 ) -> str | None:
     """crop and save a tool thumbnail. returns the file path or None."""
     try:
+        src_img = image_cache.get(image_path)
+        if src_img is None:
+            return None
+        img_h, img_w = src_img.shape[:2]
         px_xs = [p.x for p in poly_points]
         px_ys = [p.y for p in poly_points]
         pad = 20
         left = max(0, int(min(px_xs)) - pad)
         top = max(0, int(min(px_ys)) - pad)
-        right = min(src_img.width, int(max(px_xs)) + pad)
-        bottom = min(src_img.height, int(max(px_ys)) + pad)
-        crop = src_img.crop((left, top, right, bottom))
-        max_dim = max(crop.width, crop.height)
+        right = min(img_w, int(max(px_xs)) + pad)
+        bottom = min(img_h, int(max(px_ys)) + pad)
+        crop = src_img[top:bottom, left:right]
+        crop_h, crop_w = crop.shape[:2]
+        max_dim = max(crop_w, crop_h)
         if max_dim > 256:
             scale = 256 / max_dim
-            crop = crop.resize(
-                (int(crop.width * scale), int(crop.height * scale)), Image.LANCZOS
+            crop = cv2.resize(
+                crop, (int(crop_w * scale), int(crop_h * scale)), interpolation=cv2.INTER_AREA
             )
         thumb_file = output_dir / f"{tool_id}.jpg"
-        crop.convert("RGB").save(thumb_file, "JPEG", quality=80)
+        if not cv2.imwrite(str(thumb_file), crop, [cv2.IMWRITE_JPEG_QUALITY, 80]):
+            return None
         return str(thumb_file)
     except Exception:
         return None
@@ -0,0 +1,145 @@
+"""upload normalization.
+
+every stored photo is upright (exif orientation baked into the pixels),
+bounded in pixel count and, when it had to be re-encoded, a baseline jpeg,
+which is the cheapest format for the later decode-heavy steps. jpegs that
+need none of that are stored byte-for-byte to avoid generation loss.
+"""
+from __future__ import annotations
+
+import io
+import logging
+import math
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+import cv2
+import numpy as np
+from PIL import Image, ImageOps
+
+from app.config import settings
+from app.services.image_cache import image_cache, decode_bytes
+from app.services.image_processor import PAPER_SIZES, PX_PER_MM
+
+logger = logging.getLogger(__name__)
+
+try:
+    import pillow_heif
+    pillow_heif.register_heif_opener()
+except ImportError:
+    pass
+
+HEIC_EXTENSIONS = {".heic", ".heif"}
+JPEG_EXTENSIONS = {".jpg", ".jpeg"}
+EXIF_ORIENTATION = 0x0112
+
+# the warp renders the paper at PX_PER_MM. assuming the paper spans at least
+# two thirds of the photo's long side, this is the smallest long side that
+# still has a source pixel for every output pixel; downscaling stops here.
+MIN_LONG_SIDE = math.ceil(max(max(s) for s in PAPER_SIZES.values()) * PX_PER_MM * 1.5)
+
+_heic_pool: ProcessPoolExecutor | None = None
+_heic_pool_lock = threading.Lock()
+
+
+def _get_heic_pool() -> ProcessPoolExecutor:
+    # spawn, not fork: the parent is multithreaded. sized like ingest_pool,
+    # whose threads are what submit here, so a batch of heics decodes in parallel
+    global _heic_pool
+    with _heic_pool_lock:
+        if _heic_pool is None:
+            _heic_pool = ProcessPoolExecutor(
+                max_workers=settings.ingest_workers or os.cpu_count() or 2,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _heic_pool
+
+
+def _reset_heic_pool(broken: ProcessPoolExecutor):
+    global _heic_pool
+    with _heic_pool_lock:
+        if _heic_pool is broken:
+            _heic_pool = None
+    broken.shutdown(wait=False)
+
+
+def downscale_factor(width: int, height: int, max_pixels: int) -> float:
+    """scale (<= 1) that brings width*height under max_pixels without taking
+    the long side below MIN_LONG_SIDE"""
+    if max_pixels <= 0 or width * height <= max_pixels:
+        return 1.0
+    scale = math.sqrt(max_pixels / (width * height))
+    floor = MIN_LONG_SIDE / max(width, height)
+    return min(1.0, max(scale, floor))
+
+
+def _heic_to_jpeg(path: str, max_pixels: int, quality: int) -> bytes:
+    """decode, orient, downscale and re-encode a heic. runs in the heic
+    worker process so libheif never holds up the server."""
+    with Image.open(path) as im:
+        im = ImageOps.exif_transpose(im).convert("RGB")
+        scale = downscale_factor(im.width, im.height, max_pixels)
+        if scale < 1:
+            im = im.resize((round(im.width * scale), round(im.height * scale)), Image.Resampling.BOX)
+        buf = io.BytesIO()
+        im.save(buf, format="JPEG", quality=quality)
+        return buf.getvalue()
+
+
+def _exif_orientation(path: Path) -> int:
+    try:
+        with Image.open(path) as im:
+            return im.getexif().get(EXIF_ORIENTATION, 1)
+    except Exception:
+        return 1
+
+
+def _encode_jpeg(img: np.ndarray, quality: int) -> bytes:
+    ok, buf = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError("jpeg encode failed")
+    return buf.tobytes()
+
+
+def normalize_upload(raw_path: Path, dest_path: Path, max_pixels: int, quality: int):
+    """normalize a freshly stored upload into dest_path (a .jpg), remove
+    raw_path and prime the decoded-image cache with the result. raises
+    ValueError if it can't be decoded."""
+
+    if raw_path.suffix in HEIC_EXTENSIONS:
+        pool = _get_heic_pool()
+        try:
+            content = pool.submit(_heic_to_jpeg, str(raw_path), max_pixels, quality).result()
+        except BrokenProcessPool:
+            # a worker died (e.g. oom on a huge heic); start fresh next time
+            _reset_heic_pool(pool)
+            raise ValueError("heic conversion failed")
+    else:
+        # imread applies exif orientation itself; re-encoding drops the tag
+        img = cv2.imread(str(raw_path), cv2.IMREAD_COLOR)
+        if img is None:
+            raise ValueError("undecodable image")
+        h, w = img.shape[:2]
+        scale = downscale_factor(w, h, max_pixels)
+        if raw_path.suffix in JPEG_EXTENSIONS and scale == 1.0 and _exif_orientation(raw_path) == 1:
+            raw_path.replace(dest_path)
+            image_cache.put(dest_path, img)
+            return
+        if scale < 1:
+            img = cv2.resize(img, (round(w * scale), round(h * scale)), interpolation=cv2.INTER_AREA)
+        content = _encode_jpeg(img, quality)
+        logger.info("normalized upload %s: %dx%d -> scale %.2f", raw_path.name, w, h, scale)
+
+    decoded = decode_bytes(content)
+    if decoded is None:
+        raise ValueError("undecodable image")
+    tmp = dest_path.with_name(f".{raw_path.name}.tmp")
+    tmp.write_bytes(content)
+    tmp.replace(dest_path)
+    raw_path.unlink(missing_ok=True)
+    # cache what decoding the stored file gives, not the pre-encode array
+    image_cache.put(dest_path, decoded)
@@ -0,0 +1,255 @@
+"""reclaim storage that no store references any more.
+
+reconciles each user's artifact directories against their session, tool and
+bin stores: orphaned files and superseded tile pyramids are removed, debug
+output expires after a max age, and generated outputs (regenerable caches) are
+evicted least-recently-used first once a user exceeds the configured size cap.
+files younger than the grace period are never touched so in-flight requests
+can't lose data.
+"""
+from __future__ import annotations
+
+import logging
+import re
+import shutil
+import time
+from pathlib import Path
+from typing import Callable
+
+from app.services.usage_store import UsageStore, file_size
+
+logger = logging.getLogger(__name__)
+
+_UUID = r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}"
+_UPLOAD_RE = re.compile(rf"^({_UUID})\.\w+$")
+_PROCESSED_RE = re.compile(rf"^({_UUID})_.+$")
+_OUTPUT_RE = re.compile(rf"^({_UUID})(?:\.stl|\.3mf|\.hash|\.manifest\.json|_part\d+\.stl|_parts\.zip)$")
+_THUMB_RE = re.compile(rf"^({_UUID})\.jpg$")
+_BLOB_RE = re.compile(r"^([0-9a-f]{64})\.jpg$")
+
+
+class JanitorReport:
+    def __init__(self, dry_run: bool = False):
+        self.dry_run = dry_run
+        self.files: dict[str, int] = {}  # category -> files removed
+        self.bytes: dict[str, int] = {}  # category -> bytes reclaimed
+        self.duration_s = 0.0
+
+    def record(self, category: str, size: int):
+        self.files[category] = self.files.get(category, 0) + 1
+        self.bytes[category] = self.bytes.get(category, 0) + size
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(self.bytes.values())
+
+    def as_dict(self) -> dict:
+        return {
+            "dryRun": self.dry_run,
+            "files": self.files,
+            "bytes": self.bytes,
+            "totalBytes": self.total_bytes,
+            "durationS": round(self.duration_s, 3),
+        }
+
+
+class Janitor:
+    def __init__(
+        self,
+        storage_path: Path,
+        get_stores: Callable,
+        usage_store: UsageStore,
+        get_blob_store: Callable | None = None,
+        grace_s: int = 3600,
+        debug_max_age_s: int = 86400,
+        mask_max_age_s: int = 30 * 86400,
+        outputs_max_bytes: int = 0,
+    ):
+        self.storage_path = storage_path
+        self.get_stores = get_stores
+        self.usage_store = usage_store
+        self.get_blob_store = get_blob_store
+        self.grace_s = grace_s
+        self.debug_max_age_s = debug_max_age_s
+        self.mask_max_age_s = mask_max_age_s
+        self.outputs_max_bytes = outputs_max_bytes
+        self.last_report: JanitorReport | None = None
+
+    def run(self, dry_run: bool = False) -> JanitorReport:
+        start = time.perf_counter()
+        report = JanitorReport(dry_run=dry_run)
+        if self.storage_path.exists():
+            for user_dir in sorted(self.storage_path.iterdir()):
+                if user_dir.is_dir():
+                    try:
+                        self._sweep_user(user_dir, report)
+                    except Exception:
+                        logger.exception("janitor failed for user %s", user_dir.name)
+        report.duration_s = time.perf_counter() - start
+        self.last_report = report
+        logger.info(
+            "janitor %s %d bytes in %.1fs: %s",
+            "would reclaim" if dry_run else "reclaimed",
+            report.total_bytes, report.duration_s, report.files,
+        )
+        return report
+
+    def _remove(self, path: Path, category: str, report: JanitorReport, user_id: str) -> int:
+        size = _tree_size(path) if path.is_dir() else file_size(path)
+        if not report.dry_run:
+            if path.is_dir():
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                path.unlink(missing_ok=True)
+            self.usage_store.add(user_id, -size)
+        report.record(category, size)
+        return size
+
+    def _sweep_user(self, user_dir: Path, report: JanitorReport):
+        user_id = user_dir.name
+        sessions_store, tools_store, bins_store = self.get_stores(user_id)
+        sessions = sessions_store.all()
+        tools = tools_store.all()
+        bins = bins_store.all()
+        now = time.time()
+
+        def settled(p: Path) -> bool:
+            try:
+                return now - p.stat().st_mtime > self.grace_s
+            except OSError:
+                return False
+
+        referenced: set[str] = set()
+        for s in sessions.values():
+            for rel in (s.original_image_path, s.corrected_image_path, s.mask_image_path):
+                if rel:
+                    referenced.add(Path(rel).name)
+
+        for sub, pattern in (("uploads", _UPLOAD_RE), ("processed", _PROCESSED_RE)):
+            for f in _files(user_dir / sub):
+                m = pattern.match(f.name)
+                if not m or not settled(f):
+                    continue
+                if m.group(1) not in sessions:
+                    self._remove(f, f"orphan_{sub}", report, user_id)
+                elif f.name not in referenced:
+                    self._remove(f, f"superseded_{sub}", report, user_id)
+
+        # content-addressed uploads shared between sessions
+        blobs = self.get_blob_store(user_id) if self.get_blob_store else None
+        for f in _files(user_dir / "uploads"):
+            m = _BLOB_RE.match(f.name)
+            if m and f.name not in referenced and settled(f) and not (blobs and blobs.held(m.group(1))):
+                self._remove(f, "orphan_blobs", report, user_id)
+                if blobs and not report.dry_run:
+                    blobs.delete(m.group(1))
+        if blobs and not report.dry_run:
+            for digest, blob in blobs.all().items():
+                if not (self.storage_path / blob.path).exists():
+                    blobs.delete(digest)
+
+        for f in _files(user_dir / "tools"):
+            m = _THUMB_RE.match(f.name)
+            if m and m.group(1) not in tools and settled(f):
+                self._remove(f, "orphan_thumbnails", report, user_id)
+
+        debug_root = user_dir / "debug"
+        if debug_root.is_dir():
+            for d in debug_root.iterdir():
+                if d.name not in sessions and settled(d):
+                    self._remove(d, "orphan_debug", report, user_id)
+                elif now - _newest_mtime(d) > self.debug_max_age_s:
+                    self._remove(d, "expired_debug", report, user_id)
+
+        # cached masks aren't referenced by any store; they just expire
+        for f in _files(user_dir / "masks"):
+            if now - _last_used(f) > self.mask_max_age_s:
+                self._remove(f, "expired_masks", report, user_id)
+
+        # tile pyramids: tiles/{session_id}/{version}, only the session's current version is kept
+        tiles_root = user_dir / "tiles"
+        if tiles_root.is_dir():
+            for d in tiles_root.iterdir():
+                session = sessions.get(d.name)
+                if session is None:
+                    if settled(d):
+                        self._remove(d, "orphan_tiles", report, user_id)
+                    continue
+                current = session.tiles.version if session.tiles else None
+                for v in d.iterdir():
+                    if v.name != current and settled(v):
+                        self._remove(v, "superseded_tiles", report, user_id)
+
+        # outputs grouped per session/bin; orphans go, live groups are LRU-capped
+        groups: dict[str, list[Path]] = {}
+        for f in _files(user_dir / "outputs"):
+            m = _OUTPUT_RE.match(f.name)
+            if m:
+                groups.setdefault(m.group(1), []).append(f)
+
+        live = []
+        for entity_id, files in groups.items():
+            if entity_id in sessions or entity_id in bins:
+                live.append((entity_id, files))
+            elif all(settled(f) for f in files):
+                for f in files:
+                    self._remove(f, "orphan_outputs", report, user_id)
+
+        if self.outputs_max_bytes > 0:
+            self._evict_outputs(user_id, live, sessions_store, bins_store, report)
+
+    def _evict_outputs(self, user_id: str, live: list, sessions_store, bins_store, report: JanitorReport):
+        total = sum(file_size(f) for _, files in live for f in files)
+        if total <= self.outputs_max_bytes:
+            return
+
+        def last_used(item) -> float:
+            return max(_last_used(f) for f in item[1])
+
+        for entity_id, files in sorted(live, key=last_used):
+            if total <= self.outputs_max_bytes:
+                break
+            if any(not self._older_than_grace(f) for f in files):
+                continue
+            for f in files:
+                total -= self._remove(f, "evicted_outputs", report, user_id)
+            if report.dry_run:
+                continue
+            # outputs are a cache; drop the reference so the ui offers regeneration
+            session = sessions_store.get(entity_id)
+            if session and session.stl_path:
+                session.stl_path = None
+                sessions_store.set(entity_id, session)
+            bin_data = bins_store.get(entity_id)
+            if bin_data and bin_data.stl_path:
+                bin_data.stl_path = None
+                bins_store.set(entity_id, bin_data)
+
+    def _older_than_grace(self, p: Path) -> bool:
+        return time.time() - _last_used(p) > self.grace_s
+
+
+def _files(path: Path) -> list[Path]:
+    if not path.is_dir():
+        return []
+    return [f for f in path.iterdir() if f.is_file()]
+
+
+def _tree_size(path: Path) -> int:
+    return sum(file_size(f) for f in path.rglob("*") if f.is_file())
+
+
+def _newest_mtime(path: Path) -> float:
+    try:
+        times = [path.stat().st_mtime] + [f.stat().st_mtime for f in path.rglob("*")]
+    except OSError:
+        return time.time()
+    return max(times)
+
+
+def _last_used(p: Path) -> float:
+    try:
+        st = p.stat()
+    except OSError:
+        return time.time()
+    return max(st.st_atime, st.st_mtime)
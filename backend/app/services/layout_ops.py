@@ -0,0 +1,121 @@
+"""apply op-based patches to polygon and placed-tool lists.
+
+ops are applied to a shallow copy of the list; only the items an op touches
+are copied, so a failing op leaves the stored record untouched. lookups that
+miss raise LookupError, conflicting ops raise ValueError.
+"""
+import math
+
+from app.models.schemas import (
+    Point,
+    Polygon,
+    PlacedTool,
+    AddPolygonOp,
+    UpdatePolygonOp,
+    RemovePolygonOp,
+    AddFingerHoleOp,
+    UpdateFingerHoleOp,
+    RemoveFingerHoleOp,
+    AddPlacedToolOp,
+    RemovePlacedToolOp,
+    MovePlacedToolOp,
+    RotatePlacedToolOp,
+)
+
+
+def _index(items: list, item_id: str, kind: str) -> int:
+    for i, item in enumerate(items):
+        if item.id == item_id:
+            return i
+    raise LookupError(f"{kind} {item_id} not found")
+
+
+def _apply_finger_hole_op(item, op):
+    """return a copy of a polygon/placed tool with the finger hole op applied"""
+    holes = list(item.finger_holes)
+    if isinstance(op, AddFingerHoleOp):
+        if any(fh.id == op.finger_hole.id for fh in holes):
+            raise ValueError(f"finger hole {op.finger_hole.id} already exists")
+        holes.append(op.finger_hole)
+    elif isinstance(op, UpdateFingerHoleOp):
+        holes[_index(holes, op.finger_hole.id, "finger hole")] = op.finger_hole
+    else:
+        del holes[_index(holes, op.finger_hole_id, "finger hole")]
+    return item.model_copy(update={"finger_holes": holes})
+
+
+def apply_polygon_ops(polygons: list[Polygon], ops: list) -> list[Polygon]:
+    result = list(polygons)
+    for op in ops:
+        if isinstance(op, AddPolygonOp):
+            if any(p.id == op.polygon.id for p in result):
+                raise ValueError(f"polygon {op.polygon.id} already exists")
+            result.append(op.polygon)
+        elif isinstance(op, UpdatePolygonOp):
+            result[_index(result, op.polygon.id, "polygon")] = op.polygon
+        elif isinstance(op, RemovePolygonOp):
+            del result[_index(result, op.polygon_id, "polygon")]
+        else:
+            i = _index(result, op.target_id, "polygon")
+            result[i] = _apply_finger_hole_op(result[i], op)
+    return result
+
+
+def _move(pt: PlacedTool, dx: float, dy: float) -> PlacedTool:
+    return pt.model_copy(update={
+        "points": [Point(x=p.x + dx, y=p.y + dy) for p in pt.points],
+        "finger_holes": [fh.model_copy(update={"x": fh.x + dx, "y": fh.y + dy}) for fh in pt.finger_holes],
+        "interior_rings": [
+            [Point(x=p.x + dx, y=p.y + dy) for p in ring]
+            for ring in pt.interior_rings
+        ],
+    })
+
+
+def _rotate(pt: PlacedTool, angle: float, cx: float | None, cy: float | None) -> PlacedTool:
+    if cx is None or cy is None:
+        n = len(pt.points) or 1
+        cx = sum(p.x for p in pt.points) / n
+        cy = sum(p.y for p in pt.points) / n
+    rad = math.radians(angle)
+    cos_r, sin_r = math.cos(rad), math.sin(rad)
+
+    def rot(x: float, y: float) -> tuple[float, float]:
+        dx, dy = x - cx, y - cy
+        return cx + dx * cos_r - dy * sin_r, cy + dx * sin_r + dy * cos_r
+
+    def rot_pts(pts: list[Point]) -> list[Point]:
+        return [Point(x=x, y=y) for x, y in (rot(p.x, p.y) for p in pts)]
+
+    holes = []
+    for fh in pt.finger_holes:
+        x, y = rot(fh.x, fh.y)
+        holes.append(fh.model_copy(update={"x": x, "y": y}))
+
+    return pt.model_copy(update={
+        "points": rot_pts(pt.points),
+        "finger_holes": holes,
+        "interior_rings": [rot_pts(ring) for ring in pt.interior_rings],
+        "rotation": (pt.rotation + angle) % 360,
+    })
+
+
+def apply_placed_tool_ops(placed: list[PlacedTool], ops: list) -> list[PlacedTool]:
+    result = list(placed)
+    for op in ops:
+        if isinstance(op, AddPlacedToolOp):
+            if any(pt.id == op.placed_tool.id for pt in result):
+                raise ValueError(f"placed tool {op.placed_tool.id} already exists")
+            result.append(op.placed_tool)
+        elif isinstance(op, RemovePlacedToolOp):
+            del result[_index(result, op.placed_tool_id, "placed tool")]
+        elif isinstance(op, MovePlacedToolOp):
+            i = _index(result, op.placed_tool_id, "placed tool")
+            result[i] = _move(result[i], op.dx, op.dy)
+        elif isinstance(op, RotatePlacedToolOp):
+            i = _index(result, op.placed_tool_id, "placed tool")
+            result[i] = _rotate(result[i], op.angle, op.cx, op.cy)
+        else:
+            i = _index(result, op.target_id, "placed tool")
+            result[i] = _apply_finger_hole_op(result[i], op)
+    return result
@@ -0,0 +1,219 @@
+"""offline tool segmentation with classical cv.
+
+the corrected image is a top-down view of tools on white paper, which is
+constrained enough to segment without a model: find the paper, model its
+illumination, mark pixels that are much darker or more saturated than the
+paper would be there, drop smooth neutral regions (shadows, stains), and
+refine the edges with grabcut. the result is written as a black-on-white
+mask, the same format gemini returns, so _trace_mask handles both.
+
+only tools on the paper are found; anything past its edge is background.
+"""
+from __future__ import annotations
+
+import logging
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from app.services.image_cache import image_cache
+
+logger = logging.getLogger(__name__)
+
+WORK_DIM = 1024  # segmentation runs at this long side
+GRABCUT_DIM = 640  # grabcut is the slow step; it segments the tool region at most this size
+GRABCUT_LEARN_DIM = 240  # its colour models are learned on a copy this small
+GRABCUT_ITERATIONS = 2
+
+DARK_RATIO = 0.62  # below this fraction of the paper's brightness: tool
+MID_RATIO = 0.90  # below this: tool if textured or coloured, else shadow
+CHROMA_MIN = 18  # lab chroma above the paper's own tint: coloured tool
+TEXTURE_MIN = 0.035  # local std of the brightness ratio; shadows are smoother
+
+
+def _paper_rect(gray: np.ndarray) -> tuple[int, int, int, int] | None:
+    """bounding box (x, y, w, h) of the paper: the largest bright component"""
+    _, bright = cv2.threshold(cv2.GaussianBlur(gray, (5, 5), 0), 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    n, _, stats, _ = cv2.connectedComponentsWithStats(bright, connectivity=4)
+    if n < 2:
+        return None
+    best = 1 + int(np.argmax(stats[1:, cv2.CC_STAT_AREA]))
+    x, y, w, h, area = stats[best]
+    if area < 0.1 * gray.size:
+        return None
+    # stay clear of the paper edge and its shadow line
+    inset = max(2, round(0.01 * min(w, h)))
+    return x + inset, y + inset, w - 2 * inset, h - 2 * inset
+
+
+def _illumination(lum: np.ndarray) -> np.ndarray:
+    """smooth model of the paper's brightness: a quadratic surface fitted to
+    the brighter pixels, refitted once without outliers"""
+    h, w = lum.shape
+    ys, xs = np.mgrid[0:h:4, 0:w:4]
+    vals = lum[::4, ::4].astype(np.float64).ravel()
+    xn, yn = xs.ravel() / w, ys.ravel() / h
+    basis = np.stack([np.ones_like(xn), xn, yn, xn * xn, xn * yn, yn * yn], axis=1)
+    keep = vals >= np.percentile(vals, 40)
+    for _ in range(2):
+        coef, *_ = np.linalg.lstsq(basis[keep], vals[keep], rcond=None)
+        resid = vals - basis @ coef
+        keep = resid > -2.5 * max(1.0, resid[keep].std())
+    gy, gx = np.mgrid[0:h, 0:w]
+    gx, gy = gx / w, gy / h
+    surface = coef[0] + coef[1] * gx + coef[2] * gy + coef[3] * gx * gx + coef[4] * gx * gy + coef[5] * gy * gy
+    return np.maximum(surface, 1.0).astype(np.float32)
+
+
+def _foreground(roi: np.ndarray) -> np.ndarray:
+    """uint8 0/255 tool mask for a paper-only bgr region"""
+    lab = cv2.cvtColor(roi, cv2.COLOR_BGR2LAB)
+    lum = lab[:, :, 0]
+    ratio = lum.astype(np.float32) / _illumination(lum)
+
+    a = lab[:, :, 1].astype(np.float32) - 128
+    b = lab[:, :, 2].astype(np.float32) - 128
+    chroma = np.sqrt(a * a + b * b)
+    paper = ratio > MID_RATIO
+    tint = float(np.median(chroma[paper])) if paper.any() else 0.0
+
+    mean = cv2.blur(ratio, (7, 7))
+    std = np.sqrt(np.maximum(cv2.blur(ratio * ratio, (7, 7)) - mean * mean, 0))
+
+    dark = ratio < DARK_RATIO
+    coloured = (chroma - tint > CHROMA_MIN) & (ratio < 0.99)
+    textured = (ratio < MID_RATIO) & (std > TEXTURE_MIN)
+    fg = (dark | coloured | textured).astype(np.uint8) * 255
+
+    # sharp edges mark tool outlines. an edge needs one stretch above the high
+    # threshold, which soft shadow and stain edges never reach on their own;
+    # the low one lets it follow the outline through low-contrast stretches
+    edges = cv2.Canny(cv2.GaussianBlur(lum, (3, 3), 0), 25, 160)
+    fg |= edges & (ratio < 0.97).astype(np.uint8) * 255
+
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
+    fg = cv2.morphologyEx(fg, cv2.MORPH_CLOSE, kernel, iterations=2)
+
+    # non-paper pixels in regions enclosed by the mask are tool interiors
+    # (e.g. the smooth middle of a chrome spanner); paper stays open, so real
+    # holes survive even when an outline gap joins them to an interior
+    n, labels, stats, _ = cv2.connectedComponentsWithStats(cv2.bitwise_not(fg), connectivity=4)
+    h, w = fg.shape
+    paper_counts = np.bincount(labels.ravel(), weights=paper.ravel(), minlength=n)
+    x, y, cw, ch, area = (stats[:, i] for i in range(5))
+    enclosed = (x > 0) & (y > 0) & (x + cw < w) & (y + ch < h)
+    fill = enclosed & (paper_counts < area)
+    fill[0] = False
+    fg[fill[labels] & ~paper] = 255
+
+    fg = cv2.morphologyEx(fg, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3)))
+
+    # keep components with enough clearly-tool pixels, or whose outline is
+    # mostly sharp edges; shadows and stains have neither
+    n, labels, stats, _ = cv2.connectedComponentsWithStats(fg, connectivity=8)
+    strong = (dark | coloured).ravel()
+    strong_counts = np.bincount(labels.ravel(), weights=strong, minlength=n)
+    border = (fg > 0) & (cv2.erode(fg, kernel) == 0)
+    sharp = cv2.dilate(edges, kernel) > 0
+    border_counts = np.bincount(labels[border], minlength=n)
+    sharp_counts = np.bincount(labels[border], weights=sharp[border], minlength=n)
+    area = stats[:, cv2.CC_STAT_AREA]
+    min_area = max(16, fg.size // 4000)
+    keep = (area >= min_area) & ((strong_counts >= 0.05 * area) | (sharp_counts >= 0.6 * border_counts))
+    keep[0] = False
+    return np.where(keep[labels], 255, 0).astype(np.uint8)
+
+
+def _grabcut_labels(fg: np.ndarray) -> np.ndarray:
+    """grabcut's initial labels from a rough mask: sure inside, probable
+    either side of the edge, background beyond"""
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
+    sure_fg = cv2.erode(fg, kernel)
+    near = cv2.dilate(fg, kernel, iterations=2)
+    gc = np.full(fg.shape, cv2.GC_BGD, np.uint8)
+    gc[near > 0] = cv2.GC_PR_BGD
+    gc[fg > 0] = cv2.GC_PR_FGD
+    gc[sure_fg > 0] = cv2.GC_FGD
+    return gc
+
+
+def _resized(img: np.ndarray, fg: np.ndarray, dim: int) -> tuple[np.ndarray, np.ndarray]:
+    scale = min(1.0, dim / max(fg.shape))
+    if scale == 1:
+        return img, fg
+    size = (round(fg.shape[1] * scale), round(fg.shape[0] * scale))
+    return cv2.resize(img, size, interpolation=cv2.INTER_AREA), cv2.resize(fg, size, interpolation=cv2.INTER_NEAREST)
+
+
+def _grabcut(roi: np.ndarray, fg: np.ndarray) -> np.ndarray:
+    """refine a rough mask's edges with grabcut on the tools' bounding region.
+
+    most of grabcut's time goes on fitting its colour models, which don't need
+    the detail: they're learned at GRABCUT_LEARN_DIM, then a single pass at
+    GRABCUT_DIM with the models frozen places the edges."""
+    ys, xs = np.nonzero(fg)
+    if len(xs) == 0:
+        return fg
+    h, w = fg.shape
+    pad = 12
+    x0, x1 = max(0, xs.min() - pad), min(w, xs.max() + pad + 1)
+    y0, y1 = max(0, ys.min() - pad), min(h, ys.max() + pad + 1)
+    sub_img, sub_fg = _resized(roi[y0:y1, x0:x1], fg[y0:y1, x0:x1], GRABCUT_DIM)
+    learn_img, learn_fg = _resized(sub_img, sub_fg, GRABCUT_LEARN_DIM)
+
+    bgd_model, fgd_model = np.zeros((1, 65), np.float64), np.zeros((1, 65), np.float64)
+    gc = _grabcut_labels(sub_fg)
+    try:
+        cv2.grabCut(
+            learn_img, _grabcut_labels(learn_fg), None, bgd_model, fgd_model,
+            GRABCUT_ITERATIONS, cv2.GC_INIT_WITH_MASK,
+        )
+        cv2.grabCut(sub_img, gc, None, bgd_model, fgd_model, 1, cv2.GC_EVAL_FREEZE_MODEL)
+    except cv2.error:
+        # e.g. no background samples left; the rough mask is still usable
+        return fg
+    refined = np.where((gc == cv2.GC_FGD) | (gc == cv2.GC_PR_FGD), 255, 0).astype(np.uint8)
+    if refined.shape != (y1 - y0, x1 - x0):
+        refined = cv2.resize(refined, (x1 - x0, y1 - y0), interpolation=cv2.INTER_LINEAR)
+        refined = np.where(refined > 127, 255, 0).astype(np.uint8)
+    out = np.zeros_like(fg)
+    out[y0:y1, x0:x1] = refined
+    return out
+
+
+def segment_tools(image_path: str, output_path: str, grabcut: bool = True) -> str | None:
+    """write a black-tools-on-white mask of a corrected image to output_path.
+    returns output_path, or None if the image or the paper can't be found."""
+    start = time.perf_counter()
+    img = image_cache.get(image_path)
+    if img is None:
+        return None
+    h, w = img.shape[:2]
+    scale = min(1.0, WORK_DIM / max(h, w))
+    small = cv2.resize(img, (round(w * scale), round(h * scale)), interpolation=cv2.INTER_AREA) if scale < 1 else img
+
+    rect = _paper_rect(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY))
+    if rect is None:
+        logger.info("local segmentation: no paper found in %s", Path(image_path).name)
+        return None
+    x, y, rw, rh = rect
+    roi = small[y:y + rh, x:x + rw]
+    fg = _foreground(roi)
+    if grabcut:
+        fg = _grabcut(roi, fg)
+
+    mask = np.zeros(small.shape[:2], np.uint8)
+    mask[y:y + rh, x:x + rw] = fg
+    if scale < 1:
+        # linear then threshold gives smoother full-res edges than nearest
+        mask = cv2.resize(mask, (w, h), interpolation=cv2.INTER_LINEAR)
+    _, mask = cv2.threshold(mask, 127, 255, cv2.THRESH_BINARY_INV)
+
+    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+    # 1-bit png: several times faster to write than 8-bit at full resolution,
+    # and reads back as the same 0/255 grayscale
+    cv2.imwrite(output_path, mask, [cv2.IMWRITE_PNG_BILEVEL, 1, cv2.IMWRITE_PNG_COMPRESSION, 1])
+    logger.info("local segmentation of %s took %.0fms", Path(image_path).name, (time.perf_counter() - start) * 1000)
+    return output_path
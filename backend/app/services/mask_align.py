@@ -0,0 +1,212 @@
+"""aligning flash masks with the photo they were generated from.
+
+gemini flash returns masks at arbitrary dimensions. after resizing to the
+photo's, the silhouettes can still be offset by hundreds of pixels and
+stretched by a few percent per axis. two aligners estimate the correction:
+
+- template: matchTemplate of the largest tool against the inverted photo,
+  in a window around where it is. translation only.
+- phase: phase correlation over the whole mask on a coarse-to-fine pyramid,
+  with a per-axis scale search at the coarsest level that's narrowed at each
+  finer one. finds any shift up to half the image.
+
+both are scored the same way, by normalized cross-correlation of the aligned
+mask with the photo's darkness at WORK_DIM, against the unaligned mask's
+score. phase is the default, since in tests/benchmark_mask_align.py auto
+barely improves on it and mostly adds template's cost. "auto" runs both and
+keeps the better one per mask; align_stats counts how often each wins and
+what it costs.
+"""
+from __future__ import annotations
+
+import logging
+import math
+import time
+from dataclasses import dataclass
+
+import cv2
+import numpy as np
+
+from app.services.strategy_stats import StrategyStats
+
+logger = logging.getLogger(__name__)
+
+WORK_DIM = 1024  # finest pyramid level, and where alignments are scored
+PYRAMID_LEVELS = 3  # 256, 512, 1024; a coarser start picks the wrong scale
+SCALE_RANGE = 0.15  # per-axis scale searched at the coarsest level
+SCALE_STEP = 0.05  # halved at each finer level
+MIN_GAIN = 0.01  # ncc an alignment must add over leaving the mask alone
+
+ALIGNERS = ("phase", "template")
+
+align_stats = StrategyStats()
+
+
+@dataclass
+class Alignment:
+    method: str
+    dx: float = 0.0  # full-res pixels
+    dy: float = 0.0
+    sx: float = 1.0  # about the image center
+    sy: float = 1.0
+    confidence: float = 0.0  # the method's own peak: phase response or template score
+    score: float = 0.0  # ncc with the photo after alignment
+    elapsed_s: float = 0.0
+
+    def matrix(self, w: int, h: int) -> np.ndarray:
+        return _affine(self.sx, self.sy, self.dx, self.dy, w, h)
+
+
+def _affine(sx: float, sy: float, dx: float, dy: float, w: int, h: int) -> np.ndarray:
+    cx, cy = w / 2, h / 2
+    return np.float32([[sx, 0, cx * (1 - sx) + dx], [0, sy, cy * (1 - sy) + dy]])
+
+
+def _warp(img: np.ndarray, sx: float, sy: float, dx: float, dy: float) -> np.ndarray:
+    h, w = img.shape[:2]
+    return cv2.warpAffine(img, _affine(sx, sy, dx, dy, w, h), (w, h), flags=cv2.INTER_LINEAR)
+
+
+def _ncc(a: np.ndarray, b: np.ndarray) -> float:
+    a = a - a.mean()
+    b = b - b.mean()
+    return float((a * b).sum() / (math.sqrt(float((a * a).sum() * (b * b).sum())) + 1e-9))
+
+
+def _downscale(img: np.ndarray, factor: int) -> np.ndarray:
+    # integer factors take opencv's fast INTER_AREA path
+    if factor <= 1:
+        return img
+    return cv2.resize(img, None, fx=1 / factor, fy=1 / factor, interpolation=cv2.INTER_AREA)
+
+
+def _signals(thresh: np.ndarray, gray: np.ndarray) -> tuple[np.ndarray, np.ndarray, float]:
+    """mask and photo darkness as float images at about WORK_DIM, plus the
+    work/full-res scale. darkness is 0 on paper and rises towards black."""
+    h, w = thresh.shape[:2]
+    factor = max(1, math.ceil(max(w, h) / WORK_DIM))
+    mask = _downscale(thresh, factor).astype(np.float32) / 255
+    g = _downscale(gray, factor).astype(np.float32)
+    paper = max(float(np.percentile(g, 90)), 1.0)
+    dark = np.clip((paper - g) / paper, 0, 1)
+    return mask, dark, mask.shape[1] / w
+
+
+def phase_align(mask: np.ndarray, dark: np.ndarray) -> tuple[float, float, float, float, float]:
+    """(sx, sy, dx, dy, response) mapping mask onto dark, in work pixels"""
+    levels = [(mask, dark)]
+    for _ in range(PYRAMID_LEVELS - 1):
+        levels.append((cv2.pyrDown(levels[-1][0]), cv2.pyrDown(levels[-1][1])))
+
+    grid = np.arange(1 - SCALE_RANGE, 1 + SCALE_RANGE + 1e-9, SCALE_STEP)
+    candidates = [(sx, sy) for sx in grid for sy in grid]
+    step = SCALE_STEP
+    sx = sy = 1.0
+    dx = dy = 0.0
+    response = 0.0
+    for i, (m, d) in enumerate(reversed(levels)):
+        level_scale = 2.0 ** (len(levels) - 1 - i)
+        base = (dx / level_scale, dy / level_scale)
+        window = cv2.createHanningWindow((m.shape[1], m.shape[0]), cv2.CV_32F)
+        best = None
+        for csx, csy in candidates:
+            # phase correlation gives the shift left once the scale is applied;
+            # the scale is picked by how well the result matches
+            (ddx, ddy), resp = cv2.phaseCorrelate(_warp(m, csx, csy, *base), d, window)
+            cdx, cdy = base[0] + ddx, base[1] + ddy
+            score = _ncc(_warp(m, csx, csy, cdx, cdy), d)
+            if best is None or score > best[0]:
+                best = (score, csx, csy, cdx, cdy, resp)
+        _, sx, sy, dx, dy, response = best
+        dx, dy = dx * level_scale, dy * level_scale
+        step /= 2
+        candidates = [(sx + a * step, sy + b * step) for a in (-1, 0, 1) for b in (-1, 0, 1)]
+    return sx, sy, dx, dy, response
+
+
+def template_align(thresh: np.ndarray, gray: np.ndarray) -> tuple[float, float, float] | None:
+    """(dx, dy, score) in full-res pixels from matching the largest tool
+    against the inverted photo at 0.25x, or None if there's nothing to match"""
+    h, w = thresh.shape[:2]
+    work = 0.25
+    ww, wh = int(w * work), int(h * work)
+    if ww < 64 or wh < 64:
+        return None
+
+    mask_s = cv2.resize(thresh, (ww, wh), interpolation=cv2.INTER_NEAREST)
+    corr_s = cv2.resize(255 - gray, (ww, wh), interpolation=cv2.INTER_AREA)
+
+    # find tool bbox in reduced mask
+    contours, _ = cv2.findContours(mask_s, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return None
+    largest = max(contours, key=cv2.contourArea)
+    bx, by, bw, bh = cv2.boundingRect(largest)
+
+    # template: tool region with padding for context
+    pad = 30
+    tx1, ty1 = max(0, bx - pad), max(0, by - pad)
+    tx2, ty2 = min(ww, bx + bw + pad), min(wh, by + bh + pad)
+    template = mask_s[ty1:ty2, tx1:tx2].astype(np.float32)
+
+    # search region: template area plus margin for shift detection
+    margin = 75  # ~300px at full resolution
+    sx1, sy1 = max(0, tx1 - margin), max(0, ty1 - margin)
+    sx2, sy2 = min(ww, tx2 + margin), min(wh, ty2 + margin)
+    search = corr_s[sy1:sy2, sx1:sx2].astype(np.float32)
+
+    if template.shape[0] >= search.shape[0] or template.shape[1] >= search.shape[1]:
+        return None
+
+    result = cv2.matchTemplate(search, template, cv2.TM_CCOEFF_NORMED)
+    _, max_val, _, max_loc = cv2.minMaxLoc(result)
+
+    # shift = matched position minus expected position
+    dx = (max_loc[0] - (tx1 - sx1)) / work
+    dy = (max_loc[1] - (ty1 - sy1)) / work
+    if max_val < 0.15 or abs(dx) > max(w, h) * 0.1 or abs(dy) > max(w, h) * 0.1:
+        return None
+    return dx, dy, max_val
+
+
+def align_mask(thresh: np.ndarray, original: np.ndarray, method: str = "phase") -> tuple[np.ndarray, Alignment]:
+    """align a binary mask (tool=255) with the bgr photo it was made from.
+    method is "phase", "template", or "auto" to run both and keep whichever
+    scores better.
+    returns the aligned mask and the alignment applied (method "none" when
+    no candidate beat leaving it alone)."""
+    h, w = thresh.shape[:2]
+    gray = cv2.cvtColor(original, cv2.COLOR_BGR2GRAY)
+    mask, dark, work = _signals(thresh, gray)
+    baseline = _ncc(mask, dark)
+
+    candidates: list[Alignment] = []
+    timings: dict[str, float] = {}
+    for name in ALIGNERS if method == "auto" else (method,):
+        start = time.perf_counter()
+        if name == "phase":
+            sx, sy, dx, dy, resp = phase_align(mask, dark)
+            found = Alignment("phase", dx / work, dy / work, sx, sy, confidence=resp)
+        else:
+            shift = template_align(thresh, gray)
+            found = Alignment("template", shift[0], shift[1], confidence=shift[2]) if shift else None
+        if found is not None:
+            found.score = _ncc(_warp(mask, found.sx, found.sy, found.dx * work, found.dy * work), dark)
+        found_s = time.perf_counter() - start
+        timings[name] = found_s
+        if found is not None:
+            found.elapsed_s = found_s
+            candidates.append(found)
+
+    best = max(candidates, key=lambda a: a.score, default=None)
+    if best is None or best.score < baseline + MIN_GAIN:
+        best = Alignment("none", score=baseline)
+    align_stats.record(timings, best.method if best.method != "none" else None)
+    logger.info(
+        "mask alignment: %s shift=(%.1f, %.1f)px scale=(%.3f, %.3f) confidence=%.2f ncc %.3f -> %.3f; %s",
+        best.method, best.dx, best.dy, best.sx, best.sy, best.confidence, baseline, best.score,
+        ", ".join(f"{k} {v * 1000:.0f}ms" for k, v in timings.items()),
+    )
+    if best.method == "none":
+        return thresh, best
+    return cv2.warpAffine(thresh, best.matrix(w, h), (w, h), flags=cv2.INTER_NEAREST), best
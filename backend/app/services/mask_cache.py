@@ -0,0 +1,125 @@
+"""persistent cache of generated masks.
+
+keyed by (corrected-image content hash, model, mask prompt version), so
+re-tracing an unchanged image skips the gemini call entirely. the tool labels
+detected for that image are kept next to the mask as {key}.labels.json, so a
+hit skips the label call too. entries live in each user's masks/ dir; the
+janitor expires ones that haven't been used.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+from pathlib import Path
+
+from app.services.usage_store import file_size
+
+logger = logging.getLogger(__name__)
+
+
+class MaskCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.label_hits = 0
+
+    @staticmethod
+    def key(image_path: str | Path, model: str, prompt_version: int) -> str:
+        h = hashlib.sha256()
+        with open(image_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(chunk)
+        h.update(f"|{model}|{prompt_version}".encode())
+        return h.hexdigest()
+
+    def fetch(self, cache_dir: Path, key: str, output_path: str | None = None) -> str | None:
+        """path of the cached mask for key (copied to output_path if given),
+        or None on a miss"""
+        cached = cache_dir / f"{key}.png"
+        if not cached.exists():
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        # bump mtime so the janitor's expiry treats this as recently used
+        os.utime(cached)
+        if not output_path:
+            return str(cached)
+        Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(cached, output_path)
+        return output_path
+
+    def store(self, cache_dir: Path, key: str, mask_path: str) -> int:
+        """cache mask_path under key. returns the bytes this added to
+        cache_dir (net of any entry it replaced), for the usage ledger"""
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp = cache_dir / f".{key}.tmp"
+        target = cache_dir / f"{key}.png"
+        try:
+            shutil.copyfile(mask_path, tmp)
+            written = tmp.stat().st_size
+            # replace under the lock so concurrent stores of one key don't
+            # both count the entry as new
+            with self._lock:
+                replaced = file_size(target)
+                tmp.replace(target)
+            return written - replaced
+        except OSError:
+            tmp.unlink(missing_ok=True)
+            logger.warning("could not cache mask %s", key[:12])
+            return 0
+
+    def fetch_labels(self, cache_dir: Path, key: str) -> list[tuple[str, tuple[float, float, float, float]]] | None:
+        """label detections cached with the mask for key, or None"""
+        cached = cache_dir / f"{key}.labels.json"
+        try:
+            data = json.loads(cached.read_text())
+        except (OSError, ValueError):
+            return None
+        os.utime(cached)
+        with self._lock:
+            self.label_hits += 1
+        return [(label, tuple(box)) for label, box in data]
+
+    def store_labels(self, cache_dir: Path, key: str, detections: list) -> int:
+        """cache label detections for key. returns the bytes this added to
+        cache_dir, like store()"""
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp = cache_dir / f".{key}.labels.tmp"
+        target = cache_dir / f"{key}.labels.json"
+        try:
+            tmp.write_text(json.dumps([[label, list(box)] for label, box in detections]))
+            written = tmp.stat().st_size
+            with self._lock:
+                replaced = file_size(target)
+                tmp.replace(target)
+            return written - replaced
+        except OSError:
+            tmp.unlink(missing_ok=True)
+            logger.warning("could not cache labels %s", key[:12])
+            return 0
+
+    def record_bypass(self):
+        with self._lock:
+            self.bypassed += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "bypassed": self.bypassed,
+                "labelHits": self.label_hits,
+                "hitRate": round(self.hits / total, 3) if total else None,
+            }
+
+
+mask_cache = MaskCache()
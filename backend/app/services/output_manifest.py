@@ -0,0 +1,84 @@
+"""per-entity manifest of generated outputs.
+
+written atomically once generation finishes, so a cache hit (or a delete) is
+answered by reading one small file instead of globbing outputs/.
+"""
+from __future__ import annotations
+
+import logging
+import tempfile
+from pathlib import Path
+
+from pydantic import BaseModel
+
+from app.services.usage_store import file_size
+
+logger = logging.getLogger(__name__)
+
+
+class OutputManifest(BaseModel):
+    input_hash: str
+    stl: str  # file names, relative to the outputs dir
+    parts: list[str] = []
+    threemf: str | None = None
+    zip: str | None = None
+    sizes: dict[str, int] = {}  # file name -> bytes
+    timings: dict[str, float] = {}  # stage -> seconds
+    created_at: str | None = None
+
+    def files(self) -> list[str]:
+        return [f for f in (self.stl, *self.parts, self.threemf, self.zip) if f]
+
+
+def manifest_path(outputs_dir: Path, entity_id: str) -> Path:
+    return outputs_dir / f"{entity_id}.manifest.json"
+
+
+def read_manifest(outputs_dir: Path, entity_id: str) -> OutputManifest | None:
+    try:
+        return OutputManifest.model_validate_json(manifest_path(outputs_dir, entity_id).read_bytes())
+    except FileNotFoundError:
+        return None
+    except Exception:
+        logger.warning("unreadable output manifest for %s", entity_id)
+        return None
+
+
+def write_manifest(outputs_dir: Path, entity_id: str, manifest: OutputManifest):
+    path = manifest_path(outputs_dir, entity_id)
+    temp_fd, temp_path = tempfile.mkstemp(
+        dir=outputs_dir,
+        prefix=".manifest_",
+        suffix=".tmp"
+    )
+    try:
+        with open(temp_fd, 'w') as f:
+            f.write(manifest.model_dump_json(indent=2))
+        Path(temp_path).replace(path)
+    except Exception:
+        Path(temp_path).unlink(missing_ok=True)
+        raise
+
+
+def remove_outputs(outputs_dir: Path, entity_id: str) -> int:
+    """delete every generated file for an entity. returns bytes freed."""
+    manifest = read_manifest(outputs_dir, entity_id)
+    paths: list[Path] = []
+    if manifest:
+        paths = [outputs_dir / name for name in manifest.files()]
+    elif (outputs_dir / f"{entity_id}.stl").exists():
+        # outputs from before manifests existed
+        paths = [
+            outputs_dir / f"{entity_id}.stl",
+            outputs_dir / f"{entity_id}.3mf",
+            outputs_dir / f"{entity_id}_parts.zip",
+            *outputs_dir.glob(f"{entity_id}_part*.stl"),
+        ]
+    paths += [manifest_path(outputs_dir, entity_id), outputs_dir / f"{entity_id}.hash"]
+
+    freed = 0
+    for p in paths:
+        size = file_size(p)
+        p.unlink(missing_ok=True)
+        freed += size
+    return freed
@@ -0,0 +1,42 @@
+"""hit-rate and timing counters for code that tries several strategies and
+keeps one, e.g. paper detection and flash mask alignment."""
+from __future__ import annotations
+
+import threading
+from collections import Counter, defaultdict
+
+
+class StrategyStats:
+    """per-strategy attempts, wins and cumulative time, for ordering strategies by hit rate"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.attempts: Counter[str] = Counter()
+        self.wins: Counter[str] = Counter()
+        self.seconds: defaultdict[str, float] = defaultdict(float)
+        self.misses = 0
+
+    def record(self, timings: dict[str, float], winner: str | None):
+        with self._lock:
+            for name, elapsed in timings.items():
+                self.attempts[name] += 1
+                self.seconds[name] += elapsed
+            if winner:
+                self.wins[winner] += 1
+            else:
+                self.misses += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "misses": self.misses,
+                "strategies": {
+                    name: {
+                        "attempts": n,
+                        "wins": self.wins[name],
+                        "hitRate": round(self.wins[name] / n, 3),
+                        "avgMs": round(self.seconds[name] / n * 1000, 1),
+                    }
+                    for name, n in self.attempts.most_common()
+                },
+            }
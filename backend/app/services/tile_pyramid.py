@@ -0,0 +1,130 @@
+"""deep-zoom (dzi) tile pyramids for corrected images.
+
+each pyramid lives in its own versioned directory, named from a hash of the
+source image, so every url in it is immutable and can be cached forever:
+
+    tiles/{session_id}/{version}/image.dzi
+    tiles/{session_id}/{version}/preview.webp
+    tiles/{session_id}/{version}/image_files/{level}/{col}_{row}.webp
+
+levels follow the dzi convention: level 0 is 1x1, the top level is full size.
+"""
+from __future__ import annotations
+
+import hashlib
+import logging
+import math
+import shutil
+import tempfile
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from app.services.image_cache import image_cache
+from app.services.usage_store import dir_size
+
+logger = logging.getLogger(__name__)
+
+TILE_SIZE = 512
+PREVIEW_MAX_DIM = 1024
+WEBP_QUALITY = 80
+
+_DZI = """<?xml version="1.0" encoding="UTF-8"?>
+<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" TileSize="{tile}" Overlap="0" Format="webp">
+  <Size Width="{width}" Height="{height}"/>
+</Image>
+"""
+
+
+def pyramid_version(image_path: str | Path) -> str:
+    h = hashlib.blake2b(digest_size=8)
+    with open(image_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _encode(path: Path, img: np.ndarray) -> int:
+    ok, buf = cv2.imencode(".webp", img, [cv2.IMWRITE_WEBP_QUALITY, WEBP_QUALITY])
+    if not ok:
+        raise ValueError(f"webp encode failed for {path.name}")
+    return path.write_bytes(buf.tobytes())
+
+
+def build_pyramid(image_path: str | Path, session_tiles_dir: Path) -> tuple[dict | None, int]:
+    """write the pyramid for image_path under session_tiles_dir/{version}.
+    returns the pyramid description (see TilePyramid), or None if the image
+    can't be read, and the bytes it left on disk. an existing pyramid for the
+    same version is reused."""
+    version = pyramid_version(image_path)
+    out_dir = session_tiles_dir / version
+    img = image_cache.get(image_path)
+    if img is None:
+        return None, 0
+
+    height, width = img.shape[:2]
+    max_level = math.ceil(math.log2(max(width, height)))
+    info = {
+        "version": version,
+        "width": width,
+        "height": height,
+        "tile_size": TILE_SIZE,
+        "max_level": max_level,
+    }
+    if (out_dir / "image.dzi").exists():
+        return info, 0
+
+    session_tiles_dir.mkdir(parents=True, exist_ok=True)
+    # build in a temp dir and rename, so a half-written pyramid is never served
+    tmp = Path(tempfile.mkdtemp(dir=session_tiles_dir, prefix=".build_"))
+    tmp.chmod(0o755)
+    written = 0
+    try:
+        level_img = img
+        for level in range(max_level, -1, -1):
+            if level < max_level:
+                h, w = level_img.shape[:2]
+                level_img = cv2.resize(
+                    level_img, (max(1, math.ceil(w / 2)), max(1, math.ceil(h / 2))),
+                    interpolation=cv2.INTER_AREA,
+                )
+            level_dir = tmp / "image_files" / str(level)
+            level_dir.mkdir(parents=True)
+            h, w = level_img.shape[:2]
+            for row, y in enumerate(range(0, h, TILE_SIZE)):
+                for col, x in enumerate(range(0, w, TILE_SIZE)):
+                    written += _encode(level_dir / f"{col}_{row}.webp", level_img[y:y + TILE_SIZE, x:x + TILE_SIZE])
+
+        scale = min(1.0, PREVIEW_MAX_DIM / max(width, height))
+        preview = cv2.resize(
+            img, (max(1, round(width * scale)), max(1, round(height * scale))),
+            interpolation=cv2.INTER_AREA,
+        )
+        written += _encode(tmp / "preview.webp", preview)
+        written += (tmp / "image.dzi").write_text(_DZI.format(tile=TILE_SIZE, width=width, height=height))
+        try:
+            tmp.rename(out_dir)
+        except OSError:
+            # another build of the same version won the race
+            if not (out_dir / "image.dzi").exists():
+                raise
+            written = 0
+    finally:
+        if tmp.exists():
+            shutil.rmtree(tmp, ignore_errors=True)
+    return info, written
+
+
+def remove_pyramids(session_tiles_dir: Path, keep: str | None = None) -> int:
+    """delete pyramid versions for a session, except keep. returns bytes freed."""
+    if not session_tiles_dir.is_dir():
+        return 0
+    freed = 0
+    for d in session_tiles_dir.iterdir():
+        if d.name != keep and not d.name.startswith(".build_"):
+            freed += dir_size(d)
+            shutil.rmtree(d, ignore_errors=True)
+    if keep is None:
+        shutil.rmtree(session_tiles_dir, ignore_errors=True)
+    return freed
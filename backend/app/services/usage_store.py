@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import tempfile
+import threading
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# per-user subdirectories holding stored artifacts. metadata json files in the
+# user root are small and statted directly when reporting.
+ARTIFACT_DIRS = ("uploads", "processed", "outputs", "tools", "debug", "tiles", "masks")
+METADATA_FILES = ("sessions.json", "tools.json", "bins.json", "blobs.json")
+
+
+def file_size(path: str | Path | None) -> int:
+    if not path:
+        return 0
+    try:
+        return os.stat(path).st_size
+    except OSError:
+        return 0
+
+
+def dir_size(path: Path) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for f in filenames:
+            total += file_size(os.path.join(dirpath, f))
+    return total
+
+
+class UsageStore:
+    """per-user artifact byte counts, updated incrementally on every write/delete.
+
+    add() only updates memory; the file is rewritten at most once per
+    flush_delay_s, and by flush() on shutdown. reconcile() walks the tree and
+    corrects the counts, fixing any drift from crashes (including adds lost
+    before a flush) or files touched outside the api.
+    """
+
+    def __init__(self, storage_path: Path, flush_delay_s: float = 2.0):
+        self.storage_path = storage_path
+        self.file_path = storage_path / ".usage.json"
+        self.flush_delay_s = flush_delay_s
+        self._usage: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._flush_timer: threading.Timer | None = None
+        self.loaded = self._load()
+
+    def _load(self) -> bool:
+        if self.file_path.exists():
+            try:
+                self._usage = {k: int(v) for k, v in json.loads(self.file_path.read_text()).items()}
+                return True
+            except Exception:
+                self._usage = {}
+        return False
+
+    def _save(self):
+        temp_fd, temp_path = tempfile.mkstemp(
+            dir=self.file_path.parent,
+            prefix=".usage_",
+            suffix=".tmp"
+        )
+        try:
+            with open(temp_fd, 'w') as f:
+                json.dump(self._usage, f, indent=2)
+            Path(temp_path).replace(self.file_path)
+        except Exception:
+            Path(temp_path).unlink(missing_ok=True)
+            raise
+
+    def _save_later(self):
+        # caller holds _lock
+        if self._flush_timer is None:
+            self._flush_timer = threading.Timer(self.flush_delay_s, self.flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def flush(self):
+        """write pending changes now"""
+        with self._lock:
+            if self._flush_timer is None:
+                return
+            self._flush_timer.cancel()
+            self._flush_timer = None
+            self._save()
+
+    def add(self, user_id: str, delta: int):
+        if not delta:
+            return
+        with self._lock:
+            self._usage[user_id] = max(0, self._usage.get(user_id, 0) + delta)
+            self._save_later()
+
+    def get(self, user_id: str) -> int:
+        with self._lock:
+            return self._usage.get(user_id, 0)
+
+    def delete(self, user_id: str):
+        with self._lock:
+            if self._usage.pop(user_id, None) is not None:
+                self._save_later()
+
+    def all(self) -> dict[str, int]:
+        with self._lock:
+            return self._usage.copy()
+
+    def metadata_size(self, user_id: str) -> int:
+        user_path = self.storage_path / user_id
+        return sum(file_size(user_path / name) for name in METADATA_FILES)
+
+    def reconcile(self) -> dict[str, int]:
+        """recount artifact bytes from disk. returns per-user drift (actual - ledger).
+
+        users are walked one at a time without the lock. adds that land during
+        a user's walk are kept on top of the count rather than overwritten;
+        if the walk also saw that file it's counted twice until the next run."""
+        user_ids = set()
+        if self.storage_path.exists():
+            user_ids = {d.name for d in self.storage_path.iterdir() if d.is_dir()}
+
+        drift: dict[str, int] = {}
+        for uid in user_ids:
+            with self._lock:
+                before = self._usage.get(uid, 0)
+            size = sum(dir_size(self.storage_path / uid / sub) for sub in ARTIFACT_DIRS)
+            with self._lock:
+                current = self._usage.get(uid, 0)
+                corrected = max(0, size + current - before)
+                if corrected != current:
+                    drift[uid] = corrected - current
+                    self._usage[uid] = corrected
+
+        with self._lock:
+            for uid in self._usage.keys() - user_ids:
+                drift[uid] = -self._usage.pop(uid)
+            self._save_later()
+
+        if drift:
+            logger.info("usage reconcile corrected %d users: %s", len(drift), drift)
+        return drift
@@ -0,0 +1,114 @@
+"""
+Compare the offline tracer against stored Gemini masks: IoU of the traced
+outlines (what the user ends up with) and segmentation latency.
+
+Gemini masks are found through the mask cache, so every pair is a real
+Gemini result for exactly that corrected image. Pairs can also be given
+directly; use --align for masks from a flash model (or from an older warp).
+
+Usage:
+    cd backend
+    source venv/bin/activate
+    python tests/benchmark_local_tracer.py --storage ./storage
+    python tests/benchmark_local_tracer.py [--align] corrected.jpg gemini_mask.png [...]
+"""
+
+import json
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.config import settings
+from app.services.ai_tracer import AITracer, MASK_PROMPT_VERSION, _NEEDS_ALIGNMENT
+from app.services.image_cache import image_cache
+from app.services.local_segmenter import segment_tools
+from app.services.mask_cache import MaskCache
+
+
+def stored_pairs(storage: Path) -> list[tuple[str, str]]:
+    pairs = []
+    for sessions_file in storage.glob("*/sessions.json"):
+        user_dir = sessions_file.parent
+        for session in json.loads(sessions_file.read_text()).values():
+            # session paths are relative to the storage root, user id included
+            rel = session.get("corrected_image_path")
+            if not rel or not (storage / rel).exists():
+                continue
+            corrected = str(storage / rel)
+            key = MaskCache.key(corrected, settings.gemini_image_model, MASK_PROMPT_VERSION)
+            mask = user_dir / "masks" / f"{key}.png"
+            if mask.exists():
+                pairs.append((corrected, str(mask)))
+    return pairs
+
+
+def rasterize(contours, shape) -> np.ndarray:
+    out = np.zeros(shape, np.uint8)
+    for exterior, holes in contours:
+        cv2.fillPoly(out, [np.array(exterior, np.int32)], 1)
+        for hole in holes:
+            cv2.fillPoly(out, [np.array(hole, np.int32)], 0)
+    return out
+
+
+def main():
+    args = sys.argv[1:]
+    align = settings.gemini_image_model in _NEEDS_ALIGNMENT
+    if "--align" in args:
+        args.remove("--align")
+        align = True
+    if len(args) == 2 and args[0] == "--storage":
+        pairs = stored_pairs(Path(args[1]))
+    elif args and len(args) % 2 == 0:
+        pairs = list(zip(args[::2], args[1::2]))
+    else:
+        print(__doc__)
+        sys.exit(1)
+    if not pairs:
+        print("no corrected image / gemini mask pairs found")
+        sys.exit(1)
+
+    tracer = AITracer(model=settings.gemini_image_model)
+    tmp = tempfile.mkdtemp()
+    results = {True: ([], []), False: ([], [])}
+    for corrected, gemini_mask in pairs:
+        image = image_cache.get(corrected)
+        if image is None:
+            continue
+        shape = image.shape[:2]
+        reference = rasterize(tracer._trace_mask(gemini_mask, corrected, align=align), shape)
+        for grabcut in (False, True):
+            out = str(Path(tmp) / f"local_{grabcut}.png")
+            start = time.perf_counter()
+            if not segment_tools(corrected, out, grabcut=grabcut):
+                print(f"{Path(corrected).name}: no paper found")
+                break
+            elapsed = time.perf_counter() - start
+            local = rasterize(tracer._trace_mask(out, corrected), shape)
+            union = (reference | local).sum()
+            iou = (reference & local).sum() / union if union else 1.0
+            results[grabcut][0].append(iou)
+            results[grabcut][1].append(elapsed)
+            print(f"{Path(corrected).name}  grabcut={grabcut!s:5}  iou={iou:.3f}  {elapsed * 1000:.0f}ms")
+
+    for grabcut in (False, True):
+        ious, times = results[grabcut]
+        if not ious:
+            continue
+        times.sort()
+        print(
+            f"\ngrabcut={grabcut}: {len(ious)} images  mean iou {statistics.mean(ious):.3f}"
+            f"  min {min(ious):.3f}  median {statistics.median(times) * 1000:.0f}ms"
+            f"  max {times[-1] * 1000:.0f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
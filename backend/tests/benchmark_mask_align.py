@@ -0,0 +1,112 @@
+"""
+Compare the mask aligners: shift and stretch known-good masks by known
+amounts, align them back against the photo and report IoU with the original
+mask and time per method.
+
+Known-good masks are the ones in the mask cache (from a model that respects
+dimensions), or explicit corrected/mask pairs. "phase" is what the tracer runs
+by default; if "auto" starts clearly beating it here, MASK_ALIGNER=auto buys
+that back at the cost of running both.
+
+Usage:
+    cd backend
+    source venv/bin/activate
+    python tests/benchmark_mask_align.py --storage ./storage
+    python tests/benchmark_mask_align.py corrected.jpg mask.png [...]
+"""
+
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.services.image_cache import image_cache
+from app.services.mask_align import align_mask
+
+from benchmark_local_tracer import stored_pairs
+
+# (dx, dy) as fractions of the long side, (sx, sy) scale about the center
+DISTORTIONS = [
+    (0.0, 0.0, 1.0, 1.0),
+    (0.002, -0.001, 1.0, 1.0),
+    (0.03, -0.02, 1.0, 1.0),
+    (-0.08, 0.06, 1.0, 1.0),
+    (0.15, 0.0, 1.0, 1.0),
+    (0.01, 0.01, 1.06, 0.95),
+    (-0.04, 0.02, 0.92, 0.92),
+    (0.0, 0.0, 1.1, 1.0),
+]
+METHODS = ("template", "phase", "auto")
+
+
+def distort(mask: np.ndarray, dx: float, dy: float, sx: float, sy: float) -> np.ndarray:
+    h, w = mask.shape
+    side = max(w, h)
+    m = np.float32([[sx, 0, w / 2 * (1 - sx) + dx * side], [0, sy, h / 2 * (1 - sy) + dy * side]])
+    return cv2.warpAffine(mask, m, (w, h), flags=cv2.INTER_NEAREST)
+
+
+def iou(a: np.ndarray, b: np.ndarray) -> float:
+    a, b = a > 127, b > 127
+    union = (a | b).sum()
+    return (a & b).sum() / union if union else 1.0
+
+
+def main():
+    args = sys.argv[1:]
+    if len(args) == 2 and args[0] == "--storage":
+        pairs = stored_pairs(Path(args[1]))
+    elif args and len(args) % 2 == 0:
+        pairs = list(zip(args[::2], args[1::2]))
+    else:
+        print(__doc__)
+        sys.exit(1)
+    if not pairs:
+        print("no corrected image / mask pairs found")
+        sys.exit(1)
+
+    results = {m: ([], []) for m in METHODS}
+    wins = {"phase": 0, "template": 0}
+    for corrected, mask_path in pairs:
+        original = image_cache.get(corrected)
+        mask = cv2.imread(mask_path, cv2.IMREAD_GRAYSCALE)
+        if original is None or mask is None:
+            continue
+        h, w = original.shape[:2]
+        truth = cv2.resize(np.where(mask < 128, 255, 0).astype(np.uint8), (w, h), interpolation=cv2.INTER_NEAREST)
+        for case in DISTORTIONS:
+            moved = distort(truth, *case)
+            row = []
+            scores = {}
+            for method in METHODS:
+                start = time.perf_counter()
+                aligned, alignment = align_mask(moved, original, method)
+                elapsed = time.perf_counter() - start
+                scores[method] = iou(aligned, truth)
+                results[method][0].append(scores[method])
+                results[method][1].append(elapsed)
+                row.append(f"{method} {scores[method]:.3f} ({alignment.method}, {elapsed * 1000:.0f}ms)")
+            if scores["phase"] > scores["template"] + 0.005:
+                wins["phase"] += 1
+            elif scores["template"] > scores["phase"] + 0.005:
+                wins["template"] += 1
+            print(f"{Path(corrected).name} {case}: before {iou(moved, truth):.3f}  " + "  ".join(row))
+
+    print()
+    for method in METHODS:
+        ious, times = results[method]
+        if ious:
+            print(
+                f"{method:8}  mean iou {statistics.mean(ious):.3f}  min {min(ious):.3f}"
+                f"  median {statistics.median(times) * 1000:.0f}ms"
+            )
+    print(f"phase better in {wins['phase']} cases, template in {wins['template']}, of {len(results['auto'][0])}")
+
+
+if __name__ == "__main__":
+    main()
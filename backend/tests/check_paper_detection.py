@@ -0,0 +1,45 @@
+"""
+Check that paper detection is repeatable: detect the corners of each image
+several times and fail if any run disagrees with the first. Strategies run
+concurrently, so a result that depends on which finishes first shows up here.
+
+Usage:
+    cd backend
+    source venv/bin/activate
+    python tests/check_paper_detection.py ../frontend/e2e/fixtures/tool.jpg [...] [--runs 20]
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.services.image_processor import ImageProcessor, detection_stats
+
+
+def main():
+    args = sys.argv[1:]
+    runs = 20
+    if "--runs" in args:
+        i = args.index("--runs")
+        runs = int(args[i + 1])
+        del args[i:i + 2]
+    if not args:
+        print(__doc__)
+        sys.exit(1)
+
+    processor = ImageProcessor()
+    failed = False
+    for path in args:
+        first = processor.detect_paper_corners(path)
+        differing = sum(processor.detect_paper_corners(path) != first for _ in range(runs - 1))
+        status = "ok" if not differing else f"FAIL: {differing} of {runs - 1} runs differ"
+        print(f"{Path(path).name}: {first} {status}")
+        failed |= bool(differing)
+
+    print(detection_stats.snapshot())
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
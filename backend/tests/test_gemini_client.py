@@ -0,0 +1,114 @@
+"""GeminiClientPool against a local stand-in for the gemini api"""
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from app.services.gemini_client import GeminiClientPool
+
+RESPONSE = {"candidates": [{"content": {"role": "model", "parts": [{"text": "ok"}]}}]}
+
+
+class StandIn(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("content-length", 0)))
+        self.server.requests += 1
+        # models/slow-*:generateContent answers late
+        if "/models/slow" in self.path:
+            time.sleep(self.server.slow_s)
+        body = json.dumps(RESPONSE).encode()
+        try:
+            self.send_response(200)
+            self.send_header("content-type", "application/json")
+            self.send_header("content-length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client timed out and hung up
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+    srv.daemon_threads = True
+    srv.requests = 0
+    srv.slow_s = 1.5
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+def _pool(server, workers=2):
+    return GeminiClientPool(max_workers=workers, base_url=f"http://127.0.0.1:{server.server_port}")
+
+
+def test_clients_are_reused_per_key(server):
+    pool = _pool(server)
+
+    async def run():
+        for key in ("a", "a", "b"):
+            response = await pool.generate_content(key, timeout_s=5, model="fast", contents=["hi"])
+            assert response.text == "ok"
+
+    asyncio.run(run())
+    assert server.requests == 3
+    stats = pool.stats()
+    assert stats["clients"] == 2
+    assert stats["clientsCreated"] == 2
+    assert stats["active"] == 0
+    assert stats["queued"] == 0
+
+
+def test_slow_response_raises_timeout(server):
+    pool = _pool(server)
+
+    async def run():
+        await pool.generate_content("a", timeout_s=0.3, model="slow", contents=["hi"])
+
+    with pytest.raises(TimeoutError):
+        asyncio.run(run())
+    assert pool.stats()["active"] == 0
+
+
+def test_active_and_queued_stats(server):
+    pool = _pool(server, workers=1)
+    seen = {}
+
+    async def run():
+        calls = [
+            asyncio.create_task(pool.generate_content("a", timeout_s=5, model="slow", contents=["hi"]))
+            for _ in range(2)
+        ]
+        await asyncio.sleep(0.5)
+        seen.update(pool.stats())
+        await asyncio.gather(*calls)
+
+    asyncio.run(run())
+    assert (seen["active"], seen["queued"]) == (1, 1)
+    assert (pool.stats()["active"], pool.stats()["queued"]) == (0, 0)
+
+
+def test_cancelled_while_queued_leaves_the_queue(server):
+    pool = _pool(server, workers=1)
+
+    async def run():
+        running = asyncio.create_task(pool.generate_content("a", timeout_s=5, model="slow", contents=["hi"]))
+        await asyncio.sleep(0.2)
+        waiting = asyncio.create_task(pool.generate_content("a", timeout_s=5, model="slow", contents=["hi"]))
+        await asyncio.sleep(0.2)
+        assert pool.stats()["queued"] == 1
+        waiting.cancel()
+        await asyncio.sleep(0.05)
+        assert pool.stats()["queued"] == 0
+        await running
+
+    asyncio.run(run())
+    assert server.requests == 1
+    assert (pool.stats()["active"], pool.stats()["queued"]) == (0, 0)
@@ -0,0 +1,20 @@
+import numpy as np
+
+from app.services.image_cache import DecodedImageCache
+
+
+def test_cached_arrays_are_read_only():
+    cache = DecodedImageCache(100)
+    img = np.zeros(50, np.uint8)
+    cache._insert(("a.jpg", 0, 50, 1), img)
+    assert not img.flags.writeable
+    assert cache.stats()["entries"] == 1
+
+
+def test_arrays_over_budget_stay_writable():
+    # not cached, so the caller still owns the array
+    cache = DecodedImageCache(100)
+    img = np.zeros(200, np.uint8)
+    cache._insert(("a.jpg", 0, 200, 1), img)
+    assert img.flags.writeable
+    assert cache.stats()["entries"] == 0
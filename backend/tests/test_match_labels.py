@@ -0,0 +1,25 @@
+import numpy as np
+
+from app.services.ai_tracer import AITracer
+
+
+def _box(x0, y0, x1, y1):
+    return np.array([[x0, y0], [x1, y0], [x1, y1], [x0, y1]], dtype=np.float64), []
+
+
+def test_overlapping_boxes_each_get_a_label():
+    # A matches the first contour best, which also overlaps B most; B must
+    # still go to the second contour rather than ending the matching
+    contours = [_box(0, 0, 100, 100), _box(60, 0, 160, 100)]
+    detections = [("A", (0, 0, 100, 100)), ("B", (20, 0, 120, 100))]
+    assert AITracer._match_labels(contours, detections) == ["A", "B"]
+
+
+def test_unmatched_contours_keep_numbers():
+    contours = [_box(0, 0, 100, 100), _box(500, 500, 600, 600)]
+    detections = [("A", (0, 0, 100, 100))]
+    assert AITracer._match_labels(contours, detections) == ["A", "tool 2"]
+
+
+def test_no_detections():
+    assert AITracer._match_labels([_box(0, 0, 10, 10)], []) == ["tool 1"]
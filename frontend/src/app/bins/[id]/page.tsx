@@ -6,13 +6,14 @@ import { BinEditor } from '@/components/BinEditor'
 import { BinConfigurator } from '@/components/BinConfigurator'
 import { BinPreview3D } from '@/components/BinPreview3D'
 import { ToolBrowser } from '@/components/ToolBrowser'
-import { getBin, updateBin, generateBinStl, getBinStlUrl, getBinZipUrl, getBinThreemfUrl, getImageUrl, listTools, updateTool } from '@/lib/api'
+import { getBin, updateBin, patchPlacedTools, generateBinStl, getBinStlUrl, getBinZipUrl, getBinThreemfUrl, getImageUrl, listTools, updateTool } from '@/lib/api'
 import { getSettings } from '@/lib/settings'
 import type { BinConfig, BinData, PlacedTool, TextLabel } from '@/types'
 import { Download, Loader2, Package, ArrowLeft } from 'lucide-react'
 import { Alert } from '@/components/Alert'
 import { useDebouncedSave } from '@/hooks/useDebouncedSave'
 import { GRID_UNIT } from '@/lib/constants'
+import { diffPlacedTools } from '@/lib/ops'
 
 function defaultConfig(): BinConfig {
   return {
@@ -56,12 +57,18 @@ export default function BinPage() {
   const [smoothedToolIds, setSmoothedToolIds] = useState<Set<string>>(new Set())
   const [smoothLevels, setSmoothLevels] = useState<Map<string, number>>(new Map())
   const smoothLevelTimerRef = useRef<NodeJS.Timeout | null>(null)
+  // what the server has, so saves can send just the edits
+  const savedToolsRef = useRef<PlacedTool[] | null>(null)
+  const savedMetaRef = useRef('')
+  const saveChainRef = useRef<Promise<void>>(Promise.resolve())
 
   useEffect(() => {
     async function load() {
       try {
         const [data, tools] = await Promise.all([getBin(binId), listTools()])
         setBinData(data)
+        savedToolsRef.current = data.placed_tools
+        savedMetaRef.current = JSON.stringify({ name: data.name || '', config: data.bin_config, textLabels: data.text_labels })
 
         // sync placed tools with library (e.g. filled-in interior rings)
         const toolMap = new Map(tools.map(t => [t.id, t]))
@@ -148,12 +155,30 @@ export default function BinPage() {
   useDebouncedSave(
     () => {
       if (!binData) return
-      updateBin(binId, {
+      const tools = placedTools
+      const meta = JSON.stringify({ name, config, textLabels })
+      const ops = savedToolsRef.current ? diffPlacedTools(savedToolsRef.current, tools) : null
+      const metaChanged = meta !== savedMetaRef.current
+      savedToolsRef.current = tools
+      savedMetaRef.current = meta
+      const saveAll = () => updateBin(binId, {
         name: name || undefined,
         bin_config: config,
-        placed_tools: placedTools,
+        placed_tools: tools,
         text_labels: textLabels,
-      }).catch(() => {})
+      })
+      // moves, rotations and finger hole edits go as PATCH ops; anything the
+      // ops can't express, or a rejected patch, falls back to the full PUT.
+      // chained so ops reach the server in the order they were made
+      saveChainRef.current = saveChainRef.current.then(async () => {
+        if (ops === null) return saveAll()
+        if (ops.length) await patchPlacedTools(binId, ops)
+        if (metaChanged) await updateBin(binId, { name: name || undefined, bin_config: config, text_labels: textLabels })
+      }).catch(() => saveAll()).catch(() => {
+        // server state unknown, next save sends everything
+        savedToolsRef.current = null
+        savedMetaRef.current = ''
+      })
     },
     [binData, binId, name, config, placedTools, textLabels],
     150,
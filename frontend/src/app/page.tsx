@@ -4,8 +4,8 @@ import { useState, useEffect, useRef } from 'react'
 import { useRouter } from 'next/navigation'
 import { ImageUploader } from '@/components/ImageUploader'
 import { ConfirmModal } from '@/components/ConfirmModal'
-import { uploadImage, listTools, listBins, deleteTool, deleteBin, createBin, getImageUrl } from '@/lib/api'
-import type { ToolSummary, BinSummary, BinPreviewTool, Point } from '@/types'
+import { uploadImage, uploadImages, listTools, listBins, deleteTool, deleteBin, createBin, getImageUrl } from '@/lib/api'
+import type { ToolSummary, BinSummary, BinPreviewTool, Point, BatchUploadResult } from '@/types'
 import { polygonPathData } from '@/lib/svg'
 import { Trash2, Clock, Package, Plus, Loader2 } from 'lucide-react'
 import { Alert } from '@/components/Alert'
@@ -144,6 +144,7 @@ function NameModal({ open, onConfirm, onCancel }: {
 export default function HomePage() {
   const router = useRouter()
   const [uploading, setUploading] = useState(false)
+  const [batch, setBatch] = useState<{ total: number; results: BatchUploadResult[] } | null>(null)
   const [error, setError] = useState<string | null>(null)
   const [toolsList, setToolsList] = useState<ToolSummary[]>([])
   const [binsList, setBinsList] = useState<BinSummary[]>([])
@@ -171,6 +172,7 @@ export default function HomePage() {
   async function handleUpload(file: File) {
     setUploading(true)
     setError(null)
+    setBatch(null)
     try {
       const result = await uploadImage(file)
       router.push(`/trace/${result.session_id}`)
@@ -181,6 +183,21 @@ export default function HomePage() {
     }
   }
 
+  async function handleUploadMany(files: File[]) {
+    setUploading(true)
+    setError(null)
+    setBatch({ total: files.length, results: [] })
+    try {
+      await uploadImages(files, result => {
+        setBatch(prev => prev && { ...prev, results: [...prev.results, result] })
+      })
+    } catch (err) {
+      setError(err instanceof Error ? err.message : 'upload failed')
+    } finally {
+      setUploading(false)
+    }
+  }
+
   async function handleDeleteTool(id: string) {
     try {
       await deleteTool(id)
@@ -234,16 +251,33 @@ export default function HomePage() {
       </div>
 
       <div data-tour="upload">
-        <ImageUploader onUpload={handleUpload} disabled={uploading} />
+        <ImageUploader onUpload={handleUpload} onUploadMany={handleUploadMany} disabled={uploading} />
       </div>
 
       {uploading && (
         <div className="flex items-center justify-center gap-2 text-text-muted mt-4 text-xs">
           <Loader2 className="w-4 h-4 animate-spin" />
-          <span>Uploading...</span>
+          <span>{batch ? `Processing ${batch.results.length}/${batch.total}...` : 'Uploading...'}</span>
         </div>
       )}
 
+      {batch && batch.results.length > 0 && (
+        <ul className="max-w-md mx-auto mt-4 text-xs space-y-1">
+          {[...batch.results].sort((a, b) => a.index - b.index).map(r => (
+            <li key={r.index} className="flex items-center justify-between gap-3">
+              <span className="truncate text-text-secondary">{r.filename || `photo ${r.index + 1}`}</span>
+              {r.status === 'ready' && r.session_id ? (
+                <button onClick={() => router.push(`/trace/${r.session_id}`)} className="text-accent hover:underline flex-shrink-0">
+                  Trace
+                </button>
+              ) : (
+                <span className="text-red-400 flex-shrink-0">{r.error || 'failed'}</span>
+              )}
+            </li>
+          ))}
+        </ul>
+      )}
+
       {error && (
         <div className="max-w-md mx-auto mt-4">
           <Alert variant="error">{error}</Alert>
@@ -8,9 +8,10 @@ import { PaperCornerEditor } from '@/components/PaperCornerEditor'
 import { PolygonEditor } from '@/components/PolygonEditor'
 import { SessionInfo } from '@/components/SessionInfo'
 import { Alert } from '@/components/Alert'
-import { getSession, setCorners, traceTools, updatePolygons, updateSession, getImageUrl, getAvailableKeys, traceFromMask, saveToolsFromSession } from '@/lib/api'
+import { getSession, setCorners, traceTools, getTraceStatus, updatePolygons, patchPolygons, updateSession, getImageUrl, getAvailableKeys, traceFromMask, saveToolsFromSession } from '@/lib/api'
 import { CornersHint, TraceHint, EditHint } from '@/components/OnboardingIllustrations'
-import type { Point, Polygon, Session } from '@/types'
+import { diffPolygons } from '@/lib/ops'
+import type { Point, Polygon, Session, TilePyramid } from '@/types'
 
 type Step = 'corners' | 'trace' | 'edit'
 
@@ -46,9 +47,14 @@ export default function TracePage() {
   const [paperSize, setPaperSize] = useState<'a4' | 'letter'>('a4')
   const [imageUrl, setImageUrl] = useState<string>('')
   const [correctedImageUrl, setCorrectedImageUrl] = useState<string>('')
+  const [tiles, setTiles] = useState<TilePyramid | null>(null)
+  const [tilesPending, setTilesPending] = useState(false)
   const [polygons, setPolygons] = useState<Polygon[]>([])
+  // what the server has, so saves can send just the edits
+  const savedPolygonsRef = useRef<Polygon[] | null>([])
+  const saveChainRef = useRef<Promise<void>>(Promise.resolve())
 
-  const [provider, setProvider] = useState<'google' | 'manual'>('google')
+  const [provider, setProvider] = useState<'google' | 'local' | 'manual'>('google')
   const [apiKey, setApiKey] = useState('')
   const [hasEnvKey, setHasEnvKey] = useState(false)
   const [maskUrl, setMaskUrl] = useState<string | null>(null)
@@ -62,19 +68,32 @@ export default function TracePage() {
   const [hoveredPolygon, setHoveredPolygon] = useState<string | null>(null)
   const maskInputRef = useRef<HTMLInputElement>(null)
   const statusInterval = useRef<NodeJS.Timeout | null>(null)
+  const queueInterval = useRef<NodeJS.Timeout | null>(null)
 
   useEffect(() => {
+    let cancelled = false
     async function load() {
       try {
-        const [s, keys] = await Promise.all([
+        const [first, keys] = await Promise.all([
           getSession(sessionId),
           getAvailableKeys(),
         ])
+        let s = first
+        // upload is decoded and corner-detected in the background
+        while (s.upload_status === 'processing' && !cancelled) {
+          await new Promise(r => setTimeout(r, 500))
+          s = await getSession(sessionId)
+        }
+        if (cancelled) return
+        if (s.upload_status === 'failed') {
+          setError(s.upload_error || 'failed to process image')
+          return
+        }
         setSession(s)
         setHasEnvKey(keys.google)
 
         if (!keys.google) {
-          setProvider('manual')
+          setProvider('local')
         }
 
         if (s.corners) {
@@ -83,10 +102,14 @@ export default function TracePage() {
         if (s.corrected_image_path) {
           setCorrectedImageUrl(`/storage/${s.corrected_image_path}`)
         }
+        if (s.tiles) {
+          setTiles(s.tiles)
+        }
         if (s.mask_image_path) {
           const maskRel = s.mask_image_path.replace(/^storage\//, '')
           setMaskUrl(`/storage/${maskRel}`)
         }
+        savedPolygonsRef.current = s.polygons ?? []
         if (s.polygons && s.polygons.length > 0) {
           setPolygons(s.polygons)
           setStep('edit')
@@ -100,6 +123,7 @@ export default function TracePage() {
       }
     }
     load()
+    return () => { cancelled = true }
   }, [sessionId])
 
   useEffect(() => {
@@ -111,6 +135,29 @@ export default function TracePage() {
     }
   }, [session, step, correctedImageUrl, sessionId])
 
+  // tile pyramid for a new corrected image is built in the background;
+  // the editor shows the full image until it shows up
+  useEffect(() => {
+    if (!tilesPending) return
+    let cancelled = false
+    let attempts = 0
+    const timer = setInterval(async () => {
+      attempts++
+      try {
+        const s = await getSession(sessionId)
+        if (!cancelled && s.tiles) {
+          setTiles(s.tiles)
+          setTilesPending(false)
+        }
+      } catch { /* ignore */ }
+      if (attempts >= 30) setTilesPending(false)
+    }, 1000)
+    return () => {
+      cancelled = true
+      clearInterval(timer)
+    }
+  }, [tilesPending, sessionId])
+
   async function handleCornersSubmit() {
     if (corners.length !== 4) return
 
@@ -119,6 +166,8 @@ export default function TracePage() {
 
     try {
       const result = await setCorners(sessionId, corners, paperSize)
+      setTiles(null)
+      setTilesPending(true)
       setCorrectedImageUrl(result.corrected_image_url)
       setImageVersion(Date.now())
       setStep('trace')
@@ -130,28 +179,52 @@ export default function TracePage() {
   }
 
   async function handleTrace() {
-    if (!hasEnvKey && !apiKey.trim()) {
+    const local = provider === 'local'
+    if (!local && !hasEnvKey && !apiKey.trim()) {
       setError('please enter your API key')
       return
     }
 
     setProcessing(true)
     setError(null)
-    setTraceStatus(TRACE_STEPS[0])
-
-    // cycle through status messages while waiting
-    let stepIndex = 0
-    statusInterval.current = setInterval(() => {
-      stepIndex = Math.min(stepIndex + 1, TRACE_STEPS.length - 1)
-      setTraceStatus(TRACE_STEPS[stepIndex])
-    }, 3000)
+    setTraceStatus(local ? 'Segmenting image locally...' : TRACE_STEPS[0])
+
+    if (!local) {
+      // cycle through status messages while waiting, unless the server says
+      // the request is still queued behind other gemini calls
+      let stepIndex = 0
+      let queued = false
+      statusInterval.current = setInterval(() => {
+        if (queued) return
+        stepIndex = Math.min(stepIndex + 1, TRACE_STEPS.length - 1)
+        setTraceStatus(TRACE_STEPS[stepIndex])
+      }, 3000)
+      queueInterval.current = setInterval(async () => {
+        try {
+          const status = await getTraceStatus(sessionId)
+          queued = status.state === 'queued'
+          if (!queued) return
+          if (status.retry_in) {
+            setTraceStatus(`Gemini is rate limiting, retrying in ${Math.ceil(status.retry_in)}s...`)
+          } else if (status.position) {
+            setTraceStatus(`Waiting for Gemini (position ${status.position} in queue)...`)
+          }
+        } catch {
+          // status is cosmetic; the trace request reports real errors
+        }
+      }, 1500)
+    }
 
     try {
+      // a trace after a result was shown is a deliberate re-trace, so skip
+      // the server's mask cache; retries after a failure can reuse it
       const result = await traceTools(
         sessionId,
-        'google',
-        hasEnvKey ? undefined : apiKey
+        local ? 'local' : 'google',
+        local || hasEnvKey ? undefined : apiKey,
+        polygons.length > 0
       )
+      savedPolygonsRef.current = result.polygons
       setPolygons(result.polygons)
       if (result.mask_url) {
         setMaskUrl(result.mask_url)
@@ -165,6 +238,10 @@ export default function TracePage() {
         clearInterval(statusInterval.current)
         statusInterval.current = null
       }
+      if (queueInterval.current) {
+        clearInterval(queueInterval.current)
+        queueInterval.current = null
+      }
       setTraceStatus(null)
       setProcessing(false)
     }
@@ -176,6 +253,7 @@ export default function TracePage() {
 
     try {
       const result = await traceFromMask(sessionId, file)
+      savedPolygonsRef.current = result.polygons
       setPolygons(result.polygons)
       if (result.mask_url) {
         setMaskUrl(result.mask_url)
@@ -217,19 +295,39 @@ export default function TracePage() {
   }, [])
 
   useDebouncedSave(
-    () => updatePolygons(sessionId, polygons),
+    () => {
+      const current = polygons
+      const ops = savedPolygonsRef.current ? diffPolygons(savedPolygonsRef.current, current) : null
+      savedPolygonsRef.current = current
+      const saveAll = () => updatePolygons(sessionId, current)
+      // single-polygon and finger hole edits go as PATCH ops; a rejected
+      // patch falls back to the full PUT. chained to keep ops in order
+      const save = saveChainRef.current.then(async () => {
+        if (ops === null) return saveAll()
+        if (ops.length) await patchPolygons(sessionId, ops)
+      }).catch(() => saveAll())
+      saveChainRef.current = save.catch(() => {
+        // server state unknown, next save sends everything
+        savedPolygonsRef.current = null
+      })
+      return save
+    },
     [polygons, sessionId],
     300,
     { skipInitial: true }
   )
 
-  // clear status interval on unmount (if user navigates away mid-trace)
+  // clear status intervals on unmount (if user navigates away mid-trace)
   useEffect(() => {
     return () => {
       if (statusInterval.current) {
         clearInterval(statusInterval.current)
         statusInterval.current = null
       }
+      if (queueInterval.current) {
+        clearInterval(queueInterval.current)
+        queueInterval.current = null
+      }
     }
   }, [])
 
@@ -338,6 +436,16 @@ export default function TracePage() {
                   >
                     Gemini API{hasEnvKey && ' (configured)'}
                   </button>
+                  <button
+                    onClick={() => setProvider('local')}
+                    className={`px-3 py-1 rounded text-xs font-medium ${
+                      provider === 'local'
+                        ? 'bg-surface text-text-primary shadow-sm'
+                        : 'text-text-muted hover:text-text-primary'
+                    }`}
+                  >
+                    Local
+                  </button>
                   <button
                     onClick={() => setProvider('manual')}
                     className={`px-3 py-1 rounded text-xs font-medium ${
@@ -401,6 +509,21 @@ export default function TracePage() {
                 </>
               )}
 
+              {provider === 'local' && (
+                <>
+                  <p className="text-xs text-text-muted">
+                    Traces on the server with classical image processing, no API key or network needed.
+                    Works best with tools fully on the paper and soft shadows; labels are numbered.
+                  </p>
+                  {traceStatus && (
+                    <div className="flex items-center gap-2 text-xs text-text-muted">
+                      <Loader2 className="w-3.5 h-3.5 animate-spin text-blue-500" />
+                      <span>{traceStatus}</span>
+                    </div>
+                  )}
+                </>
+              )}
+
               {provider === 'manual' && (
                 <div className="space-y-3">
                   <div>
@@ -529,7 +652,7 @@ export default function TracePage() {
             </button>
           )}
 
-          {step === 'trace' && provider === 'google' && (
+          {step === 'trace' && provider !== 'manual' && (
             <button
               onClick={handleTrace}
               disabled={(provider === 'google' && !hasEnvKey && !apiKey.trim()) || processing}
@@ -595,6 +718,7 @@ export default function TracePage() {
           <PolygonEditor
             key={`${correctedImageUrl}-${imageVersion}`}
             imageUrl={`${getImageUrl(correctedImageUrl)}?v=${imageVersion}`}
+            tiles={tiles}
             polygons={polygons}
             onPolygonsChange={handlePolygonsChange}
             editable={step === 'edit'}
@@ -5,10 +5,12 @@ import { Upload } from 'lucide-react'
 
 interface Props {
   onUpload: (file: File) => void
+  // when set, several files can be picked or dropped at once
+  onUploadMany?: (files: File[]) => void
   disabled?: boolean
 }
 
-export function ImageUploader({ onUpload, disabled }: Props) {
+export function ImageUploader({ onUpload, onUploadMany, disabled }: Props) {
   const inputRef = useRef<HTMLInputElement>(null)
   const [isDragging, setIsDragging] = useState(false)
 
@@ -18,13 +20,19 @@ export function ImageUploader({ onUpload, disabled }: Props) {
     }
   }
 
-  function handleChange(e: React.ChangeEvent<HTMLInputElement>) {
-    const file = e.target.files?.[0]
-    if (file && !disabled) {
-      onUpload(file)
+  function handleFiles(files: File[]) {
+    if (disabled || files.length === 0) return
+    if (files.length > 1 && onUploadMany) {
+      onUploadMany(files)
+    } else {
+      onUpload(files[0])
     }
   }
 
+  function handleChange(e: React.ChangeEvent<HTMLInputElement>) {
+    handleFiles(Array.from(e.target.files ?? []))
+  }
+
   function handleDragOver(e: React.DragEvent) {
     e.preventDefault()
     if (!disabled) {
@@ -42,10 +50,7 @@ export function ImageUploader({ onUpload, disabled }: Props) {
     setIsDragging(false)
     if (disabled) return
 
-    const file = e.dataTransfer.files?.[0]
-    if (file && file.type.startsWith('image/')) {
-      onUpload(file)
-    }
+    handleFiles(Array.from(e.dataTransfer.files ?? []).filter(f => f.type.startsWith('image/')))
   }
 
   return (
@@ -65,6 +70,7 @@ export function ImageUploader({ onUpload, disabled }: Props) {
         ref={inputRef}
         type="file"
         accept="image/*"
+        multiple={!!onUploadMany}
         onChange={handleChange}
         className="hidden"
       />
@@ -1,13 +1,16 @@
 'use client'
 
 import { useState, useRef, useEffect, useCallback } from 'react'
-import type { Point, Polygon } from '@/types'
+import type { Point, Polygon, TilePyramid } from '@/types'
 import { Undo2, Redo2, Trash2, Plus, Minus, Move } from 'lucide-react'
 import { polygonPathData } from '@/lib/svg'
 import { useHistory } from '@/hooks/useHistory'
+import { TiledImage } from '@/components/TiledImage'
 
 interface Props {
   imageUrl: string
+  // deep-zoom pyramid of the same image; when present the full image is never downloaded
+  tiles?: TilePyramid | null
   polygons: Polygon[]
   onPolygonsChange: (polygons: Polygon[]) => void
   editable?: boolean
@@ -26,6 +29,7 @@ type DragState =
 
 export function PolygonEditor({
   imageUrl,
+  tiles,
   polygons,
   onPolygonsChange,
   editable = true,
@@ -61,6 +65,10 @@ export function PolygonEditor({
   )
 
   useEffect(() => {
+    if (tiles) {
+      setImageSize({ width: tiles.width, height: tiles.height })
+      return
+    }
     let cancelled = false
     const img = new Image()
     img.onload = () => {
@@ -69,7 +77,7 @@ export function PolygonEditor({
     }
     img.src = imageUrl
     return () => { cancelled = true }
-  }, [imageUrl])
+  }, [imageUrl, tiles])
 
   // fit image container to available space while preserving aspect ratio
   useEffect(() => {
@@ -379,12 +387,16 @@ export function PolygonEditor({
           style={fitted.width ? { width: fitted.width, height: fitted.height } : { width: '100%', aspectRatio: `${imageSize.width} / ${imageSize.height}` }}
           onClick={handleBackgroundClick}
         >
-        <img
-          src={imageUrl}
-          alt="Corrected"
-          className="w-full h-full pointer-events-none"
-          draggable={false}
-        />
+        {tiles ? (
+          <TiledImage tiles={tiles} displayWidth={fitted.width} alt="Corrected" />
+        ) : (
+          <img
+            src={imageUrl}
+            alt="Corrected"
+            className="w-full h-full pointer-events-none"
+            draggable={false}
+          />
+        )}
 
         <svg
           className="absolute inset-0 w-full h-full"
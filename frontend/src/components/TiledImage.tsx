@@ -0,0 +1,70 @@
+'use client'
+
+import { useEffect, useState } from 'react'
+import type { TilePyramid } from '@/types'
+import { getImageUrl } from '@/lib/api'
+
+interface Props {
+  tiles: TilePyramid
+  // on-screen size of the element, in css pixels
+  displayWidth: number
+  alt?: string
+}
+
+// pick the smallest dzi level that still covers the displayed size
+function pickLevel(tiles: TilePyramid, displayWidth: number): number {
+  const target = displayWidth * (window.devicePixelRatio || 1)
+  for (let level = 0; level <= tiles.max_level; level++) {
+    const scale = 2 ** (tiles.max_level - level)
+    if (Math.ceil(tiles.width / scale) >= target) return level
+  }
+  return tiles.max_level
+}
+
+export function TiledImage({ tiles, displayWidth, alt = '' }: Props) {
+  const [level, setLevel] = useState<number | null>(null)
+
+  useEffect(() => {
+    if (displayWidth > 0) setLevel(pickLevel(tiles, displayWidth))
+  }, [tiles, displayWidth])
+
+  const base = getImageUrl(`/storage/${tiles.path}`)
+  const scale = level === null ? 1 : 2 ** (tiles.max_level - level)
+  const levelW = Math.ceil(tiles.width / scale)
+  const levelH = Math.ceil(tiles.height / scale)
+  const cols = Math.ceil(levelW / tiles.tile_size)
+  const rows = Math.ceil(levelH / tiles.tile_size)
+
+  return (
+    <div className="relative w-full h-full pointer-events-none">
+      {/* small preview paints first, tiles fill in detail on top */}
+      <img
+        src={`${base}/preview.webp`}
+        alt={alt}
+        className="absolute inset-0 w-full h-full"
+        draggable={false}
+      />
+      {level !== null && Array.from({ length: rows * cols }, (_, i) => {
+        const col = i % cols
+        const row = Math.floor(i / cols)
+        const x = col * tiles.tile_size
+        const y = row * tiles.tile_size
+        return (
+          <img
+            key={`${level}-${col}-${row}`}
+            src={`${base}/image_files/${level}/${col}_${row}.webp`}
+            alt=""
+            className="absolute"
+            style={{
+              left: `${(x / levelW) * 100}%`,
+              top: `${(y / levelH) * 100}%`,
+              width: `${(Math.min(tiles.tile_size, levelW - x) / levelW) * 100}%`,
+              height: `${(Math.min(tiles.tile_size, levelH - y) / levelH) * 100}%`,
+            }}
+            draggable={false}
+          />
+        )
+      })}
+    </div>
+  )
+}
@@ -1,7 +1,9 @@
 import type {
   UploadResponse,
+  BatchUploadResult,
   CornersResponse,
   TraceResponse,
+  TraceStatus,
   GenerateResponse,
   Point,
   Polygon,
@@ -14,6 +16,8 @@ import type {
   BinSummary,
   PlacedTool,
   TextLabel,
+  PolygonOp,
+  PlacedToolOp,
 } from '@/types'
 
 export class ApiError extends Error {
@@ -65,6 +69,33 @@ export async function uploadImage(file: File): Promise<UploadResponse> {
   return fetchForm('/api/upload', formData)
 }
 
+// streams one result per image as the backend finishes it
+export async function uploadImages(
+  files: File[],
+  onResult: (result: BatchUploadResult) => void
+): Promise<void> {
+  const formData = new FormData()
+  for (const file of files) formData.append('images', file)
+  const res = await fetch(`${API_URL}/api/upload/batch`, { method: 'POST', body: formData })
+  if (!res.ok || !res.body) {
+    const err = await res.json().catch(() => ({ detail: 'request failed' }))
+    throw new ApiError(err.detail || 'request failed', res.status)
+  }
+  const reader = res.body.getReader()
+  const decoder = new TextDecoder()
+  let buffered = ''
+  for (;;) {
+    const { done, value } = await reader.read()
+    if (done) break
+    buffered += decoder.decode(value, { stream: true })
+    const lines = buffered.split('\n')
+    buffered = lines.pop() ?? ''
+    for (const line of lines) {
+      if (line.trim()) onResult(JSON.parse(line))
+    }
+  }
+}
+
 export async function setCorners(
   sessionId: string,
   corners: Point[],
@@ -82,18 +113,24 @@ export async function getAvailableKeys(): Promise<{ google: boolean }> {
 
 export async function traceTools(
   sessionId: string,
-  provider: 'google',
-  apiKey?: string
+  provider: 'google' | 'local',
+  apiKey?: string,
+  refresh = false
 ): Promise<TraceResponse> {
   return fetchApi(`/api/sessions/${sessionId}/trace`, {
     method: 'POST',
     body: JSON.stringify({
       provider,
       api_key: apiKey || null,
+      refresh,
     }),
   })
 }
 
+export async function getTraceStatus(sessionId: string): Promise<TraceStatus> {
+  return fetchApi(`/api/sessions/${sessionId}/trace-status`)
+}
+
 export async function updatePolygons(
   sessionId: string,
   polygons: Polygon[]
@@ -104,6 +141,17 @@ export async function updatePolygons(
   })
 }
 
+export async function patchPolygons(
+  sessionId: string,
+  ops: PolygonOp[],
+  target: 'polygons' | 'layout' = 'polygons'
+): Promise<void> {
+  await fetchApi(`/api/sessions/${sessionId}/polygons`, {
+    method: 'PATCH',
+    body: JSON.stringify({ ops, target }),
+  })
+}
+
 export async function generateStl(
   sessionId: string,
   config: BinConfig,
@@ -238,6 +286,13 @@ export async function updateBin(
   })
 }
 
+export async function patchPlacedTools(binId: string, ops: PlacedToolOp[]): Promise<void> {
+  await fetchApi(`/api/bins/${binId}/placed-tools`, {
+    method: 'PATCH',
+    body: JSON.stringify({ ops }),
+  })
+}
+
 export async function deleteBin(binId: string): Promise<void> {
   await fetchApi(`/api/bins/${binId}`, { method: 'DELETE' })
 }
@@ -0,0 +1,123 @@
+import type { FingerHole, FingerHoleOp, PlacedTool, PlacedToolOp, Point, Polygon, PolygonOp } from '@/types'
+
+// edits are re-derived from before/after snapshots, so float noise from the
+// editor's own maths must not turn a move into a full update
+const EPS = 1e-6
+
+const same = (a: unknown, b: unknown) => JSON.stringify(a) === JSON.stringify(b)
+
+function near(a: Point[], b: Point[], map: (p: Point) => Point): boolean {
+  if (a.length !== b.length) return false
+  return a.every((p, i) => {
+    const q = map(p)
+    return Math.abs(q.x - b[i].x) < EPS && Math.abs(q.y - b[i].y) < EPS
+  })
+}
+
+// true when b is a with every point (outline, rings, finger hole centres)
+// passed through map and nothing else changed
+function mapped(a: PlacedTool, b: PlacedTool, map: (p: Point) => Point): boolean {
+  if (a.finger_holes.length !== b.finger_holes.length) return false
+  if ((a.interior_rings ?? []).length !== (b.interior_rings ?? []).length) return false
+  return near(a.points, b.points, map)
+    && (a.interior_rings ?? []).every((ring, i) => near(ring, b.interior_rings[i], map))
+    && a.finger_holes.every((fh, i) => {
+      const other = b.finger_holes[i]
+      return fh.id === other.id
+        && same({ ...fh, x: 0, y: 0 }, { ...other, x: 0, y: 0 })
+        && near([fh], [other], map)
+    })
+}
+
+function fingerHoleOps(targetId: string, a: FingerHole[], b: FingerHole[]): FingerHoleOp[] {
+  const before = new Map(a.map(fh => [fh.id, fh]))
+  const after = new Set(b.map(fh => fh.id))
+  const ops: FingerHoleOp[] = a
+    .filter(fh => !after.has(fh.id))
+    .map(fh => ({ op: 'remove_finger_hole', target_id: targetId, finger_hole_id: fh.id }))
+  for (const fh of b) {
+    const old = before.get(fh.id)
+    if (!old) ops.push({ op: 'add_finger_hole', target_id: targetId, finger_hole: fh })
+    else if (!same(old, fh)) ops.push({ op: 'update_finger_hole', target_id: targetId, finger_hole: fh })
+  }
+  return ops
+}
+
+// the server applies removes in place and appends adds; any other reordering
+// can't be expressed as ops
+function keepsOrder<T extends { id: string }>(prev: T[], next: T[]): boolean {
+  const nextIds = new Set(next.map(item => item.id))
+  const kept = prev.filter(item => nextIds.has(item.id)).map(item => item.id)
+  return next.slice(0, kept.length).every((item, i) => item.id === kept[i])
+}
+
+function withoutHoles<T extends { finger_holes: FingerHole[] }>(item: T) {
+  return { ...item, finger_holes: [] }
+}
+
+/** ops turning prev into next, or null if only a full save can express it */
+export function diffPolygons(prev: Polygon[], next: Polygon[]): PolygonOp[] | null {
+  if (!keepsOrder(prev, next)) return null
+  const before = new Map(prev.map(p => [p.id, p]))
+  const nextIds = new Set(next.map(p => p.id))
+  const ops: PolygonOp[] = prev
+    .filter(p => !nextIds.has(p.id))
+    .map(p => ({ op: 'remove_polygon', polygon_id: p.id }))
+  for (const p of next) {
+    const old = before.get(p.id)
+    if (!old) ops.push({ op: 'add_polygon', polygon: p })
+    else if (same(withoutHoles(old), withoutHoles(p))) ops.push(...fingerHoleOps(p.id, old.finger_holes, p.finger_holes))
+    else ops.push({ op: 'update_polygon', polygon: p })
+  }
+  return ops
+}
+
+/** ops turning prev into next, or null if only a full save can express it.
+ * moves and rotations are recognised from the geometry, so a drag sends a
+ * few numbers instead of the tool's outline. */
+export function diffPlacedTools(prev: PlacedTool[], next: PlacedTool[]): PlacedToolOp[] | null {
+  if (!keepsOrder(prev, next)) return null
+  const before = new Map(prev.map(t => [t.id, t]))
+  const nextIds = new Set(next.map(t => t.id))
+  const ops: PlacedToolOp[] = prev
+    .filter(t => !nextIds.has(t.id))
+    .map(t => ({ op: 'remove_tool', placed_tool_id: t.id }))
+  for (const t of next) {
+    const old = before.get(t.id)
+    if (!old) {
+      ops.push({ op: 'add_tool', placed_tool: t })
+      continue
+    }
+    if (same(old, t)) continue
+    const geometry = { points: [], finger_holes: [], interior_rings: [], rotation: 0 }
+    if (!same({ ...old, ...geometry }, { ...t, ...geometry }) || !old.points.length) return null
+
+    if (same(withoutHoles(old), withoutHoles(t))) {
+      ops.push(...fingerHoleOps(t.id, old.finger_holes, t.finger_holes))
+      continue
+    }
+    const dx = t.points[0].x - old.points[0].x
+    const dy = t.points[0].y - old.points[0].y
+    if (old.rotation === t.rotation && mapped(old, t, p => ({ x: p.x + dx, y: p.y + dy }))) {
+      ops.push({ op: 'move', placed_tool_id: t.id, dx, dy })
+      continue
+    }
+    // the editor rotates about the centroid, which rotation leaves in place
+    const cx = old.points.reduce((s, p) => s + p.x, 0) / old.points.length
+    const cy = old.points.reduce((s, p) => s + p.y, 0) / old.points.length
+    const angle = t.rotation - old.rotation
+    const rad = angle * Math.PI / 180
+    const cos = Math.cos(rad)
+    const sin = Math.sin(rad)
+    const rotate = (p: Point) => ({
+      x: cx + (p.x - cx) * cos - (p.y - cy) * sin,
+      y: cy + (p.x - cx) * sin + (p.y - cy) * cos,
+    })
+    if (mapped(old, t, rotate)) {
+      ops.push({ op: 'rotate', placed_tool_id: t.id, angle, cx, cy })
+      continue
+    }
+    return null
+  }
+  return ops
+}
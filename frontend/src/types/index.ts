@@ -39,14 +39,26 @@ export interface Layout {
   text_labels: TextLabel[]
 }
 
+export interface TilePyramid {
+  path: string
+  version: string
+  width: number
+  height: number
+  tile_size: number
+  max_level: number
+}
+
 export interface Session {
   id: string
   name: string | null
   description: string | null
   tags: string[]
   created_at: string | null
+  upload_status?: 'processing' | 'ready' | 'failed' | null
+  upload_error?: string | null
   original_image_path: string | null
   corrected_image_path: string | null
+  tiles?: TilePyramid | null
   mask_image_path: string | null
   corners: Point[] | null
   paper_size: 'a4' | 'letter' | null
@@ -69,8 +81,15 @@ export interface SessionSummary {
 
 export interface UploadResponse {
   session_id: string
-  image_url: string
-  detected_corners: Point[] | null
+  status: 'processing' | 'ready' | 'failed'
+}
+
+export interface BatchUploadResult {
+  index: number
+  filename: string | null
+  session_id: string | null
+  status: 'ready' | 'failed'
+  error: string | null
 }
 
 export interface CornersResponse {
@@ -83,6 +102,12 @@ export interface TraceResponse {
   mask_url: string | null
 }
 
+export interface TraceStatus {
+  state: 'idle' | 'queued' | 'running'
+  position: number | null
+  retry_in: number | null
+}
+
 export interface GenerateResponse {
   stl_url: string
   stl_urls?: string[]
@@ -116,6 +141,7 @@ export interface Tool {
   smooth_level: number
   source_session_id: string | null
   created_at: string | null
+  version?: number
 }
 
 export interface ToolSummary {
@@ -140,6 +166,7 @@ export interface PlacedTool {
   finger_holes: FingerHole[]
   interior_rings: Point[][]
   rotation: number
+  synced_version?: number | null
 }
 
 export interface BinData {
@@ -167,3 +194,22 @@ export interface BinSummary {
   grid_y: number
   preview_tools: BinPreviewTool[]
 }
+
+// op-based patches (PATCH /sessions/{id}/polygons, PATCH /bins/{id}/placed-tools)
+export type FingerHoleOp =
+  | { op: 'add_finger_hole'; target_id: string; finger_hole: FingerHole }
+  | { op: 'update_finger_hole'; target_id: string; finger_hole: FingerHole }
+  | { op: 'remove_finger_hole'; target_id: string; finger_hole_id: string }
+
+export type PolygonOp =
+  | { op: 'add_polygon'; polygon: Polygon }
+  | { op: 'update_polygon'; polygon: Polygon }
+  | { op: 'remove_polygon'; polygon_id: string }
+  | FingerHoleOp
+
+export type PlacedToolOp =
+  | { op: 'add_tool'; placed_tool: PlacedTool }
+  | { op: 'remove_tool'; placed_tool_id: string }
+  | { op: 'move'; placed_tool_id: string; dx: number; dy: number }
+  | { op: 'rotate'; placed_tool_id: string; angle: number; cx?: number; cy?: number }
+  | FingerHoleOp